@@ -1,9 +1,72 @@
+import time
+
 from fastapi import Header, HTTPException, status
+from fastapi.responses import JSONResponse
 from config import API_KEY
+from instrumentation import HTTP_REQUEST_SECONDS
 
 async def verify_api_key(x_api_key: str = Header(None)):
     if x_api_key != API_KEY:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid or missing API key",
-        )
\ No newline at end of file
+        )
+
+class UploadSizeLimitMiddleware:
+    """
+    Rejects /upload requests whose Content-Length is already over the limit
+    with 413, before Starlette receives and spools the multipart body.
+    Bodies without a Content-Length are caught by the byte count while streaming.
+    """
+
+    # headroom for multipart boundaries and part headers
+    MULTIPART_OVERHEAD = 64 * 1024
+
+    def __init__(self, app, max_bytes: int, path: str = "/upload"):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == self.path:
+            length = dict(scope["headers"]).get(b"content-length")
+            if length is not None and length.isdigit() and int(length) > self.max_bytes + self.MULTIPART_OVERHEAD:
+                response = JSONResponse(
+                    status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+                    content={"detail": f"Upload exceeds the limit of {self.max_bytes} bytes."},
+                )
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+class RequestMetricsMiddleware:
+    """
+    Records every HTTP request in the invoice_api_request_seconds histogram,
+    labelled with the route template (/job/{job_id}, not the concrete path).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.labels(
+                scope["method"], getattr(route, "path", "unmatched"), str(status_code)
+            ).observe(time.perf_counter() - start)
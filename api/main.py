@@ -1,11 +1,28 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Depends
-from api.routes import upload, process, job, health
-from api.dependencies import verify_api_key
+from api.routes import upload, process, job, usage, health, metrics
+from api.dependencies import verify_api_key, UploadSizeLimitMiddleware, RequestMetricsMiddleware
+from config import MAX_UPLOAD_BYTES
+from api.redis_client import init_redis, close_redis, close_async_redis
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_redis()  # shared, pooled Redis client for all routes
+    yield
+    await close_async_redis()
+    close_redis()
+
 
-app = FastAPI(title="Invoice Extraction API")
+app = FastAPI(title="Invoice Extraction API", lifespan=lifespan)
+app.add_middleware(UploadSizeLimitMiddleware, max_bytes=MAX_UPLOAD_BYTES)
+app.add_middleware(RequestMetricsMiddleware)  # outermost: also times requests rejected by the size limit
 
 # Apply to all routers
 app.include_router(upload.router, dependencies=[Depends(verify_api_key)])
 app.include_router(process.router, dependencies=[Depends(verify_api_key)])
 app.include_router(job.router, dependencies=[Depends(verify_api_key)])
-app.include_router(health.router)
\ No newline at end of file
+app.include_router(usage.router, dependencies=[Depends(verify_api_key)])
+app.include_router(health.router)
+app.include_router(metrics.router)
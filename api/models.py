@@ -1,10 +1,22 @@
-from pydantic import BaseModel
+from typing import Literal
+
+from pydantic import BaseModel, Field
 
 class ProcessRequest(BaseModel):
     file_id: str
+    force: bool = False  # bypass the content-hash dedup index and always reprocess
+    # high: front of the fast queue; low: bulk queue; unset/normal: routed by page count and size
+    priority: Literal["high", "normal", "low"] | None = None
 
 class JobStatusResponse(BaseModel):
     job_id: str
     status: str
     result: dict | None = None
-    error: str | None = None
\ No newline at end of file
+    error: str | None = None
+    progress: dict | None = None  # latest stage event: {"id", "event", "data", "ts"}
+
+class JobsStatusRequest(BaseModel):
+    job_ids: list[str] = Field(min_length=1, max_length=500)
+
+class JobsStatusResponse(BaseModel):
+    jobs: list[JobStatusResponse]
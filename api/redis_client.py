@@ -0,0 +1,73 @@
+import os
+import threading
+
+from redis import ConnectionPool, Redis
+from redis.asyncio import ConnectionPool as AsyncConnectionPool, Redis as AsyncRedis
+from rq import Queue
+
+# One connection pool per API process, created at startup (see api/main.py).
+# Route handlers borrow connections from it instead of opening a new one per request.
+_lock = threading.Lock()
+_redis: Redis | None = None
+_queues: dict[str, Queue] = {}
+# Separate asyncio client for long-lived waits (SSE, ?wait= long-poll): a blocked
+# XREAD then parks a coroutine instead of holding a threadpool thread.
+_async_redis: AsyncRedis | None = None
+
+
+def init_redis() -> Redis:
+    global _redis
+    with _lock:
+        if _redis is None:
+            pool = ConnectionPool.from_url(
+                os.environ["REDIS_URL"],  # fail fast if missing
+                max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", "50")),
+                health_check_interval=30,
+                socket_keepalive=True,
+            )
+            _redis = Redis(connection_pool=pool)
+        return _redis
+
+
+def get_redis() -> Redis:
+    return _redis or init_redis()
+
+
+def get_queue(name: str) -> Queue:
+    queue = _queues.get(name)
+    if queue is None:
+        with _lock:
+            queue = _queues.setdefault(name, Queue(name, connection=get_redis()))
+    return queue
+
+
+def close_redis() -> None:
+    global _redis
+    with _lock:
+        if _redis is not None:
+            _redis.connection_pool.disconnect()
+            _redis = None
+        _queues.clear()
+
+
+def get_async_redis() -> AsyncRedis:
+    # created on first use, i.e. on the server's event loop
+    global _async_redis
+    if _async_redis is None:
+        pool = AsyncConnectionPool.from_url(
+            os.environ["REDIS_URL"],
+            # one connection per waiting client while its XREAD blocks
+            max_connections=int(os.getenv("REDIS_MAX_STREAM_CONNECTIONS", "500")),
+            health_check_interval=30,
+            socket_keepalive=True,
+        )
+        _async_redis = AsyncRedis(connection_pool=pool)
+    return _async_redis
+
+
+async def close_async_redis() -> None:
+    global _async_redis
+    if _async_redis is not None:
+        await _async_redis.aclose()
+        await _async_redis.connection_pool.disconnect()
+        _async_redis = None
@@ -1,39 +1,207 @@
-import os
-from fastapi import APIRouter
-from redis import Redis
+import asyncio
+import json
+import time
+
+from fastapi import APIRouter, Header, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from rq.job import Job
 from rq.exceptions import NoSuchJobError
+from rq.results import Result
 
-from api.models import JobStatusResponse
+from api.models import JobStatusResponse, JobsStatusRequest, JobsStatusResponse
+from api.redis_client import get_async_redis, get_redis
+from jobs.dedup_index import ACTIVE_STATUSES, DedupIndex
+from jobs.progress import TERMINAL_EVENTS, decode_event, events_key
 
 router = APIRouter()
 
+MAX_WAIT_SECONDS = 60
+SSE_KEEPALIVE_MS = 15_000
+SSE_BATCH = 100
+# process_file publishes finished/failed just before RQ stores the job's result
+SETTLE_SECONDS = 5
 
-def get_redis_conn() -> Redis:
-    return Redis.from_url(os.environ["REDIS_URL"])
 
+def _error_line(exc_string: str | None) -> str | None:
+    # keep it short; full traceback is in Redis and logs
+    if not exc_string:
+        return None
+    # last line usually contains the exception type/message
+    return exc_string.splitlines()[-1]
 
-@router.get("/job/{job_id}", response_model=JobStatusResponse)
-async def get_job(job_id: str):
-    redis_conn = get_redis_conn()
+
+def _status_payload(job_id: str, status: str, result=None, exc_string: str | None = None, progress=None) -> dict:
+    if status == "finished":
+        return {"job_id": job_id, "status": "finished", "result": result, "progress": progress}
+    if status == "failed":
+        return {"job_id": job_id, "status": "failed", "error": _error_line(exc_string), "progress": progress}
+    # queued / started / deferred / scheduled
+    return {"job_id": job_id, "status": status, "result": None, "progress": progress}
+
+
+def _latest_event(reply) -> dict | None:
+    # reply of XREVRANGE job:{id}:events + - COUNT 1
+    return decode_event(*reply[0]) if reply else None
+
+
+def _not_found_payload(job_id: str) -> dict:
+    # the RQ job may have expired while its result lives on in the dedup index
+    cached = DedupIndex(get_redis()).result_for_job(job_id)
+    if cached is not None:
+        return _status_payload(job_id, "finished", result=cached["result"])
+    return {"job_id": job_id, "status": "not_found", "result": None}
+
+
+def _job_status(job_id: str) -> dict:
+    # blocking Redis calls: run in the threadpool
+    redis_conn = get_redis()
 
     try:
         job = Job.fetch(job_id, connection=redis_conn)
     except NoSuchJobError:
-        return {"job_id": job_id, "status": "not_found", "result": None}
+        return _not_found_payload(job_id)
 
     status = job.get_status()  # 'queued', 'started', 'finished', 'failed', etc.
+    progress = _latest_event(redis_conn.xrevrange(events_key(job_id), "+", "-", count=1))
 
     if status == "finished":
-        return {"job_id": job_id, "status": "finished", "result": job.result}
-
+        return _status_payload(job_id, status, result=job.return_value(), progress=progress)
     if status == "failed":
-        # keep it short; full traceback is in Redis and logs
-        err = None
-        if job.exc_info:
-            # first line usually contains the exception type/message
-            err = job.exc_info.splitlines()[-1]
-        return {"job_id": job_id, "status": "failed", "error": err}
+        result = job.latest_result()
+        return _status_payload(job_id, status, exc_string=result.exc_string if result else None, progress=progress)
+    return _status_payload(job_id, status, progress=progress)
 
-    # queued / started / deferred / scheduled
-    return {"job_id": job_id, "status": status, "result": None}
\ No newline at end of file
+
+async def _rq_status(aredis, job_id: str) -> str | None:
+    raw = await aredis.hget(Job.key_for(job_id), "status")
+    return raw.decode() if raw else None
+
+
+async def _settle(aredis, job_id: str) -> None:
+    """After a finished/failed event, wait (briefly) for RQ to mark the job done."""
+    deadline = time.monotonic() + SETTLE_SECONDS
+    while await _rq_status(aredis, job_id) in ACTIVE_STATUSES and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+
+
+async def _wait_for_change(job_id: str, timeout: float) -> None:
+    """Return on the job's next stage event, or after `timeout` seconds; at once if it is not active."""
+    aredis = get_async_redis()
+    key = events_key(job_id)
+    async with aredis.pipeline(transaction=False) as pipe:
+        pipe.xrevrange(key, "+", "-", count=1)
+        pipe.hget(Job.key_for(job_id), "status")
+        latest, status = await pipe.execute()
+    if status is None or status.decode() not in ACTIVE_STATUSES:
+        return
+
+    # everything after the latest event we have seen counts as a change (no lost wake-ups)
+    last_id = latest[0][0] if latest else "0-0"
+    reply = await aredis.xread({key: last_id}, count=1, block=max(1, int(timeout * 1000)))
+    if reply and decode_event(*reply[0][1][0])["event"] in TERMINAL_EVENTS:
+        await _settle(aredis, job_id)
+
+
+@router.get("/job/{job_id}", response_model=JobStatusResponse)
+async def get_job(
+    job_id: str,
+    wait: float = Query(0, ge=0, le=MAX_WAIT_SECONDS, description="Long-poll: hold the request until the next state change, up to this many seconds"),
+):
+    if wait:
+        await _wait_for_change(job_id, wait)
+    return await run_in_threadpool(_job_status, job_id)
+
+
+def _sse(event: str, data: dict, event_id: str | None = None) -> str:
+    head = f"id: {event_id}\n" if event_id else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _event_stream(job_id: str, last_id: str):
+    aredis = get_async_redis()
+    key = events_key(job_id)
+    block = None  # the first read returns the backlog without waiting
+    saw_terminal = False
+    while True:
+        # status first: once RQ says done, every event of the job is already in the stream
+        done = await _rq_status(aredis, job_id) not in ACTIVE_STATUSES  # None: unknown / expired job
+        reply = await aredis.xread({key: last_id}, count=SSE_BATCH, block=None if done else block)
+        entries = reply[0][1] if reply else []
+        for entry_id, fields in entries:
+            event = decode_event(entry_id, fields)
+            last_id = event["id"]
+            saw_terminal = saw_terminal or event["event"] in TERMINAL_EVENTS
+            yield _sse(event["event"], event["data"], event["id"])
+
+        if len(entries) == SSE_BATCH:
+            block = None  # more backlog to replay
+            continue
+        if done or saw_terminal:
+            if not done:
+                await _settle(aredis, job_id)
+            yield _sse("status", await run_in_threadpool(_job_status, job_id))
+            return
+        if not entries and block:
+            yield ": keep-alive\n\n"
+        block = SSE_KEEPALIVE_MS
+
+
+@router.get("/job/{job_id}/events")
+async def job_events(job_id: str, last_event_id: str | None = Header(None)):
+    """
+    Server-sent events for one job: stage events (started, ocr_done,
+    analysis_done, subdocument_extracted, finished/failed) as process_file
+    publishes them, then a final `status` event with the GET /job/{job_id}
+    payload. Reconnecting clients send Last-Event-ID and only get what they missed.
+    """
+    return StreamingResponse(
+        _event_stream(job_id, last_event_id or "0-0"),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/jobs/status", response_model=JobsStatusResponse)
+def get_jobs_status(req: JobsStatusRequest):
+    """
+    Status (and result) of many jobs in one pipelined round-trip: the job hashes,
+    the latest entry of each job's result stream and its latest stage event are
+    fetched together.
+    """
+    redis_conn = get_redis()
+
+    with redis_conn.pipeline(transaction=False) as pipe:
+        for job_id in req.job_ids:
+            pipe.hgetall(Job.key_for(job_id))
+            pipe.xrevrange(Result.get_key(job_id), "+", "-", count=1)
+            pipe.xrevrange(events_key(job_id), "+", "-", count=1)
+        replies = pipe.execute()
+
+    jobs = []
+    for i, job_id in enumerate(req.job_ids):
+        raw_job, raw_result, raw_event = replies[3 * i: 3 * i + 3]
+        if not raw_job:
+            jobs.append(_not_found_payload(job_id))
+            continue
+
+        job = Job(job_id, connection=redis_conn)
+        job.restore(raw_job)
+        status = job.get_status(refresh=False)
+
+        result = None
+        if raw_result:
+            result_id, payload = raw_result[0]
+            result = Result.restore(job_id, result_id.decode(), payload, connection=redis_conn, serializer=job.serializer)
+
+        jobs.append(
+            _status_payload(
+                job_id,
+                status,
+                result=result.return_value if result and result.type == Result.Type.SUCCESSFUL else None,
+                exc_string=result.exc_string if result and result.type == Result.Type.FAILED else None,
+                progress=_latest_event(raw_event),
+            )
+        )
+
+    return {"jobs": jobs}
@@ -0,0 +1,11 @@
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+from instrumentation import metrics_registry
+
+router = APIRouter()
+
+@router.get("/metrics")
+def metrics():
+    # Prometheus scrape endpoint; like /healthz it is not behind the API key
+    return Response(generate_latest(metrics_registry()), media_type=CONTENT_TYPE_LATEST)
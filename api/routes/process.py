@@ -1,29 +1,147 @@
 import os
-from fastapi import APIRouter
-from redis import Redis
-from rq import Queue
+import uuid
+from datetime import timedelta
+from fastapi import APIRouter, HTTPException, status
+from rq import Retry
+from rq.job import Job
+from rq.exceptions import NoSuchJobError
 
-from jobs.tasks import process_file
+from jobs.dedup_index import ACTIVE_STATUSES, DedupIndex, dedup_enabled, pipeline_version
+from jobs.queues import QUEUE_NAME, QueueRouter, Route, UploadInfo
+from jobs.usage_ledger import BudgetDecision, BudgetGuard, UsageLedger
 from api.models import ProcessRequest
+from api.redis_client import get_queue, get_redis
 
 router = APIRouter()
 
-QUEUE_NAME = os.getenv("RQ_QUEUE_NAME", "invoice-jobs")
+# Enqueued by dotted path: the worker imports the pipeline, the API never has to
+PROCESS_FILE_TASK = "jobs.tasks.process_file"
+# A failed job runs again after these delays (seconds; the last one repeats), resuming
+# from its stage checkpoint instead of redoing OCR/analysis/rendering (jobs/checkpoint.py)
+JOB_RETRY_INTERVALS = [int(s) for s in os.getenv("JOB_RETRY_INTERVALS", "30,120").split(",") if s.strip()]
+JOB_MAX_RETRIES = int(os.getenv("JOB_MAX_RETRIES", str(len(JOB_RETRY_INTERVALS))))
 
 
-def get_queue() -> Queue:
-    redis_url = os.environ["REDIS_URL"]  # fail fast if missing
-    redis_conn = Redis.from_url(redis_url)
-    return Queue(QUEUE_NAME, connection=redis_conn)
+def _claim_ttl(route: Route) -> int:
+    """How long a job may hold its dedup claim over all its attempts, scheduling delays aside."""
+    return route.job_timeout * (JOB_MAX_RETRIES + 1) + sum(JOB_RETRY_INTERVALS[:JOB_MAX_RETRIES])
+
+
+def _active_job(job_id: str) -> tuple[str, str] | None:
+    """(status, queue) of a job that is still queued or running."""
+    try:
+        job = Job.fetch(job_id, connection=get_redis())
+    except NoSuchJobError:
+        return None
+    status = job.get_status()
+    return (status, job.origin) if status in ACTIVE_STATUSES else None
+
+
+def _route(req: ProcessRequest) -> Route:
+    """Queue and timeout from the page count / size recorded at upload (see jobs/queues.py)."""
+    info = UploadInfo(get_redis()).get(req.file_id) or {}
+    # uploads recorded before "is_pdf" existed: go by content type / extension
+    is_pdf = info.get("is_pdf")
+    if is_pdf is None:
+        is_pdf = info.get("content_type") == "application/pdf" or req.file_id.lower().endswith(".pdf")
+    return QueueRouter.from_env().route(info.get("pages"), info.get("size"), req.priority, is_pdf=is_pdf)
+
+
+def _budget_decision() -> BudgetDecision | None:
+    """None when a new job may start now (see BudgetGuard for the env knobs)."""
+    guard = BudgetGuard.from_env(UsageLedger(get_redis()))
+    return guard.check() if guard is not None else None
+
+
+def _admission_delay(decision: BudgetDecision | None) -> int:
+    """Seconds to hold a new job back (0: start now); 429 when the guard rejects."""
+    if decision is None:
+        return 0
+    if decision.action == "reject":
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Not accepting new jobs: {decision.reason}",
+            headers={"Retry-After": str(decision.retry_after)},
+        )
+    print(f"Deferring new job by {decision.retry_after}s: {decision.reason}")
+    return decision.retry_after
+
+
+def _enqueue(file_id: str, route: Route, delay: int, **kwargs) -> Job:
+    queue = get_queue(route.queue_class.queue)
+    kwargs.update(
+        job_timeout=route.job_timeout,
+        result_ttl=3600,
+        failure_ttl=3600,
+        at_front=route.at_front,
+        # the worker labels its queue-wait metrics with the class
+        meta={"queue_class": route.queue_class.name},
+    )
+    if JOB_MAX_RETRIES > 0:
+        kwargs["retry"] = Retry(max=JOB_MAX_RETRIES, interval=JOB_RETRY_INTERVALS or 0)
+    if delay:
+        # scheduled job: moved to the queue by a worker's scheduler once the delay is over
+        return queue.enqueue_in(timedelta(seconds=delay), PROCESS_FILE_TASK, file_id, **kwargs)
+    return queue.enqueue(PROCESS_FILE_TASK, file_id, **kwargs)
 
 
 @router.post("/process")
-async def process_document(req: ProcessRequest):
-    queue = get_queue()
-    job = queue.enqueue(process_file, req.file_id, job_timeout=3600,result_ttl=3600,failure_ttl=3600)  # 1 hour timeout
+def process_document(req: ProcessRequest):
+    index = DedupIndex(get_redis()) if dedup_enabled() and not req.force else None
+    sha256 = index.sha_for_file(req.file_id) if index is not None else None
+
+    if sha256 is not None:
+        version = pipeline_version()
+
+        # 1) same bytes already processed with this pipeline version -> answer right away
+        cached = index.get_result(sha256, version)
+        if cached is not None:
+            return {
+                "job_id": cached["job_id"],
+                "status": "finished",
+                "queue": QUEUE_NAME,
+                "deduplicated": True,
+                "result": cached["result"],
+            }
+
+        # 2) same bytes currently being processed -> attach to that job instead of enqueueing
+        route = _route(req)
+        decision = _budget_decision()
+        # a deferred job keeps its in-flight claim until it can actually have run
+        claim_ttl = _claim_ttl(route) + (decision.retry_after if decision is not None else 0)
+        job_id = uuid.uuid4().hex
+        holder = index.claim(sha256, version, job_id, ttl=claim_ttl)
+        if holder is not None:
+            holder_job = _active_job(holder)
+            if holder_job is not None:
+                holder_status, holder_queue = holder_job
+                return {"job_id": holder, "status": holder_status, "queue": holder_queue, "deduplicated": True}
+            # stale marker (job failed or expired without releasing it) -> take over, unless
+            # a concurrent request found the same stale marker and replaced it first
+            winner = index.replace_claim(sha256, version, holder, job_id, ttl=claim_ttl)
+            if winner is not None:
+                # the winner may not be enqueued yet: it will be, on its route's queue
+                winner_status, winner_queue = _active_job(winner) or ("queued", route.queue_class.queue)
+                return {"job_id": winner, "status": winner_status, "queue": winner_queue, "deduplicated": True}
+
+        # 3) new work: only when the token/cost budget allows it
+        try:
+            delay = _admission_delay(decision)
+        except HTTPException:
+            index.release(sha256, version, job_id)
+            raise
+        job = _enqueue(req.file_id, route, delay, job_id=job_id)
+    else:
+        route = _route(req)
+        delay = _admission_delay(_budget_decision())
+        job = _enqueue(req.file_id, route, delay, force=req.force)
 
-    return {
+    response = {
         "job_id": job.get_id(),
-        "status": "queued",
-        "queue": QUEUE_NAME,
-    }
\ No newline at end of file
+        "status": "scheduled" if delay else "queued",
+        "queue": route.queue_class.queue,
+        "job_timeout": route.job_timeout,
+    }
+    if delay:
+        response["deferred_seconds"] = delay
+    return response
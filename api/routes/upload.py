@@ -1,16 +1,30 @@
-from fastapi import APIRouter, UploadFile, File
-from storage.file_storage import save_upload
+from fastapi import APIRouter, UploadFile, File, HTTPException, status
+from config import MAX_UPLOAD_BYTES
+from storage.file_storage import save_upload_stream, UploadTooLargeError
+from api.redis_client import get_redis
+from jobs.dedup_index import DedupIndex, dedup_enabled
+from jobs.queues import UploadInfo
 
 router = APIRouter()
 
+# Plain `def`: the body is copied to storage with blocking I/O, so it runs in the threadpool.
+# Starlette has already spooled the multipart file to disk; we stream it from there in chunks.
 @router.post("/upload")
-async def upload(file: UploadFile = File(...)):
-    file_bytes = await file.read()
+def upload(file: UploadFile = File(...)):
+    try:
+        result = save_upload_stream(
+            file.file,
+            original_filename=file.filename,
+            content_type=file.content_type,
+            max_bytes=MAX_UPLOAD_BYTES,
+        )
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=status.HTTP_413_CONTENT_TOO_LARGE, detail=str(e))
 
-    file_id = save_upload(
-        file_bytes,
-        original_filename=file.filename,
-        content_type=file.content_type,
-    )
+    # remember the content hash so /process can recognise resubmitted documents
+    if dedup_enabled():
+        DedupIndex(get_redis()).record_upload(result.file_id, result.sha256)
+    # ... and size / page count, which decide its queue and job timeout
+    UploadInfo(get_redis()).record(result.file_id, result.size, result.pages, file.content_type, result.is_pdf)
 
-    return {"file_id": file_id}
\ No newline at end of file
+    return {"file_id": result.file_id, "sha256": result.sha256, "size": result.size, "pages": result.pages}
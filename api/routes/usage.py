@@ -0,0 +1,39 @@
+from fastapi import APIRouter, HTTPException, Query
+
+from api.redis_client import get_redis
+from jobs.usage_ledger import BudgetGuard, UsageLedger
+
+router = APIRouter()
+
+
+@router.get("/usage")
+def get_usage(days: int = Query(7, ge=1, le=90)):
+    """Daily token/page/cost totals (UTC days, newest first), per model, plus the current budget state."""
+    ledger = UsageLedger(get_redis())
+    daily = ledger.days(days)
+    guard = BudgetGuard.from_env(ledger)
+    decision = guard.check() if guard is not None else None
+    return {
+        "days": daily,
+        "totals": {
+            name: round(sum(d[name] for d in daily), 6) if name == "cost_usd" else sum(d[name] for d in daily)
+            for name in ("jobs", "calls", "prompt_tokens", "completion_tokens", "total_tokens", "pages", "credits", "cost_usd")
+        },
+        "budget": None if guard is None else {
+            "daily_tokens": guard.daily_tokens,
+            "daily_cost_usd": guard.daily_cost_usd,
+            "tpm": guard.tpm,
+            "tokens_this_minute": ledger.tokens_this_minute(),
+            "admitting": decision is None,
+            "reason": decision.reason if decision is not None else None,
+        },
+    }
+
+
+@router.get("/usage/job/{job_id}")
+def get_job_usage(job_id: str):
+    """Per-call usage of one job (also for failed jobs, whose calls were paid for too)."""
+    usage = UsageLedger(get_redis()).job(job_id)
+    if usage is None:
+        raise HTTPException(status_code=404, detail="No usage recorded for this job")
+    return {"job_id": job_id, **usage}
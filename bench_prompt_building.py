@@ -0,0 +1,60 @@
+"""
+Micro-benchmark: per-call prompt build cost, original (re-read + re-parse the
+config on every call) vs. the compiled PromptRegistry.
+
+    python bench_prompt_building.py [--number 2000]
+"""
+import argparse
+import timeit
+
+from prompt_building.prompt_building import (
+    build_prompt_for_analyze_document,
+    build_prompt_for_analyze_document_uncached,
+    build_prompt_from_config,
+    build_prompt_from_config_uncached,
+    get_full_prompt,
+    get_full_prompt_uncached,
+    prompt_version,
+)
+
+OCR_TEXT = "| Pos | Leistung | GOT | Betrag |\n" * 80
+ANIMALS = [
+    {"name": "Bello", "species": "Hund", "breed": "Labrador"},
+    {"name": "Mia", "species": "Katze", "breed": ""},
+]
+
+CASES = [
+    (
+        "build_prompt_for_analyze_document",
+        lambda: build_prompt_for_analyze_document_uncached(markdown_text=OCR_TEXT),
+        lambda: build_prompt_for_analyze_document(markdown_text=OCR_TEXT),
+    ),
+    (
+        "build_prompt_from_config",
+        lambda: build_prompt_from_config_uncached(use_ocr=True, use_vision=True, ocr_text=OCR_TEXT, animal_information=ANIMALS),
+        lambda: build_prompt_from_config(use_ocr=True, use_vision=True, ocr_text=OCR_TEXT, animal_information=ANIMALS),
+    ),
+    (
+        "get_full_prompt",
+        lambda: get_full_prompt_uncached(ocr_text=OCR_TEXT, animal_information=ANIMALS),
+        lambda: get_full_prompt(ocr_text=OCR_TEXT, animal_information=ANIMALS),
+    ),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prompt build cost: uncached vs. PromptRegistry")
+    parser.add_argument("--number", type=int, default=2000, help="calls per measurement")
+    args = parser.parse_args()
+
+    print(f"prompt version: {prompt_version()}")
+    print(f"{'function':<36} {'before (us)':>12} {'after (us)':>12} {'speedup':>8}")
+    for name, before, after in CASES:
+        assert before() == after(), f"{name}: registry output differs from the original"
+        t_before = min(timeit.repeat(before, number=args.number, repeat=3)) / args.number * 1e6
+        t_after = min(timeit.repeat(after, number=args.number, repeat=3)) / args.number * 1e6
+        print(f"{name:<36} {t_before:>12.1f} {t_after:>12.1f} {t_before / t_after:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Throughput of the local tesseract engine (ocr/ocr_tesseract.py) in pages/sec,
+for several process pool sizes. Needs the tesseract binary and language data.
+
+    python bench_tesseract.py files/*.pdf [--workers 1,2,4] [--repeat 2]
+
+workers=1 renders and OCRs in-process, one page after the other. The first
+run of each pool size is a warm-up (pool start, imports) and is not timed.
+"""
+import argparse
+import os
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import fitz
+
+from ocr.ocr_tesseract import TesseractOCR, TesseractSettings
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="TesseractOCR pages/sec by worker count")
+    parser.add_argument("pdfs", nargs="+", help="PDF files to OCR")
+    parser.add_argument("--workers", default=",".join(str(n) for n in sorted({1, 2, cpus})), help="comma-separated pool sizes")
+    parser.add_argument("--repeat", type=int, default=2, help="timed runs per pool size (best is reported)")
+    args = parser.parse_args()
+
+    settings = TesseractSettings.from_env()
+    docs = [SimpleNamespace(local_input_path=Path(p)) for p in args.pdfs]
+    pages = 0
+    for doc in docs:
+        with fitz.open(doc.local_input_path) as pdf:
+            pages += len(pdf)
+    print(f"{len(docs)} documents, {pages} pages, lang={settings.lang} dpi={settings.dpi} ({cpus} CPUs)")
+    print(f"{'workers':>7} {'seconds':>9} {'pages/s':>9} {'speedup':>8}")
+
+    baseline = None
+    for workers in (int(n) for n in args.workers.split(",")):
+        engine = TesseractOCR(settings=settings, workers=workers)
+        try:
+            engine.extract_text(docs[0])  # warm-up
+            best = float("inf")
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                for doc in docs:
+                    engine.extract_text(doc)
+                best = min(best, time.perf_counter() - t0)
+        finally:
+            engine.close()
+        rate = pages / best
+        baseline = baseline or rate
+        print(f"{workers:>7} {best:>9.2f} {rate:>9.2f} {rate / baseline:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
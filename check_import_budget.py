@@ -0,0 +1,73 @@
+"""
+Import-time budget for the API process. Fails (exit code 1) when importing
+api.main takes longer than the budget, or when it pulls in any of the
+pipeline-only modules the web process never runs (fitz, PIL, openai, ...).
+
+    python check_import_budget.py                 # default budget
+    python check_import_budget.py --budget-ms 600 --runs 5
+
+Times come from `python -X importtime` (cumulative microseconds of api.main);
+the best of --runs fresh interpreters is used to keep noise out.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+MODULE = "api.main"
+# the worker needs these, the API must enqueue by dotted path instead of importing them
+FORBIDDEN = ["fitz", "pymupdf", "PIL", "openai", "landingai_ade", "boto3", "invoice", "jobs.tasks"]
+
+_PROBE = (
+    "import json, resource, sys\n"
+    f"import {MODULE}\n"
+    "print(json.dumps({\n"
+    f"    'loaded': [m for m in {FORBIDDEN!r} if m in sys.modules],\n"
+    "    'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,\n"
+    "}))\n"
+)
+
+
+def measure() -> dict:
+    env = dict(os.environ)
+    env.setdefault("REDIS_URL", "redis://localhost:6379/0")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PROBE],
+        env=env, capture_output=True, text=True, check=True,
+    )
+    match = re.search(rf"^import time:\s+\d+ \|\s+(\d+) \| {re.escape(MODULE)}$", proc.stderr, re.MULTILINE)
+    if match is None:
+        raise RuntimeError(f"No importtime line for {MODULE}:\n{proc.stderr[-2000:]}")
+    out = json.loads(proc.stdout.strip().splitlines()[-1])
+    out["import_ms"] = int(match.group(1)) / 1000
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=f"Import-time budget check for {MODULE}")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", "1000")))
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(args.runs)]
+    best = min(runs, key=lambda r: r["import_ms"])
+    loaded = sorted({m for r in runs for m in r["loaded"]})
+    print(f"{MODULE}: {best['import_ms']:.0f} ms (budget {args.budget_ms:.0f} ms), "
+          f"max RSS {best['max_rss_kb'] / 1024:.0f} MB")
+
+    failed = False
+    if best["import_ms"] > args.budget_ms:
+        print(f"FAIL: import time over budget by {best['import_ms'] - args.budget_ms:.0f} ms")
+        failed = True
+    if loaded:
+        print(f"FAIL: {MODULE} imports pipeline-only modules: {', '.join(loaded)}")
+        failed = True
+    if not failed:
+        print("OK")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
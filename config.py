@@ -6,4 +6,7 @@ os.makedirs(FILES_DIR, exist_ok=True)
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
 
-API_KEY = os.getenv("INVOICE_API_KEY", "changeme123")
\ No newline at end of file
+API_KEY = os.getenv("INVOICE_API_KEY", "changeme123")
+
+# Uploads above this size are rejected (413) before and while streaming to storage
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
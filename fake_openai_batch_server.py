@@ -0,0 +1,174 @@
+"""
+Minimal local stand-in for the OpenAI Files + Batch API, for exercising the
+batch backfill (jobs/batch_backfill.py) without an API key or cost.
+
+    python fake_openai_batch_server.py --port 8089
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=fake OPENAI_BATCH_POLL_INTERVAL=1 \
+        python -m jobs.batch_backfill some.pdf
+
+Batches go validating -> in_progress -> completed over consecutive polls.
+Analysis requests are answered with one invoice per "--- PAGE n ---" marker
+found in the prompt; extraction requests with a small fixed JSON object.
+Requests whose text contains FAKE_BATCH_FAIL get an error line instead.
+"""
+import argparse
+import json
+import re
+import time
+import uuid
+
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi.responses import PlainTextResponse
+
+app = FastAPI()
+
+_files: dict[str, dict] = {}
+_batches: dict[str, dict] = {}
+
+
+def _new_id(prefix: str) -> str:
+    return f"{prefix}-{uuid.uuid4().hex[:24]}"
+
+
+def _store_file(filename: str, purpose: str, content: bytes) -> dict:
+    file_id = _new_id("file")
+    _files[file_id] = {
+        "id": file_id,
+        "object": "file",
+        "bytes": len(content),
+        "created_at": int(time.time()),
+        "filename": filename,
+        "purpose": purpose,
+        "status": "processed",
+        "content": content,
+    }
+    return _files[file_id]
+
+
+def _public(file: dict) -> dict:
+    return {k: v for k, v in file.items() if k != "content"}
+
+
+def _prompt_text(body: dict) -> str:
+    content = body["messages"][0]["content"]
+    if isinstance(content, str):
+        return content
+    return "\n".join(block.get("text", "") for block in content if block.get("type") == "text")
+
+
+def _answer(body: dict) -> str:
+    content = body["messages"][0]["content"]
+    if isinstance(content, str):
+        # analysis call: every page becomes its own invoice
+        pages = sorted({int(n) for n in re.findall(r"--- PAGE (\d+) ---", content)}) or [1]
+        return json.dumps({"invoice_pages": {str(i + 1): [p] for i, p in enumerate(pages)}, "animals": []})
+    images = sum(1 for block in content if block.get("type") == "image_url")
+    return json.dumps({"fake_extraction": True, "images": images})
+
+
+def _complete(batch: dict) -> None:
+    lines = _files[batch["input_file_id"]]["content"].decode("utf-8").splitlines()
+    output, errors = [], []
+    for raw in lines:
+        if not raw.strip():
+            continue
+        req = json.loads(raw)
+        text = _prompt_text(req["body"])
+        if "FAKE_BATCH_FAIL" in text:
+            errors.append({
+                "id": _new_id("batch_req"),
+                "custom_id": req["custom_id"],
+                "response": {"status_code": 400, "request_id": _new_id("req"),
+                             "body": {"error": {"code": "fake_error", "message": "requested failure"}}},
+                "error": None,
+            })
+            continue
+        prompt_tokens = len(text) // 4 + 1
+        output.append({
+            "id": _new_id("batch_req"),
+            "custom_id": req["custom_id"],
+            "response": {
+                "status_code": 200,
+                "request_id": _new_id("req"),
+                "body": {
+                    "id": _new_id("chatcmpl"),
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": req["body"].get("model", "fake"),
+                    "choices": [{
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": _answer(req["body"])},
+                    }],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 20,
+                              "total_tokens": prompt_tokens + 20},
+                },
+            },
+            "error": None,
+        })
+
+    def jsonl(rows):
+        return "".join(json.dumps(r) + "\n" for r in rows).encode("utf-8")
+
+    batch["output_file_id"] = _store_file(f"{batch['id']}_output.jsonl", "batch_output", jsonl(output))["id"]
+    if errors:
+        batch["error_file_id"] = _store_file(f"{batch['id']}_errors.jsonl", "batch_output", jsonl(errors))["id"]
+    batch["request_counts"] = {"total": len(output) + len(errors), "completed": len(output), "failed": len(errors)}
+    batch["status"] = "completed"
+    batch["completed_at"] = int(time.time())
+
+
+@app.post("/v1/files")
+async def create_file(file: UploadFile = File(...), purpose: str = Form(...)):
+    return _public(_store_file(file.filename, purpose, await file.read()))
+
+
+@app.get("/v1/files/{file_id}/content")
+def file_content(file_id: str):
+    if file_id not in _files:
+        raise HTTPException(status_code=404, detail="No such file")
+    return PlainTextResponse(_files[file_id]["content"].decode("utf-8"))
+
+
+@app.post("/v1/batches")
+def create_batch(req: dict):
+    if req.get("input_file_id") not in _files:
+        raise HTTPException(status_code=400, detail="Unknown input_file_id")
+    batch_id = _new_id("batch")
+    _batches[batch_id] = {
+        "id": batch_id,
+        "object": "batch",
+        "endpoint": req["endpoint"],
+        "input_file_id": req["input_file_id"],
+        "completion_window": req.get("completion_window", "24h"),
+        "created_at": int(time.time()),
+        "metadata": req.get("metadata"),
+        "status": "validating",
+        "output_file_id": None,
+        "error_file_id": None,
+        "request_counts": {"total": 0, "completed": 0, "failed": 0},
+    }
+    return _batches[batch_id]
+
+
+@app.get("/v1/batches/{batch_id}")
+def retrieve_batch(batch_id: str):
+    batch = _batches.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="No such batch")
+    # advance one state per poll so clients see a realistic lifecycle
+    if batch["status"] == "validating":
+        batch["status"] = "in_progress"
+    elif batch["status"] == "in_progress":
+        _complete(batch)
+    return batch
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Fake OpenAI Batch API for local testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port)
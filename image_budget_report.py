@@ -0,0 +1,58 @@
+"""
+Compare vision payloads of the original rendering (300 DPI concatenated PNG)
+with an image policy, per PDF: encoded bytes and estimated OpenAI image tokens.
+
+    python image_budget_report.py 3C_testdaten_pdf/*.pdf --policy budget
+    IMAGE_FORMAT=webp IMAGE_QUALITY=70 python image_budget_report.py some.pdf --policy env
+"""
+import argparse
+
+import fitz  # PyMuPDF
+
+from rendering.image_policy import ImageBudgetReport, ImagePolicy, compose_images, legacy_image_size, render_page
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bytes/tokens of vision images: legacy vs. image policy")
+    parser.add_argument("pdfs", nargs="+", help="PDF files (each treated as one subdocument)")
+    parser.add_argument("--policy", choices=["budget", "legacy", "env"], default="budget")
+    args = parser.parse_args()
+
+    policy = {
+        "budget": ImagePolicy.budget,
+        "legacy": ImagePolicy.legacy,
+        "env": ImagePolicy.from_env,
+    }[args.policy]()
+    legacy = ImagePolicy.legacy()
+    print(f"Policy: {policy}")
+
+    report = ImageBudgetReport()
+    for pdf_path in args.pdfs:
+        with fitz.open(pdf_path) as doc:
+            pages = list(doc)
+            baseline = compose_images([render_page(p, legacy) for p in pages], legacy)
+            images = compose_images([render_page(p, policy) for p in pages], policy)
+            report.add(
+                pdf_path,
+                images,
+                policy.detail,
+                baseline_size=legacy_image_size(pages),
+                baseline_bytes=sum(len(i.data) for i in baseline),
+            )
+        e = report.entries[-1]
+        print(
+            f"{pdf_path}: {e['images']} image(s), {e['bytes'] / 1024:.0f} KiB "
+            f"(legacy {e['baseline_bytes'] / 1024:.0f} KiB), "
+            f"~{e['tokens']} tokens (legacy ~{e['baseline_tokens']})"
+        )
+
+    s = report.summary()
+    print(
+        f"\nTotal: {s['bytes'] / 1024:.0f} KiB vs {s['baseline_bytes'] / 1024:.0f} KiB "
+        f"(saved {s['bytes_saved'] / 1024:.0f} KiB), "
+        f"~{s['tokens']} vs ~{s['baseline_tokens']} image tokens (saved {s['tokens_saved']})"
+    )
+
+
+if __name__ == "__main__":
+    main()
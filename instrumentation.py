@@ -0,0 +1,180 @@
+# instrumentation.py
+"""
+Prometheus metrics shared by the API and the RQ workers, and per-job stage
+timings (what ends up in job.meta["timings"]).
+
+Metrics go to the default registry. With PROMETHEUS_MULTIPROC_DIR set (several
+uvicorn workers, forking RQ workers) every process writes its samples to that
+directory and metrics_registry() aggregates them. METRICS_PROCESS_ID pins the
+file a process writes to: RQ job processes are forked one at a time per worker,
+so they share their worker's file instead of leaving one file behind per job
+(a threaded worker runs its concurrent jobs in one process, which is the same).
+"""
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from prometheus_client import (
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    multiprocess,
+    push_to_gateway,
+    values,
+    write_to_textfile,
+)
+
+if os.getenv("PROMETHEUS_MULTIPROC_DIR") and os.getenv("METRICS_PROCESS_ID"):
+    # must happen before the first metric is created
+    values.ValueClass = values.MultiProcessValue(process_identifier=lambda: os.environ["METRICS_PROCESS_ID"])
+
+_SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+_BYTES_BUCKETS = (1e3, 1e4, 1e5, 5e5, 1e6, 5e6, 1e7, 5e7, 1e8)
+_PAGES_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+STAGE_SECONDS = Histogram(
+    "invoice_stage_seconds", "Wall time of one pipeline stage", ["stage"], buckets=_SECONDS_BUCKETS
+)
+STAGE_PAGES = Histogram(
+    "invoice_stage_pages", "Pages handled by one run of a pipeline stage", ["stage"], buckets=_PAGES_BUCKETS
+)
+EXTERNAL_CALL_SECONDS = Histogram(
+    "invoice_external_call_seconds",
+    "Latency of calls to external services (LandingAI, OpenAI, S3)",
+    ["service", "operation", "outcome"],
+    buckets=_SECONDS_BUCKETS,
+)
+EXTERNAL_CALL_BYTES = Histogram(
+    "invoice_external_call_bytes",
+    "Payload size of calls to external services",
+    ["service", "operation", "direction"],
+    buckets=_BYTES_BUCKETS,
+)
+EXTERNAL_CALL_RETRIES = Counter(
+    "invoice_external_call_retries",
+    "Retries of calls to external services, by what the failed attempt hit",
+    ["service", "operation", "reason"],
+)
+EXTERNAL_CALL_HEDGES = Counter(
+    "invoice_external_call_hedges",
+    "Hedged calls (a duplicate request was sent), by which request answered first",
+    ["service", "operation", "winner"],
+)
+CIRCUIT_BREAKER_TRANSITIONS = Counter(
+    "invoice_circuit_breaker_transitions", "Circuit breaker state changes", ["service", "state"]
+)
+OCR_PAGES = Counter(
+    "invoice_ocr_pages", "Document pages read, by where their text came from", ["source"]  # text_layer / ocr
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    "invoice_queue_wait_seconds",
+    "Time jobs spend queued before a worker starts them, by queue class",
+    ["queue_class"],
+    buckets=_SECONDS_BUCKETS,
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "invoice_api_request_seconds", "API request latency", ["method", "route", "status"], buckets=_SECONDS_BUCKETS
+)
+
+
+class StageTimings:
+    """Stage wall times of one job; thread-safe (subdocuments are extracted concurrently)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: dict[str, dict] = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            entry = self._stages.setdefault(stage, {"count": 0, "seconds": 0.0})
+            entry["count"] += 1
+            entry["seconds"] += seconds
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {stage: {"count": e["count"], "seconds": round(e["seconds"], 3)} for stage, e in self._stages.items()}
+
+
+def record_stage(stage: str, seconds: float, timings: Optional[StageTimings] = None, pages: Optional[int] = None) -> None:
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    if pages is not None:
+        STAGE_PAGES.labels(stage).observe(pages)
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+@contextmanager
+def timed_stage(stage: str, timings: Optional[StageTimings] = None, pages: Optional[int] = None):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start, timings, pages)
+
+
+class CallRecord:
+    __slots__ = ("received_bytes",)
+
+    def __init__(self):
+        self.received_bytes: Optional[int] = None
+
+
+@contextmanager
+def timed_call(service: str, operation: str, sent_bytes: Optional[int] = None):
+    """
+    Time one external call. Set `.received_bytes` on the yielded record to
+    also record the response size:
+
+        with timed_call("s3", "get") as call:
+            data = ...
+            call.received_bytes = len(data)
+    """
+    call = CallRecord()
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield call
+        outcome = "ok"
+    finally:
+        EXTERNAL_CALL_SECONDS.labels(service, operation, outcome).observe(time.perf_counter() - start)
+        if sent_bytes is not None:
+            EXTERNAL_CALL_BYTES.labels(service, operation, "sent").observe(sent_bytes)
+        if call.received_bytes is not None:
+            EXTERNAL_CALL_BYTES.labels(service, operation, "received").observe(call.received_bytes)
+
+
+def metrics_registry() -> CollectorRegistry:
+    """What /metrics and the worker exporters publish."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def export_worker_metrics() -> None:
+    """
+    Publish the worker's metrics after a job, to METRICS_TEXTFILE (node_exporter
+    textfile collector) and/or METRICS_PUSHGATEWAY (Prometheus Pushgateway URL).
+    """
+    textfile = os.getenv("METRICS_TEXTFILE")
+    gateway = os.getenv("METRICS_PUSHGATEWAY")
+    if not textfile and not gateway:
+        return
+    registry = metrics_registry()
+    try:
+        if textfile:
+            write_to_textfile(textfile, registry)
+        if gateway:
+            push_to_gateway(
+                gateway,
+                job=os.getenv("METRICS_JOB_NAME", "invoice-worker"),
+                grouping_key={"instance": socket.gethostname()},
+                registry=registry,
+            )
+    except Exception as e:
+        print(f"Could not export worker metrics: {e}")
@@ -1,19 +1,29 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
-import os
 import json
 import tempfile
+import asyncio
+import inspect
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator
+import time
 import fitz
-from PIL import Image
 from dotenv import load_dotenv
-from openai import OpenAI
+from instrumentation import StageTimings, record_stage, timed_call, timed_stage
+from jobs.checkpoint import CheckpointStore
+from jobs.usage_ledger import JobUsage
+from processors.openai_clients import get_openai_client, openai_policy, run_async
 import shutil
 from ocr.base_ocr import BaseOCREngine
-from utils import extract_json_from_response
+from utils import extract_json_from_response, sha256_file
 from prompt_building.prompt_building import build_prompt_for_analyze_document, get_full_prompt
 
+from rendering.image_policy import ImagePolicy, ImageBudgetReport, legacy_image_size
+from rendering.rasterizer import Rasterizer, fitz_lock, get_rasterizer
 from storage.storage import StorageBackend, LocalStorage, StorageKey
 
 load_dotenv()
@@ -29,6 +39,12 @@ class SubdocumentArtifact:
     md_key: StorageKey
     pdf_key: StorageKey
     image_key: StorageKey
+    # all images sent to the vision model (one per page when the image policy doesn't concatenate)
+    image_keys: list[StorageKey] = field(default_factory=list)
+
+    def __post_init__(self):
+        if not self.image_keys:
+            self.image_keys = [self.image_key]
 
 
 class Invoice:
@@ -39,17 +55,34 @@ class Invoice:
         storage: StorageBackend | None = None,
         work_dir: Path | None = None,
         output_prefix: str = "temp",  # where to put subdocs + outputs within the storage
+        image_policy: ImagePolicy | None = None,
+        rasterizer: Rasterizer | None = None,
+        on_subdocument_extracted: Callable[[int, SubdocumentArtifact, dict], None] | None = None,
+        timings: StageTimings | None = None,
+        usage: JobUsage | None = None,
+        checkpoints: CheckpointStore | None = None,
+        resume: bool = True,
     ):
         self.file_key = file_key
         self.ocr_engine = ocr_engine
         self.storage = storage or LocalStorage()
         self.output_prefix = output_prefix
+        self.image_policy = image_policy or ImagePolicy.from_env()
+        self.image_report = ImageBudgetReport()
+        self.rasterizer = rasterizer or get_rasterizer()
+        # per-stage wall times of this document (also exported as Prometheus histograms)
+        self.timings = timings or StageTimings()
+        # tokens / pages / cost of every external call made for this document
+        self.usage = usage or JobUsage()
+        # called with (index, subdoc, result) as each subdocument's extraction completes
+        self.on_subdocument_extracted = on_subdocument_extracted
 
         self.work_dir = work_dir or Path(tempfile.mkdtemp(prefix="invoice_work_"))
         self.work_dir.mkdir(parents=True, exist_ok=True)
 
         # Materialize the source document locally for fitz/PIL/OCR tooling
-        self.local_input_path = self.storage.materialize_to_local(file_key)
+        with self._stage("materialize"):
+            self.local_input_path = self.storage.materialize_to_local(file_key)
 
         self.markdown = ""
         self.markdown_by_page: dict[int, str] = {}
@@ -61,7 +94,7 @@ class Invoice:
         self.file_type = "pdf" if self.local_input_path.suffix.lower() == ".pdf" else "image"
 
         if self.file_type == "pdf":
-            with fitz.open(self.local_input_path) as doc:
+            with fitz_lock, fitz.open(self.local_input_path) as doc:
                 self.page_number = len(doc)
         else:
             self.page_number = 1
@@ -69,112 +102,442 @@ class Invoice:
         # A nice stable stem for output naming
         self.stem = self.local_input_path.stem
 
+        self._content_sha256: str | None = None
+
+        # stage results saved as they complete; with `resume`, stages a previous
+        # attempt finished for these bytes (same pipeline version) are skipped
+        self.checkpoint = checkpoints.manifest(self.content_sha256, fresh=not resume) if checkpoints else None
+        if self.checkpoint is not None and self.checkpoint.completed():
+            print(f"Resuming {self.stem} from checkpoint: {', '.join(self.checkpoint.completed())} already done")
+
+    @property
+    def content_sha256(self) -> str:
+        """SHA-256 of the source document bytes (computed once, used as a cache key)."""
+        if self._content_sha256 is None:
+            self._content_sha256 = sha256_file(self.local_input_path)
+        return self._content_sha256
+
+    def _stage(self, name: str, pages: int | None = None):
+        return timed_stage(name, self.timings, pages)
+
     def extract_markdown(self):
-        markdown, markdown_by_page = self.ocr_engine.extract_text(self)
+        if self.checkpoint is not None and self.checkpoint.has("ocr"):
+            markdown, markdown_by_page = self.checkpoint.ocr()
+        else:
+            with self._stage("ocr", pages=self.page_number):
+                markdown, markdown_by_page = self.ocr_engine.extract_text(self)
+            if self.checkpoint is not None:
+                self.checkpoint.save_ocr(markdown, markdown_by_page)
         self.markdown = markdown
         self.markdown_by_page = markdown_by_page
         self.markdown_with_pages_numbers = "\n\n---\n\n".join(
             [f"--- PAGE {page} ---\n: {txt}" for page, txt in markdown_by_page.items()]
         )
 
-    def analyze_document(self):
+    def analysis_request(self) -> dict:
+        """chat.completions body of the analysis call (also used as a Batch API request)."""
         prompt = build_prompt_for_analyze_document(
             config_path="configs/extraction_config.json",
             markdown_text=self.markdown_with_pages_numbers,
         )
+        return {
+            "model": "gpt-4o",
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": 0,
+        }
 
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0,
-        )
-        self.analysis_dict = extract_json_from_response(response.choices[0].message.content)
+    def apply_analysis_response(self, content: str):
+        self.analysis_dict = extract_json_from_response(content)
+
+    def analyze_document(self):
+        if self.checkpoint is not None and self.checkpoint.has("analysis"):
+            self.analysis_dict = self.checkpoint.analysis()
+            return
+        client = get_openai_client()
+        request = self.analysis_request()
+        with self._stage("analysis"), timed_call(
+            "openai", "analysis", sent_bytes=len(request["messages"][0]["content"])
+        ) as call:
+            response = openai_policy().call(
+                "analysis",
+                client.chat.completions.create,
+                on_discard=lambda discarded: self.usage.record_chat_completion("analysis_hedge", discarded),
+                **request,
+            )
+            content = response.choices[0].message.content
+            call.received_bytes = len(content or "")
+        self.usage.record_chat_completion("analysis", response)
+        self.apply_analysis_response(content)
+        if self.checkpoint is not None:
+            self.checkpoint.save_analysis(self.analysis_dict)
 
     def _subdoc_key(self, ext: str, document_number: int) -> str:
         base = self.output_prefix.rstrip("/")
         return f"{base}/{self.stem}_subdocument_{document_number}{ext}"
 
     def split_document_into_invoices(self):
+        with self._stage("split"):
+            for _ in self.iter_split_subdocuments():
+                pass
+
+    def iter_split_subdocuments(self) -> Iterator[SubdocumentArtifact]:
+        """
+        Build, render and store the subdocuments one at a time, yielding each
+        SubdocumentArtifact as soon as its artifacts are in storage.
+        """
         if self.file_type != "pdf":
             raise ValueError("split_document_into_invoices currently expects a PDF input.")
 
-        with fitz.open(self.local_input_path) as doc:
-            for doc_num_str, page_numbers in self.analysis_dict["invoice_pages"].items():
-                document_number = int(doc_num_str) if isinstance(doc_num_str, str) and doc_num_str.isdigit() else int(doc_num_str)
-
+        restored = self._restored_subdocuments()
+        if restored is not None:
+            for artifact in restored:
+                self.subdocuments.append(artifact)
+                yield artifact
+            return
+
+        policy = self.image_policy
+        subdocs = []
+        for doc_num_str, page_numbers in self.analysis_dict["invoice_pages"].items():
+            document_number = int(doc_num_str) if isinstance(doc_num_str, str) and doc_num_str.isdigit() else int(doc_num_str)
+            subdocs.append((document_number, page_numbers, page_numbers[0] - 1, page_numbers[-1] - 1))
+
+        # page images are rendered on the rasterizer's process pool, a few subdocuments
+        # ahead of this loop, and arrive here already encoded according to the image policy
+        rendered = self.rasterizer.iter_subdocument_images(
+            self.local_input_path, [(first, last) for _, _, first, last in subdocs], policy
+        )
+        # fitz_lock is held around the fitz calls only, never across storage writes or the yield
+        with fitz_lock:
+            doc = fitz.open(self.local_input_path)
+        try:
+            start = time.perf_counter()  # per subdocument: waiting for its images + building + storing
+            for (document_number, page_numbers, first, last), images in zip(subdocs, rendered):
                 sub_md = "\n\n".join([self.markdown_by_page[p] for p in page_numbers])
 
                 md_key = self._subdoc_key(".md", document_number)
                 pdf_key = self._subdoc_key(".pdf", document_number)
-                img_key = self._subdoc_key(".png", document_number)
-
-                # 1) write markdown to storage
-                self.storage.write_text(md_key, sub_md)
-
-                # 2) create sub-pdf locally, then upload/store
-                subdoc_pdf_local = self.work_dir / Path(pdf_key).name
-                subdoc = fitz.open()
-                subdoc.insert_pdf(doc, from_page=page_numbers[0] - 1, to_page=page_numbers[-1] - 1)
-                subdoc.save(subdoc_pdf_local)
-                subdoc.close()
-
-                self.storage.write_bytes(pdf_key, subdoc_pdf_local.read_bytes(), content_type="application/pdf")
-
-                # 3) render pages into one concatenated image locally, then upload/store
-                page_images: list[Image.Image] = []
-                with fitz.open(subdoc_pdf_local) as subpdf:
-                    for page in subpdf:
-                        pix = page.get_pixmap(dpi=300)
-                        mode = "RGB" if pix.alpha == 0 else "RGBA"
-                        pil_image = Image.frombytes(mode, [pix.width, pix.height], pix.samples)
-                        page_images.append(pil_image)
-
-                total_height = sum(img.height for img in page_images)
-                max_width = max(img.width for img in page_images)
-                concatenated = Image.new("RGB", (max_width, total_height), color=(255, 255, 255))
-                y = 0
-                for img in page_images:
-                    concatenated.paste(img, (0, y))
-                    y += img.height
-
-                subdoc_img_local = self.work_dir / Path(img_key).name
-                concatenated.save(subdoc_img_local)
-
-                self.storage.write_bytes(img_key, subdoc_img_local.read_bytes(), content_type="image/png")
-
-                self.subdocuments.append(
-                    SubdocumentArtifact(
-                        document_number=document_number,
-                        page_numbers=page_numbers,
-                        markdown=sub_md,
-                        md_key=md_key,
-                        pdf_key=pdf_key,
-                        image_key=img_key,
-                    )
+
+                with fitz_lock:
+                    # 1) build the sub-pdf in memory
+                    subdoc = fitz.open()
+                    subdoc.insert_pdf(doc, from_page=first, to_page=last)
+                    pdf_bytes = subdoc.tobytes(garbage=3, deflate=True)
+                    subdoc.close()
+
+                    # 2) images come from the rasterizer; the pages are only needed for the legacy size baseline
+                    baseline_size = legacy_image_size([doc[i] for i in range(first, last + 1)])
+
+                if len(images) == 1:
+                    img_keys = [self._subdoc_key(images[0].extension, document_number)]
+                else:
+                    img_keys = [
+                        self._subdoc_key(f"_page_{first + 1 + i}{img.extension}", document_number)
+                        for i, img in enumerate(images)
+                    ]
+
+                # 3) markdown, pdf and images go to storage in one concurrent batch
+                self.storage.write_many(
+                    [
+                        (md_key, sub_md.encode("utf-8"), "text/plain; charset=utf-8"),
+                        (pdf_key, pdf_bytes, "application/pdf"),
+                    ]
+                    + [(key, img.data, img.mime_type) for key, img in zip(img_keys, images)]
                 )
 
-    def extract_data_from_subdocuments(self, processor):
-        extraction_dicts = []
-        extraction_result_json = {"number_of_subdocuments": len(self.subdocuments)}
+                self.image_report.add(
+                    f"subdocument_{document_number}", images, policy.detail, baseline_size=baseline_size
+                )
 
-        for subdoc in self.subdocuments:
-            # processor.extract expects a local filename -> materialize image to local
-            local_image = self.storage.materialize_to_local(subdoc.image_key)
-
-            extraction_dict = processor.extract(
-                str(local_image),
-                use_ocr=True,
-                use_vision=True,
-                markdown_text=subdoc.markdown,
-                prompt=get_full_prompt(
-                    ocr_text=subdoc.markdown,
-                    animal_information=self.analysis_dict.get("animals"),
-                ),
+                artifact = SubdocumentArtifact(
+                    document_number=document_number,
+                    page_numbers=page_numbers,
+                    markdown=sub_md,
+                    md_key=md_key,
+                    pdf_key=pdf_key,
+                    image_key=img_keys[0],
+                    image_keys=img_keys,
+                )
+                self.subdocuments.append(artifact)
+                record_stage("split_subdocument", time.perf_counter() - start, self.timings, pages=len(page_numbers))
+                yield artifact
+                start = time.perf_counter()
+        finally:
+            with fitz_lock:
+                doc.close()
+
+        if self.checkpoint is not None:
+            self.checkpoint.save_split(self.subdocuments)
+
+    def _restored_subdocuments(self) -> list[SubdocumentArtifact] | None:
+        """Checkpointed subdocuments, if their artifacts are all still in storage."""
+        if self.checkpoint is None or not self.checkpoint.has("split"):
+            return None
+        subdocs = self.checkpoint.split()
+        keys = [key for subdoc in subdocs for key in (subdoc.md_key, subdoc.pdf_key, *subdoc.image_keys)]
+        missing = [key for key in keys if not self.storage.exists(key)]
+        if missing:
+            print(f"Checkpointed subdocuments of {self.stem} are incomplete ({len(missing)} artifacts missing); splitting again")
+            self.checkpoint.drop("split")
+            return None
+        return subdocs
+
+    def _extract_kwargs(self, subdoc: SubdocumentArtifact) -> dict:
+        return dict(
+            use_ocr=True,
+            use_vision=True,
+            markdown_text=subdoc.markdown,
+            prompt=get_full_prompt(
+                ocr_text=subdoc.markdown,
                 animal_information=self.analysis_dict.get("animals"),
-            )
-            extraction_dicts.append(extraction_dict)
+            ),
+            animal_information=self.analysis_dict.get("animals"),
+        )
+
+    def _materialize_images(self, subdoc: SubdocumentArtifact) -> str | list[str]:
+        paths = [str(self.storage.materialize_to_local(key)) for key in subdoc.image_keys]
+        return paths[0] if len(paths) == 1 else paths
+
+    def _restored_extraction(self, subdoc: SubdocumentArtifact) -> dict | None:
+        return self.checkpoint.extraction(subdoc.document_number) if self.checkpoint is not None else None
+
+    def _extract_subdocument(self, processor, subdoc: SubdocumentArtifact) -> dict:
+        restored = self._restored_extraction(subdoc)
+        if restored is not None:
+            return restored
+        with self._stage("extract_subdocument", pages=len(subdoc.page_numbers)):
+            # processor.extract expects local filenames -> materialize images to local
+            return processor.extract(self._materialize_images(subdoc), usage=self.usage, **self._extract_kwargs(subdoc))
+
+    async def _aextract_subdocument(self, processor, subdoc: SubdocumentArtifact) -> dict:
+        restored = self._restored_extraction(subdoc)
+        if restored is not None:
+            return restored
+        with self._stage("extract_subdocument", pages=len(subdoc.page_numbers)):
+            local_images = await asyncio.to_thread(self._materialize_images, subdoc)
+            return await processor.extract(local_images, usage=self.usage, **self._extract_kwargs(subdoc))
+
+    def _failed_extraction(self, i: int, subdoc: SubdocumentArtifact, e: Exception, errors: list) -> dict:
+        print(f"Extraction failed for subdocument {subdoc.document_number}: {e}")
+        errors.append((i, e))
+        return {"document_number": subdoc.document_number, "error": str(e)}
+
+    def _subdocument_done(self, i: int, subdoc: SubdocumentArtifact, result: dict) -> None:
+        # checkpoint and progress callback are side channels: their failure must not
+        # lose the result (or, in split_and_extract, kill the consumer thread)
+        try:
+            # failed subdocuments are not checkpointed: a retry extracts them again
+            if self.checkpoint is not None and "error" not in result:
+                self.checkpoint.save_extraction(subdoc.document_number, result)
+            if self.on_subdocument_extracted is not None:
+                self.on_subdocument_extracted(i, subdoc, result)
+        except Exception as e:
+            print(f"Subdocument {subdoc.document_number} of {self.stem}: done hook failed: {type(e).__name__}: {e}")
+
+    def extract_data_from_subdocuments(self, processor, max_concurrency: int = 1):
+        """
+        Run processor.extract for every subdocument, up to `max_concurrency` at a time.
+        Results keep subdocument order. A failing subdocument is recorded as
+        {"document_number": ..., "error": ...} instead of aborting its siblings;
+        only if every subdocument fails is the first error re-raised.
+
+        Processors with a coroutine extract() (AsyncGPTInvoiceProcessor) run on an
+        event loop instead of the thread pool.
+        """
+        with self._stage("extract"):
+            if inspect.iscoroutinefunction(processor.extract):
+                run_async(self.aextract_data_from_subdocuments(processor, max_concurrency=max_concurrency))
+                return
+
+            n = len(self.subdocuments)
+            extraction_dicts: list[dict | None] = [None] * n
+            errors: list[tuple[int, Exception]] = []
+
+            def run(i: int):
+                subdoc = self.subdocuments[i]
+                try:
+                    extraction_dicts[i] = self._extract_subdocument(processor, subdoc)
+                except Exception as e:
+                    extraction_dicts[i] = self._failed_extraction(i, subdoc, e, errors)
+                self._subdocument_done(i, subdoc, extraction_dicts[i])
+
+            workers = max(1, min(max_concurrency, n))
+            if workers == 1:
+                for i in range(n):
+                    run(i)
+            else:
+                with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="subdoc_extract") as pool:
+                    list(pool.map(run, range(n)))
+
+            self._store_extraction_results(extraction_dicts, errors)
+
+    async def aextract_data_from_subdocuments(self, processor, max_concurrency: int = 4):
+        """asyncio counterpart of extract_data_from_subdocuments for async processors."""
+        n = len(self.subdocuments)
+        extraction_dicts: list[dict | None] = [None] * n
+        errors: list[tuple[int, Exception]] = []
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+        async def run(i: int):
+            subdoc = self.subdocuments[i]
+            async with semaphore:
+                try:
+                    extraction_dicts[i] = await self._aextract_subdocument(processor, subdoc)
+                except Exception as e:
+                    extraction_dicts[i] = self._failed_extraction(i, subdoc, e, errors)
+                await asyncio.to_thread(self._subdocument_done, i, subdoc, extraction_dicts[i])
+
+        await asyncio.gather(*(run(i) for i in range(n)))
+        await asyncio.to_thread(self._store_extraction_results, extraction_dicts, errors)
+
+    def split_and_extract(self, processor, max_concurrency: int = 4, queue_size: int = 4):
+        """
+        Streaming split_document_into_invoices + extract_data_from_subdocuments.
+
+        Each subdocument is handed to extraction as soon as it is rendered and
+        stored, so rasterization (CPU) overlaps with the LLM calls (network) and
+        total latency approaches max(render, extract) instead of their sum. The
+        hand-off queue holds at most `queue_size` subdocuments; rendering blocks
+        while it is full. Results and error handling match the two-step version.
+        """
+        with self._stage("split_extract"):
+            if inspect.iscoroutinefunction(processor.extract):
+                run_async(self.asplit_and_extract(processor, max_concurrency=max_concurrency, queue_size=queue_size))
+                return
+
+            n = len(self.analysis_dict["invoice_pages"])
+            extraction_dicts: list[dict | None] = [None] * n
+            errors: list[tuple[int, Exception]] = []
+            handoff: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+            workers = max(1, min(max_concurrency, n))
+
+            def consume():
+                while (item := handoff.get()) is not None:
+                    i, subdoc = item
+                    try:
+                        extraction_dicts[i] = self._extract_subdocument(processor, subdoc)
+                    except Exception as e:
+                        extraction_dicts[i] = self._failed_extraction(i, subdoc, e, errors)
+                    self._subdocument_done(i, subdoc, extraction_dicts[i])
+
+            def hand_off(item) -> bool:
+                """Queue `item`, unless every consumer is gone and nobody would ever take it."""
+                while True:
+                    try:
+                        handoff.put(item, timeout=1.0)
+                        return True
+                    except queue.Full:
+                        if all(f.done() for f in consumers):
+                            return False
+
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="subdoc_extract") as pool:
+                consumers = [pool.submit(consume) for _ in range(workers)]
+                split = self.iter_split_subdocuments()
+                try:
+                    # the producer (rendering) runs on this thread
+                    for i, subdoc in enumerate(split):
+                        if not hand_off((i, subdoc)):
+                            break  # the consumers' error is raised below
+                except BaseException:
+                    # splitting failed: don't spend API calls on what is still queued
+                    while True:
+                        try:
+                            handoff.get_nowait()
+                        except queue.Empty:
+                            break
+                    raise
+                finally:
+                    split.close()  # in-flight renders and the open document, if it stopped early
+                    for _ in consumers:
+                        hand_off(None)
+
+            for consumer in consumers:
+                consumer.result()  # a consumer that died re-raises here instead of vanishing
+            self._store_extraction_results(extraction_dicts, errors)
+
+    async def asplit_and_extract(self, processor, max_concurrency: int = 4, queue_size: int = 4):
+        """asyncio counterpart of split_and_extract: rendering runs in a thread, extraction on the loop."""
+        n = len(self.analysis_dict["invoice_pages"])
+        extraction_dicts: list[dict | None] = [None] * n
+        errors: list[tuple[int, Exception]] = []
+        handoff: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+
+        async def consume():
+            while (item := await handoff.get()) is not None:
+                i, subdoc = item
+                try:
+                    extraction_dicts[i] = await self._aextract_subdocument(processor, subdoc)
+                except Exception as e:
+                    extraction_dicts[i] = self._failed_extraction(i, subdoc, e, errors)
+                await asyncio.to_thread(self._subdocument_done, i, subdoc, extraction_dicts[i])
+
+        consumers = [asyncio.create_task(consume()) for _ in range(max(1, min(max_concurrency, n)))]
+        split = self.iter_split_subdocuments()
+        # a cancelled await doesn't stop the next() already running in its thread:
+        # close() waits for it instead of failing with "generator already executing"
+        split_lock = threading.Lock()
+
+        def split_next():
+            with split_lock:
+                return next(split, None)
+
+        def split_close():
+            with split_lock:
+                split.close()
 
+        try:
+            i = 0
+            while (subdoc := await asyncio.to_thread(split_next)) is not None:
+                await handoff.put((i, subdoc))
+                i += 1
+        except BaseException:
+            for task in consumers:
+                task.cancel()
+            await asyncio.gather(*consumers, return_exceptions=True)
+            raise
+        finally:
+            # in-flight renders and the open document, if splitting stopped early;
+            # off the loop like next(): closing waits for the rasterizer
+            await asyncio.to_thread(split_close)
+
+        for _ in consumers:
+            await handoff.put(None)
+        await asyncio.gather(*consumers)
+        await asyncio.to_thread(self._store_extraction_results, extraction_dicts, errors)
+
+    def extraction_request(self, processor, subdoc: SubdocumentArtifact) -> dict:
+        """chat.completions body of one subdocument's extraction (for the Batch API)."""
+        return processor.build_request_body(self._materialize_images(subdoc), **self._extract_kwargs(subdoc))
+
+    def apply_extraction_results(self, results: list):
+        """
+        Store results produced outside this class (e.g. by a batch job), one per
+        subdocument in order: the extracted dict, or the Exception it failed with.
+        """
+        extraction_dicts: list[dict] = []
+        errors: list[tuple[int, Exception]] = []
+        for i, (subdoc, result) in enumerate(zip(self.subdocuments, results)):
+            if isinstance(result, Exception):
+                result = self._failed_extraction(i, subdoc, result, errors)
+            extraction_dicts.append(result)
+            self._subdocument_done(i, subdoc, result)
+        self._store_extraction_results(extraction_dicts, errors)
+
+    def _store_extraction_results(self, extraction_dicts: list, errors: list[tuple[int, Exception]]):
+        with self._stage("store_result"):
+            self._write_extraction_results(extraction_dicts, errors)
+
+    def _write_extraction_results(self, extraction_dicts: list, errors: list[tuple[int, Exception]]):
+        n = len(self.subdocuments)
+        if n and len(errors) == n:
+            # errors arrive in completion order: raise the first subdocument's, so the
+            # job's error doesn't depend on which request happened to fail first
+            raise min(errors, key=lambda error: error[0])[1]
+
+        extraction_result_json = {"number_of_subdocuments": n}
+        if errors:
+            extraction_result_json["failed_subdocuments"] = sorted(
+                self.subdocuments[i].document_number for i, _ in errors
+            )
         extraction_result_json["subdocuments"] = extraction_dicts
         self.extraction_result_json = extraction_result_json
 
@@ -184,10 +547,10 @@ class Invoice:
 
     def cleanup_temporary_files(self):
         # delete subdocument artifacts from storage (optional; comment out if you want to keep them)
+        keys = []
         for subdoc in self.subdocuments:
-            self.storage.delete(subdoc.md_key)
-            self.storage.delete(subdoc.pdf_key)
-            self.storage.delete(subdoc.image_key)
+            keys += [subdoc.md_key, subdoc.pdf_key, *subdoc.image_keys]
+        self.storage.delete_many(keys)
 
         # always delete local working files
         try:
@@ -0,0 +1,152 @@
+"""
+Bulk (re)processing of many documents through the OpenAI Batch API: same
+pipeline as jobs.tasks.process_file, at batch pricing and batch latency.
+
+The analysis -> split -> extraction dependency runs as two batch waves:
+  1) OCR every document locally, one batch with all analysis calls
+  2) split every analysed document, one batch with all subdocument extractions
+
+    python -m jobs.batch_backfill s3://bucket/a.pdf s3://bucket/b.pdf --output-prefix s3://bucket/backfill
+    python -m jobs.batch_backfill --from-file keys.txt
+
+Run offline against the fake endpoint:
+    python fake_openai_batch_server.py --port 8089 &
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_BATCH_POLL_INTERVAL=1 python -m jobs.batch_backfill ...
+"""
+import argparse
+import json
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from invoice import Invoice
+from jobs.tasks import _build_ocr_engine, _build_storage
+from processors.gpt_processor import GPTInvoiceProcessor
+from processors.openai_batch import BatchRequest, OpenAIBatchRunner, build_batch_runner
+from rendering.image_policy import ImagePolicy
+from utils import ensure_json_serializable
+
+load_dotenv()
+
+
+def run_backfill(file_keys: list[str], make_invoice, processor, runner: OpenAIBatchRunner) -> dict:
+    """
+    Drive every document through both batch waves; `make_invoice(file_key)`
+    builds its Invoice. Returns {file_key: extraction result or {"error": ...}};
+    a document failing in one stage is dropped from the later ones.
+    """
+    results: dict[str, dict] = {}
+    active: dict[int, Invoice] = {}
+    invoices: list[Invoice] = []
+    try:
+        for i, file_key in enumerate(file_keys):
+            try:
+                invoice = make_invoice(file_key)
+                invoices.append(invoice)
+                invoice.extract_markdown()
+                active[i] = invoice
+            except Exception as e:
+                print(f"OCR failed for {file_key}: {e}")
+                results[file_key] = {"error": f"ocr: {e}"}
+
+        _run_waves(file_keys, active, processor, runner, results)
+    finally:
+        for invoice in invoices:
+            invoice.cleanup_local()
+    return results
+
+
+def _run_waves(file_keys: list[str], active: dict[int, Invoice], processor, runner: OpenAIBatchRunner, results: dict) -> None:
+    # wave 1: document analysis (which pages form which invoice)
+    analysis = runner.run(
+        [BatchRequest(f"analysis-{i}", invoice.analysis_request()) for i, invoice in active.items()],
+        label="analysis",
+    )
+    for i in list(active):
+        try:
+            outcome = analysis[f"analysis-{i}"]
+            if isinstance(outcome, Exception):
+                raise outcome
+            active[i].apply_analysis_response(outcome.choices[0].message.content)
+            active[i].split_document_into_invoices()
+        except Exception as e:
+            print(f"Analysis/split failed for {file_keys[i]}: {e}")
+            results[file_keys[i]] = {"error": f"analysis: {e}"}
+            del active[i]
+
+    # wave 2: extraction of every subdocument of every document
+    build_errors: dict[str, Exception] = {}
+
+    def extraction_requests():
+        # generated lazily: bodies carry base64 images and go straight to the JSONL files
+        for i, invoice in active.items():
+            for j, subdoc in enumerate(invoice.subdocuments):
+                try:
+                    yield BatchRequest(f"extract-{i}-{j}", invoice.extraction_request(processor, subdoc))
+                except Exception as e:
+                    build_errors[f"extract-{i}-{j}"] = e
+
+    extraction = runner.run(extraction_requests(), label="extraction")
+    extraction.update(build_errors)
+
+    for i, invoice in active.items():
+        subdoc_results = []
+        for j in range(len(invoice.subdocuments)):
+            outcome = extraction[f"extract-{i}-{j}"]
+            if not isinstance(outcome, Exception):
+                try:
+                    outcome = processor._parse_response(outcome)
+                except Exception as e:
+                    outcome = e
+            subdoc_results.append(outcome)
+        try:
+            invoice.apply_extraction_results(subdoc_results)
+            results[file_keys[i]] = ensure_json_serializable(invoice.extraction_result_json)
+        except Exception as e:
+            results[file_keys[i]] = {"error": f"extraction: {e}"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process many documents through the OpenAI Batch API")
+    parser.add_argument("file_keys", nargs="*", help="storage keys (local paths or s3://...)")
+    parser.add_argument("--from-file", help="text file with one storage key per line")
+    parser.add_argument("--output-prefix", default=os.getenv("OUTPUT_PREFIX", "outputs"))
+    parser.add_argument("--work-dir", help="where batch JSONL files are written (default: temp dir)")
+    parser.add_argument("--summary", help="write {file_key: result} JSON here")
+    args = parser.parse_args()
+
+    file_keys = list(args.file_keys)
+    if args.from_file:
+        file_keys += [line.strip() for line in Path(args.from_file).read_text().splitlines() if line.strip()]
+    if not file_keys:
+        parser.error("no documents given")
+
+    storage = _build_storage()
+    ocr_engine = _build_ocr_engine(storage)
+    image_policy = ImagePolicy.from_env()
+    # only used to build request bodies and parse responses; it never calls the API itself
+    processor = GPTInvoiceProcessor(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        model=os.getenv("OPENAI_TEXT_MODEL", "gpt-4"),
+        vision_model=os.getenv("OPENAI_VISION_MODEL", "gpt-4o"),
+        image_policy=image_policy,
+    )
+
+    def make_invoice(file_key: str) -> Invoice:
+        return Invoice(file_key=file_key, ocr_engine=ocr_engine, storage=storage,
+                       output_prefix=args.output_prefix, image_policy=image_policy)
+
+    runner = build_batch_runner(Path(args.work_dir) if args.work_dir else None)
+    results = run_backfill(file_keys, make_invoice, processor, runner)
+
+    failed = [key for key, result in results.items() if "error" in result]
+    print(f"Backfill done: {len(results) - len(failed)} ok, {len(failed)} failed")
+    for key in failed:
+        print(f"  {key}: {results[key]['error']}")
+    if args.summary:
+        Path(args.summary).write_text(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+# jobs/checkpoint.py
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+import time
+from dataclasses import asdict
+from typing import TYPE_CHECKING, Optional
+
+from storage.storage import StorageBackend
+
+if TYPE_CHECKING:  # invoice imports this module
+    from invoice import SubdocumentArtifact
+
+# Stages in pipeline order; a manifest holds the ones that completed:
+#   ocr         {"markdown", "markdown_by_page"}
+#   analysis    {"analysis_dict"}
+#   split       {"subdocuments": [SubdocumentArtifact as dict, ...]}
+#   extraction  {document_number: extracted dict}  (successful subdocuments only)
+STAGES = ("ocr", "analysis", "split", "extraction")
+
+
+def checkpoints_enabled() -> bool:
+    return os.getenv("CHECKPOINTS", "1") != "0"
+
+
+class StageManifest:
+    """
+    Checkpoint of one document: what its completed stages produced, so a retried
+    job can pick up where the previous attempt died. Saved to storage after
+    every stage (and every extracted subdocument).
+
+    Saving is best-effort: a storage error is logged and never fails the job.
+    """
+
+    def __init__(self, storage: StorageBackend, key: str, version: str, stages: Optional[dict] = None):
+        self.storage = storage
+        self.key = key
+        self.version = version
+        self.stages: dict = stages or {}
+        self._lock = threading.Lock()
+
+    def has(self, stage: str) -> bool:
+        return stage in self.stages
+
+    def completed(self) -> list[str]:
+        return [stage for stage in STAGES if stage in self.stages and (stage != "extraction" or self.stages[stage])]
+
+    def _save(self) -> None:
+        # under the caller's lock: concurrent extractions must not overwrite a newer manifest with an older one
+        payload = {"version": self.version, "updated_at": time.time(), "stages": self.stages}
+        try:
+            self.storage.write_bytes(
+                self.key, json.dumps(payload, ensure_ascii=False).encode("utf-8"), content_type="application/json"
+            )
+        except Exception as e:
+            print(f"Could not save checkpoint {self.key}: {e}")
+
+    def _set(self, stage: str, data) -> None:
+        with self._lock:
+            self.stages[stage] = data
+            self._save()
+
+    # ---- ocr ----
+
+    def save_ocr(self, markdown: str, markdown_by_page: dict[int, str]) -> None:
+        # JSON object keys are strings; converted back to int by ocr()
+        self._set("ocr", {"markdown": markdown, "markdown_by_page": {str(k): v for k, v in markdown_by_page.items()}})
+
+    def ocr(self) -> tuple[str, dict[int, str]]:
+        data = self.stages["ocr"]
+        return data["markdown"], {int(k): v for k, v in data["markdown_by_page"].items()}
+
+    # ---- analysis ----
+
+    def save_analysis(self, analysis_dict: dict) -> None:
+        self._set("analysis", {"analysis_dict": analysis_dict})
+
+    def analysis(self) -> dict:
+        return self.stages["analysis"]["analysis_dict"]
+
+    # ---- split ----
+
+    def save_split(self, subdocuments: list["SubdocumentArtifact"]) -> None:
+        self._set("split", {"subdocuments": [asdict(s) for s in subdocuments]})
+
+    def split(self) -> list["SubdocumentArtifact"]:
+        from invoice import SubdocumentArtifact
+
+        return [SubdocumentArtifact(**s) for s in self.stages["split"]["subdocuments"]]
+
+    def drop(self, stage: str) -> None:
+        with self._lock:
+            self.stages.pop(stage, None)
+
+    # ---- extraction ----
+
+    def save_extraction(self, document_number: int, result: dict) -> None:
+        with self._lock:
+            results = self.stages.setdefault("extraction", {})
+            if str(document_number) in results:
+                return
+            results[str(document_number)] = result
+            self._save()
+
+    def extraction(self, document_number: int) -> Optional[dict]:
+        return self.stages.get("extraction", {}).get(str(document_number))
+
+    def clear(self) -> None:
+        """Drop the checkpoint once the document's result is stored."""
+        with self._lock:
+            self.stages = {}
+            try:
+                self.storage.delete(self.key)
+            except Exception as e:
+                print(f"Could not delete checkpoint {self.key}: {e}")
+
+
+class CheckpointStore:
+    """
+    Stage manifests in a StorageBackend, one per document content and upload:
+
+      {prefix}/{content_sha256}/{sha256(scope)[:16]}.json -> {"version", "updated_at", "stages": {...}}
+
+    `scope` is the file_id: two jobs on the same bytes from different uploads
+    (force, DEDUP_ENABLED=0) run side by side, and must neither overwrite nor
+    clear each other's manifest, nor resume from split artifacts stored under
+    the other upload's name. Retries of a job keep its file_id and resume.
+
+    `version` is everything that changes what the stages produce (pipeline
+    version: prompts, config, models, image policy; plus the OCR engine). A
+    manifest written under another version is ignored and overwritten, never
+    resumed from.
+    """
+
+    def __init__(self, storage: StorageBackend, prefix: str, version: str, scope: str = ""):
+        self.storage = storage
+        self.prefix = prefix.rstrip("/")
+        self.version = version
+        self.scope = scope
+
+    def _key(self, content_sha256: str) -> str:
+        scope = hashlib.sha256(self.scope.encode("utf-8")).hexdigest()[:16]
+        return f"{self.prefix}/{content_sha256}/{scope}.json"
+
+    def manifest(self, content_sha256: str, fresh: bool = False) -> StageManifest:
+        """The document's manifest; empty when there is none, it is stale, or `fresh` is set."""
+        key = self._key(content_sha256)
+        if fresh:
+            return StageManifest(self.storage, key, self.version)
+        try:
+            if not self.storage.exists(key):
+                return StageManifest(self.storage, key, self.version)
+            payload = json.loads(self.storage.read_bytes(key).decode("utf-8"))
+        except Exception as e:
+            # a broken checkpoint only costs the work it would have saved
+            print(f"Could not read checkpoint {key}: {e}")
+            return StageManifest(self.storage, key, self.version)
+        if payload.get("version") != self.version:
+            print(f"Ignoring checkpoint {key}: written by pipeline version {payload.get('version')}, now {self.version}")
+            return StageManifest(self.storage, key, self.version)
+        return StageManifest(self.storage, key, self.version, payload.get("stages"))
+
+
+def build_checkpoint_store(
+    storage: StorageBackend, output_prefix: str, version: str, scope: str = ""
+) -> Optional[CheckpointStore]:
+    """
+    CHECKPOINTS=0        disable stage checkpoints
+    CHECKPOINT_PREFIX    where manifests go (default: <OUTPUT_PREFIX>/checkpoints)
+    """
+    if not checkpoints_enabled():
+        return None
+    prefix = os.getenv("CHECKPOINT_PREFIX") or f"{output_prefix.rstrip('/')}/checkpoints"
+    return CheckpointStore(storage, prefix, version, scope=scope)
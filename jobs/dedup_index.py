@@ -0,0 +1,146 @@
+# jobs/dedup_index.py
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from typing import Optional
+
+from redis import Redis
+from redis.exceptions import WatchError
+
+from prompt_building.prompt_building import prompt_version
+
+# Bump when the pipeline changes in a way that invalidates stored results
+# (prompt/config/model/image changes are picked up automatically below).
+PIPELINE_VERSION = "1"
+
+ACTIVE_STATUSES = {"queued", "started", "deferred", "scheduled"}
+
+
+def pipeline_version() -> str:
+    """
+    Everything that changes what an extraction returns for the same bytes.
+    API and worker compute this from the same env, so they agree on the version.
+    """
+    # imported here so the API (which imports this module) doesn't load PIL at startup
+    from rendering.image_policy import ImagePolicy
+
+    parts = [
+        PIPELINE_VERSION,
+        prompt_version(),
+        os.getenv("OPENAI_TEXT_MODEL", "gpt-4"),
+        os.getenv("OPENAI_VISION_MODEL", "gpt-4o"),
+        repr(ImagePolicy.from_env()),
+    ]
+    ocr_engine = os.getenv("OCR_ENGINE", "agentic").lower()
+    if ocr_engine != "agentic":  # the default adds nothing, so existing versions stay valid
+        # text-layer pages depend on the detector settings (ocr/ocr_text_layer.py),
+        # tesseract pages on its language and resolution (ocr/ocr_tesseract.py)
+        settings = (
+            "TEXT_LAYER_MIN_CHARS", "TEXT_LAYER_MAX_IMAGE_COVERAGE", "TEXT_LAYER_MAX_BAD_CHARS", "TEXT_LAYER_TABLES",
+            "OCR_FALLBACK_ENGINE", "TESSERACT_LANG", "TESSERACT_DPI", "TESSERACT_CONFIG",
+        )
+        parts.append(ocr_engine + ":" + ",".join(os.getenv(name, "") for name in settings))
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def dedup_enabled() -> bool:
+    return os.getenv("DEDUP_ENABLED", "1") != "0"
+
+
+class DedupIndex:
+    """
+    Content-hash index in Redis, so identical documents are processed once:
+
+      dedup:file:{file_id}              -> sha256 of the uploaded bytes
+      dedup:result:{sha256}:{version}   -> {"file_id", "job_id", "pipeline_version", "result"}
+      dedup:job:{job_id}                -> "{sha256}:{version}" (result lookup after the RQ job expired)
+      dedup:inflight:{sha256}:{version} -> job_id currently processing these bytes
+
+    Results are keyed by pipeline_version(), so a prompt/model/image policy
+    change never serves a result produced by an older configuration.
+    """
+
+    def __init__(self, redis_conn: Redis, ttl: Optional[int] = None):
+        self.redis = redis_conn
+        self.ttl = ttl or int(os.getenv("DEDUP_TTL_SECONDS", str(30 * 24 * 3600)))
+
+    # ---- uploads ----
+
+    def record_upload(self, file_id: str, sha256: str) -> None:
+        self.redis.set(f"dedup:file:{file_id}", sha256, ex=self.ttl)
+
+    def sha_for_file(self, file_id: str) -> Optional[str]:
+        value = self.redis.get(f"dedup:file:{file_id}")
+        return value.decode() if value else None
+
+    # ---- results ----
+
+    def get_result(self, sha256: str, version: str) -> Optional[dict]:
+        raw = self.redis.get(f"dedup:result:{sha256}:{version}")
+        return json.loads(raw) if raw else None
+
+    def result_for_job(self, job_id: str) -> Optional[dict]:
+        ref = self.redis.get(f"dedup:job:{job_id}")
+        if not ref:
+            return None
+        raw = self.redis.get(f"dedup:result:{ref.decode()}")
+        return json.loads(raw) if raw else None
+
+    def record_result(self, sha256: str, version: str, file_id: str, job_id: str, result) -> None:
+        entry = {"file_id": file_id, "job_id": job_id, "pipeline_version": version, "result": result}
+        with self.redis.pipeline() as pipe:
+            pipe.set(f"dedup:result:{sha256}:{version}", json.dumps(entry), ex=self.ttl)
+            pipe.set(f"dedup:job:{job_id}", f"{sha256}:{version}", ex=self.ttl)
+            pipe.set(f"dedup:file:{file_id}", sha256, ex=self.ttl)
+            pipe.execute()
+
+    # ---- in-flight jobs ----
+
+    def claim(self, sha256: str, version: str, job_id: str, ttl: int) -> Optional[str]:
+        """
+        Register `job_id` as the job processing these bytes. Returns None if the
+        claim succeeded, otherwise the job_id that already holds it.
+        """
+        key = f"dedup:inflight:{sha256}:{version}"
+        while True:
+            if self.redis.set(key, job_id, nx=True, ex=ttl):
+                return None
+            holder = self.redis.get(key)
+            if holder is not None:
+                return holder.decode()
+            # the holder's claim expired in between: try again
+
+    def replace_claim(self, sha256: str, version: str, stale_holder: str, job_id: str, ttl: int) -> Optional[str]:
+        """
+        Compare-and-swap a stale claim (its job failed or expired without releasing
+        it) for `job_id`. Returns None if `job_id` holds the claim now, otherwise
+        the job_id that got it first (another request replaced the stale holder too).
+        """
+        key = f"dedup:inflight:{sha256}:{version}"
+        with self.redis.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    current = pipe.get(key)
+                    current = current.decode() if current else None
+                    if current is not None and current != stale_holder:
+                        pipe.unwatch()
+                        return current
+                    pipe.multi()
+                    pipe.set(key, job_id, ex=ttl)
+                    pipe.execute()
+                    return None
+                except WatchError:
+                    continue  # changed between WATCH and EXEC: look again
+
+    def release(self, sha256: str, version: str, job_id: Optional[str] = None) -> None:
+        """Drop the in-flight marker; with `job_id`, only if that job still holds it."""
+        key = f"dedup:inflight:{sha256}:{version}"
+        if job_id is None:
+            self.redis.delete(key)
+            return
+        holder = self.redis.get(key)
+        if holder is not None and holder.decode() == job_id:
+            self.redis.delete(key)
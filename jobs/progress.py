@@ -0,0 +1,66 @@
+# jobs/progress.py
+from __future__ import annotations
+
+import json
+import os
+import time
+from typing import Optional
+
+from redis import Redis
+
+# Stage events of a job, in the order process_file publishes them:
+#   started                {"queue", "queue_class", "queue_wait_seconds"}  the worker picked the job up
+#   ocr_done               {"pages"}          markdown extracted
+#   analysis_done          {"subdocuments"}   document split plan known
+#   subdocument_extracted  {"document_number", "index", "subdocuments", "ok", "error"?}
+#   finished               {"failed_subdocuments"?, "deduplicated"?}
+#   retrying               {"error", "retries_left"}  attempt failed, RQ runs the job again
+#   failed                 {"error"}
+TERMINAL_EVENTS = {"finished", "failed"}
+
+
+def events_key(job_id: str) -> str:
+    return f"job:{job_id}:events"
+
+
+def decode_event(entry_id, fields: dict) -> dict:
+    """One stream entry -> {"id", "event", "data", "ts"} (works for bytes and str replies)."""
+    def text(value):
+        return value.decode() if isinstance(value, bytes) else value
+
+    fields = {text(k): text(v) for k, v in fields.items()}
+    return {
+        "id": text(entry_id),
+        "event": fields.get("event"),
+        "data": json.loads(fields.get("data") or "{}"),
+        "ts": float(fields.get("ts") or 0),
+    }
+
+
+class JobProgress:
+    """
+    Publishes a job's stage events to the Redis stream job:{job_id}:events.
+
+    A stream instead of pub/sub so clients that connect late (or reconnect with
+    Last-Event-ID) still see everything that already happened. The stream is
+    capped and expires JOB_EVENTS_TTL_SECONDS after the last event.
+
+    Progress is best-effort: a Redis error is logged and never fails the job.
+    """
+
+    def __init__(self, redis_conn: Redis, job_id: str, ttl: Optional[int] = None, maxlen: int = 1000):
+        self.redis = redis_conn
+        self.job_id = job_id
+        self.key = events_key(job_id)
+        self.ttl = ttl or int(os.getenv("JOB_EVENTS_TTL_SECONDS", str(24 * 3600)))
+        self.maxlen = maxlen
+
+    def publish(self, event: str, **data) -> None:
+        fields = {"event": event, "data": json.dumps(data), "ts": repr(time.time())}
+        try:
+            with self.redis.pipeline(transaction=False) as pipe:
+                pipe.xadd(self.key, fields, maxlen=self.maxlen, approximate=True)
+                pipe.expire(self.key, self.ttl)
+                pipe.execute()
+        except Exception as e:
+            print(f"Could not publish {event} for job {self.job_id}: {e}")
@@ -0,0 +1,137 @@
+# jobs/queues.py
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from redis import Redis
+
+# Jobs are routed by size to two queues next to the original one:
+#   {RQ_QUEUE_NAME}-fast   small documents (interactive uploads, receipts)
+#   {RQ_QUEUE_NAME}-bulk   long scans, and anything whose size is unknown
+#   {RQ_QUEUE_NAME}        jobs enqueued before routing existed, tooling (worker_overhead_report.py)
+QUEUE_NAME = os.getenv("RQ_QUEUE_NAME", "invoice-jobs")
+FAST_QUEUE = os.getenv("RQ_FAST_QUEUE_NAME", f"{QUEUE_NAME}-fast")
+BULK_QUEUE = os.getenv("RQ_BULK_QUEUE_NAME", f"{QUEUE_NAME}-bulk")
+
+
+@dataclass(frozen=True)
+class QueueClass:
+    name: str  # "fast" / "bulk": the label of the queue-wait metrics
+    queue: str
+    timeout_base: int
+    timeout_per_page: int
+    timeout_max: int
+
+    @classmethod
+    def from_env(cls, name: str, queue: str, base: int, per_page: int, maximum: int) -> "QueueClass":
+        prefix = name.upper()
+        return cls(
+            name=name,
+            queue=queue,
+            timeout_base=int(os.getenv(f"{prefix}_JOB_TIMEOUT_BASE", str(base))),
+            timeout_per_page=int(os.getenv(f"{prefix}_JOB_TIMEOUT_PER_PAGE", str(per_page))),
+            timeout_max=int(os.getenv(f"{prefix}_JOB_TIMEOUT_MAX", str(maximum))),
+        )
+
+    def job_timeout(self, pages: Optional[int]) -> int:
+        if pages is None:
+            return self.timeout_max
+        return min(self.timeout_base + self.timeout_per_page * pages, self.timeout_max)
+
+
+@dataclass(frozen=True)
+class Route:
+    queue_class: QueueClass
+    job_timeout: int
+    at_front: bool  # explicit high priority jumps the queue
+
+
+class QueueRouter:
+    """
+    Picks the queue and job timeout of a new job:
+
+      FAST_MAX_PAGES / FAST_MAX_BYTES   documents up to both limits go to the fast queue (3 pages, 5 MB)
+      {FAST,BULK}_JOB_TIMEOUT_BASE / _PER_PAGE / _MAX
+                                        job_timeout = base + per_page * pages, capped at max;
+                                        max when the page count is unknown
+
+    A PDF whose pages couldn't be counted goes to the bulk queue whatever
+    its size: a small file can still be a long scan. An explicit priority
+    overrides the size rule: high -> front of the fast queue, low -> bulk queue.
+    """
+
+    def __init__(self, fast: QueueClass, bulk: QueueClass, fast_max_pages: int, fast_max_bytes: int):
+        self.fast = fast
+        self.bulk = bulk
+        self.fast_max_pages = fast_max_pages
+        self.fast_max_bytes = fast_max_bytes
+
+    @classmethod
+    def from_env(cls) -> "QueueRouter":
+        return cls(
+            fast=QueueClass.from_env("fast", FAST_QUEUE, base=300, per_page=60, maximum=1800),
+            bulk=QueueClass.from_env("bulk", BULK_QUEUE, base=600, per_page=60, maximum=3 * 3600),
+            fast_max_pages=int(os.getenv("FAST_MAX_PAGES", "3")),
+            fast_max_bytes=int(os.getenv("FAST_MAX_BYTES", str(5 * 1024 * 1024))),
+        )
+
+    def route(
+        self, pages: Optional[int], size: Optional[int], priority: Optional[str] = None, is_pdf: bool = False
+    ) -> Route:
+        if priority == "high":
+            queue_class = self.fast
+        elif priority == "low":
+            queue_class = self.bulk
+        elif pages is None and size is None:
+            queue_class = self.bulk  # uploaded before page counting, or the info expired
+        elif pages is None and is_pdf:
+            queue_class = self.bulk  # uncountable PDF: its length is unknown
+        elif (pages is None or pages <= self.fast_max_pages) and (size is None or size <= self.fast_max_bytes):
+            queue_class = self.fast
+        else:
+            queue_class = self.bulk
+        return Route(queue_class, queue_class.job_timeout(pages), at_front=priority == "high")
+
+
+def worker_queues() -> list[tuple[str, float]]:
+    """
+    (queue, weight) pairs a worker listens to, from WORKER_QUEUES, e.g.
+    "invoice-jobs-fast:4,invoice-jobs-bulk:1". A queue's weight is its share of
+    the time it is tried first, so bulk work keeps moving while fast jobs wait
+    less. Default: fast 3, bulk 1, the original queue 1.
+    """
+    spec = os.getenv("WORKER_QUEUES")
+    if not spec:
+        return [(FAST_QUEUE, 3.0), (BULK_QUEUE, 1.0), (QUEUE_NAME, 1.0)]
+    queues = []
+    for item in spec.split(","):
+        name, _, weight = item.strip().partition(":")
+        if name:
+            queues.append((name, float(weight) if weight else 1.0))
+    return queues
+
+
+class UploadInfo:
+    """
+    What the API learned about an upload while streaming it to storage, for
+    routing at /process time:
+
+      upload:{file_id} -> {"size", "pages", "content_type", "is_pdf"}
+    """
+
+    def __init__(self, redis_conn: Redis, ttl: Optional[int] = None):
+        self.redis = redis_conn
+        self.ttl = ttl or int(os.getenv("UPLOAD_INFO_TTL_SECONDS", str(30 * 24 * 3600)))
+
+    def record(
+        self, file_id: str, size: int, pages: Optional[int], content_type: Optional[str] = None, is_pdf: bool = False
+    ) -> None:
+        info = {"size": size, "pages": pages, "content_type": content_type, "is_pdf": is_pdf}
+        self.redis.set(f"upload:{file_id}", json.dumps(info), ex=self.ttl)
+
+    def get(self, file_id: str) -> Optional[dict]:
+        raw = self.redis.get(f"upload:{file_id}")
+        return json.loads(raw) if raw else None
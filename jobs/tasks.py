@@ -1,14 +1,30 @@
 import os
+import time
+from dataclasses import dataclass
 from pathlib import Path
 from dotenv import load_dotenv
+from rq import get_current_job
 
 from storage.file_storage import get_file_key  # <-- NEW (was get_file_path)
 
 from storage.storage import LocalStorage, S3Storage  # adjust import to your actual module names
+from storage.cached_storage import CachedStorage, build_cached_storage
 from invoice import Invoice
+from jobs.checkpoint import build_checkpoint_store
+from jobs.dedup_index import DedupIndex, dedup_enabled, pipeline_version
+from jobs.progress import JobProgress
+from jobs.usage_ledger import JobUsage, UsageLedger
+from instrumentation import QUEUE_WAIT_SECONDS, StageTimings, export_worker_metrics, record_stage
 
 from ocr.ocr_agentic import OCRAgenticProcessor
-from processors.gpt_processor import GPTInvoiceProcessor
+from ocr.ocr_cache import build_cached_ocr_engine
+from ocr.ocr_tesseract import TesseractOCR
+from ocr.ocr_text_layer import HybridOCR, TextLayerOCR
+from processors.gpt_processor import GPTInvoiceProcessor, AsyncGPTInvoiceProcessor
+from processors.rate_limiter import get_rate_limiter
+from prompt_building.prompt_building import prompt_version
+from rendering.image_policy import ImagePolicy
+from rendering.rasterizer import close_rasterizer
 from utils import ensure_json_serializable
 
 load_dotenv()
@@ -23,31 +39,203 @@ def _build_storage():
 
     if backend == "s3":
         region = os.getenv("AWS_DEFAULT_REGION", "eu-central-1")
-        return S3Storage(region_name=region)
+        # write-through cache: artifacts we upload are read back locally, not re-downloaded
+        return build_cached_storage(S3Storage(region_name=region))
 
     # default: local
     base_dir = Path(os.getenv("LOCAL_STORAGE_BASE_DIR", Path.cwd()))
     return LocalStorage(base_dir=base_dir)
 
 
-def process_file(file_id: str):
+def _build_ocr_engine(storage):
+    """
+    OCR_ENGINE=agentic|hybrid|text_layer|tesseract (default agentic):
+      agentic     LandingAI parse for every document
+      hybrid      pages with a good PDF text layer are read locally, only the
+                  others (scans) go to the OCR_FALLBACK_ENGINE (see ocr/ocr_text_layer.py)
+      text_layer  PDF text layer only, no LandingAI at all
+      tesseract   local tesseract for every page: offline, no OCR cost (see ocr/ocr_tesseract.py)
+
+    OCR_FALLBACK_ENGINE=agentic|tesseract (default agentic) is what hybrid sends scans to.
+    """
+    engine = os.getenv("OCR_ENGINE", "agentic").lower()
+    if engine not in ("agentic", "hybrid", "text_layer", "tesseract"):
+        raise ValueError(f"OCR_ENGINE must be 'agentic', 'hybrid', 'text_layer' or 'tesseract', got {engine!r}")
+    if engine == "text_layer":
+        return TextLayerOCR()
+    if engine == "hybrid":
+        fallback = os.getenv("OCR_FALLBACK_ENGINE", "agentic").lower()
+        if fallback not in ("agentic", "tesseract"):
+            raise ValueError(f"OCR_FALLBACK_ENGINE must be 'agentic' or 'tesseract', got {fallback!r}")
+        return HybridOCR(_build_page_ocr_engine(fallback, storage))
+    return _build_page_ocr_engine(engine, storage)
+
+
+def _build_page_ocr_engine(engine: str, storage):
+    if engine == "tesseract":
+        # TESSERACT_WORKERS gives tesseract a pool of its own; default: the shared Rasterizer pool
+        workers = os.getenv("TESSERACT_WORKERS")
+        ocr_engine = TesseractOCR(workers=int(workers) if workers else None)
+    else:
+        ocr_engine = OCRAgenticProcessor(name="agentic_ocr")
+    # repeat uploads of the same bytes skip the OCR (see OCR_CACHE_* env)
+    return build_cached_ocr_engine(ocr_engine, storage=storage)
+
+
+@dataclass
+class PipelineComponents:
+    storage: object
+    ocr_engine: object
+    processor: GPTInvoiceProcessor
+    image_policy: ImagePolicy
+    shared: bool = False  # reused across jobs -> never torn down by a job
+
+
+def _build_components() -> PipelineComponents:
+    # 2) Build storage backend
+    storage = _build_storage()
+
+    # 3) Engines / processors
+    ocr_engine = _build_ocr_engine(storage)
+
+    # IMAGE_POLICY=budget|legacy (+ IMAGE_* overrides) controls vision payload size
+    image_policy = ImagePolicy.from_env()
+
+    # OPENAI_ASYNC=1 runs subdocument extraction on one event loop / AsyncOpenAI client
+    processor_cls = AsyncGPTInvoiceProcessor if os.getenv("OPENAI_ASYNC", "0") == "1" else GPTInvoiceProcessor
+    processor = processor_cls(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        model=os.getenv("OPENAI_TEXT_MODEL", "gpt-4"),
+        vision_model=os.getenv("OPENAI_VISION_MODEL", "gpt-4o"),
+        rate_limiter=get_rate_limiter(),
+        image_policy=image_policy,
+    )
+    return PipelineComponents(storage=storage, ocr_engine=ocr_engine, processor=processor, image_policy=image_policy)
+
+
+def _release_components(components: PipelineComponents) -> None:
+    storage = components.storage
+    if isinstance(storage, CachedStorage):
+        print(f"Storage cache: {storage.stats()}")
+    if components.shared:
+        return
+    components.ocr_engine.close()  # e.g. TesseractOCR's own process pool (TESSERACT_WORKERS)
+    close_rasterizer()  # the render pool of this job's process, if RASTER_WORKERS started one
+    if isinstance(storage, CachedStorage):
+        storage.cleanup_cache()
+    if isinstance(storage, (S3Storage, CachedStorage)):
+        storage.close()  # stop the S3 I/O thread pool
+
+
+# Components reused by every job run in this process, keyed by pid so a forked
+# child never picks up its parent's clients (sockets and thread pools don't survive fork).
+_warm_components: dict[int, PipelineComponents] = {}
+
+
+def preload() -> None:
+    """
+    Fork-safe warm-up for the parent of a forking worker: heavy modules are
+    already imported by this module; this also fills module-level caches
+    (PIL plugins, compiled prompts, botocore service models) that forked
+    children inherit. It creates no sockets, threads or processes.
+    """
+    from PIL import Image
+    Image.init()
+    prompt_version()
+    if os.getenv("STORAGE_BACKEND", "local").lower() == "s3":
+        import boto3
+        # loads the S3 service model into the default session; no connection is opened
+        boto3.client("s3", region_name=os.getenv("AWS_DEFAULT_REGION", "eu-central-1"))
+
+
+def warm_up() -> PipelineComponents:
+    """Build this process's shared components (non-forking worker); process_file reuses them."""
+    preload()
+    components = _warm_components.get(os.getpid())
+    if components is None:
+        components = _build_components()
+        components.shared = True
+        _warm_components[os.getpid()] = components
+    return components
+
+
+def shutdown_warm() -> None:
+    components = _warm_components.pop(os.getpid(), None)
+    if components is not None:
+        components.shared = False
+        _release_components(components)
+
+
+def _components_for_job() -> PipelineComponents:
+    return _warm_components.get(os.getpid()) or _build_components()
+
+
+def overhead_probe(io_seconds: float = 0.0) -> dict:
+    """
+    Job that does only process_file's fixed setup (no document, no API calls),
+    then waits `io_seconds` as a stand-in for external calls. Used by
+    worker_overhead_report.py to measure per-job overhead per worker mode.
+    """
+    start = time.perf_counter()
+    components = _components_for_job()
+    setup = time.perf_counter() - start
+    time.sleep(io_seconds)
+    _release_components(components)
+    return {"setup_seconds": setup, "pid": os.getpid()}
+
+
+def process_file(file_id: str, force: bool = False):
     # 1) Resolve file_id -> storage key (local path or s3://...)
     invoice = None
-    try:
-        file_key = get_file_key(file_id)
+    components = None
+    lease = None
+    dedup_index = None
+    retrying = False
+    job = get_current_job()
+    started = time.perf_counter()
+    timings = StageTimings()
+    # tokens/pages/cost per call, written through to the daily ledger as they happen
+    ledger = UsageLedger(job.connection) if job is not None else None
+    usage = JobUsage(ledger)
+    # stage events for GET /job/{id}/events and the ?wait= long-poll
+    progress = JobProgress(job.connection, job.id) if job is not None else None
 
-        # 2) Build storage backend
-        storage = _build_storage()
+    def publish(event: str, **data):
+        if progress is not None:
+            progress.publish(event, **data)
 
-        # 3) Engines / processors
-        agentic_ocr_engine = OCRAgenticProcessor(name="agentic_ocr")
+    def subdocument_extracted(i, subdoc, extracted):
+        data = {
+            "index": i,
+            "document_number": subdoc.document_number,
+            "subdocuments": len(invoice.analysis_dict.get("invoice_pages", {})),
+            "ok": "error" not in extracted,
+        }
+        if "error" in extracted:
+            data["error"] = extracted["error"]
+        publish("subdocument_extracted", **data)
 
-        processor = GPTInvoiceProcessor(
-            name="gpt_processor",
-            api_key=os.getenv("OPENAI_API_KEY"),
-            model=os.getenv("OPENAI_TEXT_MODEL", "gpt-4"),
-            vision_model=os.getenv("OPENAI_VISION_MODEL", "gpt-4o"),
-        )
+    started_data = {}
+    if job is not None and job.enqueued_at is not None and job.started_at is not None:
+        # from (re-)enqueueing to this worker picking the job up, per queue class (fast / bulk)
+        queue_wait = max((job.started_at - job.enqueued_at).total_seconds(), 0.0)
+        queue_class = job.meta.get("queue_class", job.origin)
+        QUEUE_WAIT_SECONDS.labels(queue_class).observe(queue_wait)
+        timings.add("queue_wait", queue_wait)
+        started_data = {"queue": job.origin, "queue_class": queue_class, "queue_wait_seconds": round(queue_wait, 3)}
+
+    publish("started", **started_data)
+    try:
+        file_key = get_file_key(file_id)
+
+        # 2) + 3) storage, OCR engine, processor: shared when the worker warmed them up
+        components = _components_for_job()
+        storage, ocr_engine = components.storage, components.ocr_engine
+        processor, image_policy = components.processor, components.image_policy
+        if isinstance(storage, CachedStorage):
+            # the cache may be shared with concurrent jobs: files this job opens by path are
+            # pinned until it is done, so another job's writes can't evict them
+            storage = lease = storage.lease()
 
         # 4) Output prefix (local folder or s3 prefix)
         #    Examples:
@@ -55,25 +243,109 @@ def process_file(file_id: str):
         #      s3:    output_prefix="s3://my-bucket/processed/invoices"
         output_prefix = os.getenv("OUTPUT_PREFIX", "outputs")
 
+        # stage manifests: a retried job resumes after the last stage its previous attempt
+        # finished; `force` starts over (and overwrites the manifest) on its first attempt
+        # only, so its RQ retries resume like any other job's. RQ doesn't persist
+        # number_of_retries, so the first attempt marks the job in its meta
+        restart = force and (job is None or not job.meta.get("force_restarted"))
+        if restart and job is not None:
+            job.meta["force_restarted"] = True
+            job.save_meta()
+        checkpoints = build_checkpoint_store(
+            storage,
+            output_prefix,
+            version=f"{pipeline_version()}:{getattr(ocr_engine, 'name', '')}:{getattr(ocr_engine, 'model_id', '')}",
+            scope=file_id,  # one manifest per upload: concurrent jobs on the same bytes don't share it
+        )
+
         # 5) Run pipeline
         invoice = Invoice(
             file_key=file_key,
-            ocr_engine=agentic_ocr_engine,
+            ocr_engine=ocr_engine,
             storage=storage,
             output_prefix=output_prefix,
+            image_policy=image_policy,
+            on_subdocument_extracted=subdocument_extracted,
+            timings=timings,
+            usage=usage,
+            checkpoints=checkpoints,
+            resume=not restart,
         )
 
+        # Identical bytes + identical pipeline version -> reuse the stored result (no OCR/LLM calls)
+        if job is not None and dedup_enabled():
+            dedup_index = DedupIndex(job.connection)
+            version = pipeline_version()
+            cached = None if force else dedup_index.get_result(invoice.content_sha256, version)
+            if cached is not None:
+                print(f"Dedup hit: {file_id} has the same content as {cached['file_id']} (job {cached['job_id']})")
+                publish("finished", deduplicated=True)
+                # the stored result never carries usage: this job's (zero) usage is attached instead
+                return {**ensure_json_serializable(cached["result"]), "usage": usage.summary()}
+
         invoice.extract_markdown()
+        publish("ocr_done", pages=invoice.page_number)
         invoice.analyze_document()
-        invoice.split_document_into_invoices()
-        invoice.extract_data_from_subdocuments(processor)
+        publish("analysis_done", subdocuments=len(invoice.analysis_dict.get("invoice_pages", {})))
+        max_concurrency = int(os.getenv("SUBDOC_EXTRACTION_CONCURRENCY", "4"))
+        if os.getenv("SPLIT_EXTRACT_STREAMING", "1") == "1":
+            # extraction starts on each subdocument as soon as it is rendered;
+            # at most SPLIT_QUEUE_SIZE rendered subdocuments wait for the LLM
+            invoice.split_and_extract(
+                processor,
+                max_concurrency=max_concurrency,
+                queue_size=int(os.getenv("SPLIT_QUEUE_SIZE", "4")),
+            )
+        else:
+            invoice.split_document_into_invoices()
+            invoice.extract_data_from_subdocuments(processor, max_concurrency=max_concurrency)
+        print(f"Vision image budget: {invoice.image_report.summary()}")
+
+        result = ensure_json_serializable(invoice.extraction_result_json)
+        # partial results (some subdocuments failed) are not worth replaying
+        if dedup_index is not None and "failed_subdocuments" not in result:
+            dedup_index.record_result(invoice.content_sha256, version, file_id, job.id, result)
+        failed = result.get("failed_subdocuments")
+        if invoice.checkpoint is not None and not failed:
+            # with failures the checkpoint stays: a rerun only extracts the failed subdocuments
+            invoice.checkpoint.clear()
+        publish("finished", **({"failed_subdocuments": failed} if failed else {}))
+        result["usage"] = usage.summary()
+
+    except Exception as e:
+        # RQ re-enqueues the job (see JOB_MAX_RETRIES) after this attempt's failure is handled
+        retrying = job is not None and bool(job.retries_left)
+        if retrying:
+            publish("retrying", error=f"{type(e).__name__}: {e}", retries_left=job.retries_left)
+        else:
+            publish("failed", error=f"{type(e).__name__}: {e}")
+        raise
 
     # (optional) keep artifacts in S3 but remove local temps
     # invoice.cleanup_temporary_files()  # enable if desired
-    finally:    
+    finally:
+        if dedup_index is not None and not retrying:
+            # a job that will be retried keeps its in-flight claim
+            dedup_index.release(invoice.content_sha256, version, job.id)
         if invoice is not None:
             invoice.cleanup_local()
         else:
             print("Invoice is None")
+        if lease is not None:
+            lease.release()
+        if components is not None:
+            _release_components(components)
+        record_stage("job", time.perf_counter() - started, timings)
+        if ledger is not None:
+            # failed jobs are charged too; like JobUsage, a ledger error never changes the job's outcome
+            try:
+                ledger.save_job(job.id, usage.summary())
+            except Exception as e:
+                print(f"Could not write usage to the ledger: {e}")
+        if job is not None:
+            # per-stage wall times next to the result, e.g. {"ocr": {"count": 1, "seconds": 12.3}, ...}
+            job.meta["timings"] = timings.as_dict()
+            job.save_meta()
+        export_worker_metrics()
 
-    return ensure_json_serializable(invoice.extraction_result_json)
\ No newline at end of file
+    return result
\ No newline at end of file
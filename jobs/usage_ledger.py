@@ -0,0 +1,298 @@
+# jobs/usage_ledger.py
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Optional
+
+from redis import Redis
+
+PRICES_PATH = "configs/model_prices.json"
+
+_COUNTERS = ("calls", "prompt_tokens", "cached_tokens", "completion_tokens", "total_tokens", "pages", "credits", "cost_usd")
+_FLOAT_COUNTERS = {"credits", "cost_usd"}
+
+
+class PriceTable:
+    """Model prices from configs/model_prices.json (or MODEL_PRICES_PATH)."""
+
+    def __init__(self, prices: dict):
+        self.openai: dict[str, dict] = prices.get("openai", {})
+        self.usd_per_landingai_credit = float(prices.get("landingai", {}).get("usd_per_credit", 0.0))
+        self._warned: set[str] = set()
+
+    @classmethod
+    def from_file(cls, path: Optional[str] = None) -> "PriceTable":
+        with open(path or os.getenv("MODEL_PRICES_PATH", PRICES_PATH), encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def _model_prices(self, model: str) -> Optional[dict]:
+        # exact name first, then the longest prefix: gpt-4o-mini-2024-07-18 -> gpt-4o-mini, not gpt-4o
+        if model in self.openai:
+            return self.openai[model]
+        matches = [name for name in self.openai if model.startswith(name)]
+        return self.openai[max(matches, key=len)] if matches else None
+
+    def llm_cost(self, model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+        prices = self._model_prices(model)
+        if prices is None:
+            if model not in self._warned:
+                self._warned.add(model)
+                print(f"No price for model {model!r} in the price table; its calls are counted at $0")
+            return 0.0
+        cached_rate = prices.get("cached_input", prices["input"])
+        return (
+            (prompt_tokens - cached_tokens) * prices["input"]
+            + cached_tokens * cached_rate
+            + completion_tokens * prices["output"]
+        ) / 1_000_000
+
+    def landingai_cost(self, credits: float) -> float:
+        return credits * self.usd_per_landingai_credit
+
+
+@lru_cache(maxsize=1)
+def get_price_table() -> PriceTable:
+    return PriceTable.from_file()
+
+
+def _today() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+def _parse_counters(raw: dict) -> dict:
+    """HGETALL of a usage hash -> {"calls": 3, ..., "by_model": {model: {...}}}."""
+    totals = {name: 0.0 if name in _FLOAT_COUNTERS else 0 for name in _COUNTERS}
+    by_model: dict[str, dict] = {}
+    for field, value in raw.items():
+        field = field.decode() if isinstance(field, bytes) else field
+        number = float(value)
+        if field.startswith("model:"):
+            model, name = field[len("model:"):].rsplit(":", 1)  # model names may contain ':' (fine-tunes)
+            by_model.setdefault(model, {})[name] = number if name in _FLOAT_COUNTERS else int(number)
+        else:
+            totals[field] = number if field in _FLOAT_COUNTERS else int(number)
+    totals.setdefault("jobs", 0)
+    totals["cost_usd"] = round(totals["cost_usd"], 6)
+    totals["by_model"] = by_model
+    return totals
+
+
+class UsageLedger:
+    """
+    Token/cost ledger in Redis:
+
+      usage:day:{YYYY-MM-DD}  -> hash of counters (calls, tokens, pages, credits, cost_usd, jobs)
+                                 plus model:{model}:{counter} per model; UTC days
+      usage:minute:{epoch_min} -> OpenAI tokens spent in that minute (TPM headroom)
+      usage:job:{job_id}       -> per-call entries and totals of one job (JSON)
+
+    Counters are incremented as each call completes, so the daily totals the
+    budget guard reads include jobs that are still running.
+    """
+
+    def __init__(self, redis_conn: Redis, ttl_days: Optional[int] = None):
+        self.redis = redis_conn
+        self.ttl = (ttl_days or int(os.getenv("USAGE_LEDGER_TTL_DAYS", "90"))) * 24 * 3600
+
+    def add_call(self, entry: dict) -> None:
+        day_key = f"usage:day:{_today()}"
+        model = entry.get("model")
+        with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hincrby(day_key, "calls", 1)
+            if model:
+                pipe.hincrby(day_key, f"model:{model}:calls", 1)
+            for name in _COUNTERS[1:]:
+                value = entry.get(name)
+                if not value:
+                    continue
+                incr = pipe.hincrbyfloat if name in _FLOAT_COUNTERS else pipe.hincrby
+                incr(day_key, name, value)
+                if model and name in ("total_tokens", "cost_usd"):
+                    incr(day_key, f"model:{model}:{name}", value)
+            pipe.expire(day_key, self.ttl)
+            if entry.get("service") == "openai" and entry.get("total_tokens"):
+                minute_key = f"usage:minute:{int(time.time() // 60)}"
+                pipe.incrby(minute_key, entry["total_tokens"])
+                pipe.expire(minute_key, 120)
+            pipe.execute()
+
+    def save_job(self, job_id: str, usage: dict) -> None:
+        day_key = f"usage:day:{_today()}"
+        with self.redis.pipeline(transaction=False) as pipe:
+            pipe.set(f"usage:job:{job_id}", json.dumps(usage), ex=self.ttl)
+            pipe.hincrby(day_key, "jobs", 1)
+            pipe.expire(day_key, self.ttl)
+            pipe.execute()
+
+    def job(self, job_id: str) -> Optional[dict]:
+        raw = self.redis.get(f"usage:job:{job_id}")
+        return json.loads(raw) if raw else None
+
+    def day(self, day: Optional[str] = None) -> dict:
+        day = day or _today()
+        return {"day": day, **_parse_counters(self.redis.hgetall(f"usage:day:{day}"))}
+
+    def days(self, n: int) -> list[dict]:
+        today = datetime.now(timezone.utc).date()
+        names = [(today - timedelta(days=i)).isoformat() for i in range(n)]
+        with self.redis.pipeline(transaction=False) as pipe:
+            for name in names:
+                pipe.hgetall(f"usage:day:{name}")
+            replies = pipe.execute()
+        return [{"day": name, **_parse_counters(raw)} for name, raw in zip(names, replies)]
+
+    def tokens_this_minute(self) -> int:
+        raw = self.redis.get(f"usage:minute:{int(time.time() // 60)}")
+        return int(raw) if raw else 0
+
+
+class JobUsage:
+    """
+    Usage of one job, call by call. Thread-safe (subdocuments are extracted
+    concurrently). Every call is also written through to the ledger when one is
+    given; a ledger error is logged and never fails the job.
+    """
+
+    def __init__(self, ledger: Optional[UsageLedger] = None, prices: Optional[PriceTable] = None):
+        self.ledger = ledger
+        self.prices = prices or get_price_table()
+        self._lock = threading.Lock()
+        self._calls: list[dict] = []
+
+    def _add(self, entry: dict) -> dict:
+        with self._lock:
+            self._calls.append(entry)
+        if self.ledger is not None:
+            try:
+                self.ledger.add_call(entry)
+            except Exception as e:
+                print(f"Could not write usage to the ledger: {e}")
+        return entry
+
+    def record_chat_completion(self, operation: str, response) -> dict:
+        """Record an OpenAI chat.completions response (its `model` and `usage`)."""
+        usage = response.usage
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = (getattr(details, "cached_tokens", 0) or 0) if details is not None else 0
+        model = response.model
+        return self._add({
+            "service": "openai",
+            "operation": operation,
+            "model": model,
+            "prompt_tokens": usage.prompt_tokens,
+            "cached_tokens": cached,
+            "completion_tokens": usage.completion_tokens,
+            "total_tokens": usage.total_tokens,
+            "cost_usd": round(self.prices.llm_cost(model, usage.prompt_tokens, usage.completion_tokens, cached), 6),
+        })
+
+    def record_landingai_parse(self, model: str, pages: int, credits: float) -> dict:
+        return self._add({
+            "service": "landingai",
+            "operation": "parse",
+            "model": model,
+            "pages": pages,
+            "credits": credits,
+            "cost_usd": round(self.prices.landingai_cost(credits), 6),
+        })
+
+    def summary(self) -> dict:
+        """{"totals": {...}, "by_operation": {op: {...}}, "calls": [...]} — stored per job and returned with the result."""
+        with self._lock:
+            calls = list(self._calls)
+
+        def total(entries):
+            out = {name: 0.0 if name in _FLOAT_COUNTERS else 0 for name in _COUNTERS}
+            out["calls"] = len(entries)
+            for entry in entries:
+                for name in _COUNTERS[1:]:
+                    out[name] += entry.get(name) or 0
+            out["cost_usd"] = round(out["cost_usd"], 6)
+            return out
+
+        operations = sorted({entry["operation"] for entry in calls})
+        return {
+            "totals": total(calls),
+            "by_operation": {op: total([e for e in calls if e["operation"] == op]) for op in operations},
+            "calls": calls,
+        }
+
+
+@dataclass
+class BudgetDecision:
+    reason: str
+    retry_after: int  # seconds until there is budget again
+    action: str  # "reject" (429) or "defer" (schedule the job for later)
+
+
+class BudgetGuard:
+    """
+    Admission control for new jobs, checked by POST /process:
+
+      DAILY_TOKEN_BUDGET      OpenAI tokens per UTC day (0/unset: no limit)
+      DAILY_COST_BUDGET_USD   OpenAI + LandingAI spend per UTC day (0/unset: no limit)
+      OPENAI_TPM + BUDGET_TPM_HEADROOM
+                              defer while this minute's tokens (all workers) leave less
+                              than that fraction of OPENAI_TPM free, e.g. 0.2
+      BUDGET_ACTION           reject (default) -> 429 with Retry-After;
+                              defer -> job is scheduled for when budget is back
+
+    A job in flight can still overshoot a daily budget by its own usage; the
+    guard only stops new work from being admitted.
+    """
+
+    def __init__(
+        self,
+        ledger: UsageLedger,
+        daily_tokens: Optional[int] = None,
+        daily_cost_usd: Optional[float] = None,
+        tpm: Optional[int] = None,
+        tpm_headroom: float = 0.0,
+        action: str = "reject",
+    ):
+        self.ledger = ledger
+        self.daily_tokens = daily_tokens
+        self.daily_cost_usd = daily_cost_usd
+        self.tpm = tpm
+        self.tpm_headroom = tpm_headroom
+        self.action = action
+
+    @classmethod
+    def from_env(cls, ledger: UsageLedger) -> Optional["BudgetGuard"]:
+        daily_tokens = int(os.getenv("DAILY_TOKEN_BUDGET", "0")) or None
+        daily_cost = float(os.getenv("DAILY_COST_BUDGET_USD", "0")) or None
+        headroom = float(os.getenv("BUDGET_TPM_HEADROOM", "0"))
+        tpm = (int(os.getenv("OPENAI_TPM", "0")) or None) if headroom > 0 else None
+        if daily_tokens is None and daily_cost is None and tpm is None:
+            return None
+        action = os.getenv("BUDGET_ACTION", "reject").lower()
+        if action not in ("reject", "defer"):
+            raise ValueError(f"BUDGET_ACTION must be 'reject' or 'defer', got {action!r}")
+        return cls(ledger, daily_tokens, daily_cost, tpm, headroom, action)
+
+    def check(self) -> Optional[BudgetDecision]:
+        """None if a new job may start now, otherwise why not and for how long."""
+        now = datetime.now(timezone.utc)
+        if self.daily_tokens is not None or self.daily_cost_usd is not None:
+            today = self.ledger.day(now.strftime("%Y-%m-%d"))
+            until_midnight = int((datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), timezone.utc) - now).total_seconds()) + 1
+            if self.daily_tokens is not None and today["total_tokens"] >= self.daily_tokens:
+                return BudgetDecision(
+                    f"daily token budget exhausted ({today['total_tokens']}/{self.daily_tokens})", until_midnight, self.action
+                )
+            if self.daily_cost_usd is not None and today["cost_usd"] >= self.daily_cost_usd:
+                return BudgetDecision(
+                    f"daily cost budget exhausted (${today['cost_usd']:.2f}/${self.daily_cost_usd:.2f})", until_midnight, self.action
+                )
+        if self.tpm is not None:
+            used = self.ledger.tokens_this_minute()
+            if used > self.tpm * (1 - self.tpm_headroom):
+                # TPM pressure passes within the minute: always defer, never reject
+                return BudgetDecision(f"TPM headroom below {self.tpm_headroom:.0%} ({used}/{self.tpm})", 60 - now.second, "defer")
+        return None
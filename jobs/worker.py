@@ -1,11 +1,300 @@
 import os
+import random
+import signal
+import tempfile
+import threading
+import time
+import multiprocessing
+
 from redis import Redis
-from rq import Worker, Queue
+from rq import Worker, SimpleWorker, Queue
+from rq.exceptions import StopRequested
+from rq.scheduler import RQScheduler
+from rq.timeouts import TimerDeathPenalty
 
-queue_name = os.getenv("RQ_QUEUE_NAME", "invoice-jobs")
+from jobs.queues import worker_queues
 
-if __name__ == "__main__":
+# WORKER_QUEUES="queue:weight,..." (see jobs/queues.py): fast/bulk/original queue by default
+queue_weights = dict(worker_queues())
+
+# WORKER_MODE:
+#   fork    - stock rq.Worker: every job runs in a fresh fork that imports and builds everything itself
+#   preload - rq.Worker, but heavy modules and fork-safe caches are loaded once in the parent before forking
+#   warm    - non-forking SimpleWorker in a child process that builds storage/OCR/OpenAI clients once and
+#             reuses them for every job; a supervisor restarts the child if it crashes and recycles it
+#             after WORKER_MAX_JOBS jobs
+#   threaded - like warm, but the child runs WORKER_CONCURRENCY jobs at once, one RQ worker per thread,
+#             all sharing the child's clients: jobs mostly wait on LandingAI/OpenAI/S3, so one instance
+#             gets through about WORKER_CONCURRENCY times as many; WORKER_MAX_JOBS counts per thread;
+#             RQ's scheduler runs in a separate process next to the child
+worker_mode = os.getenv("WORKER_MODE", "fork").lower()
+max_jobs = int(os.getenv("WORKER_MAX_JOBS", "0")) or None
+concurrency = max(1, int(os.getenv("WORKER_CONCURRENCY", "4")))
+burst = os.getenv("WORKER_BURST", "0") == "1"
+
+
+def _setup_metrics() -> None:
+    """
+    With METRICS_TEXTFILE / METRICS_PUSHGATEWAY set, every job exports the worker's
+    Prometheus metrics when it ends (see instrumentation.py). Jobs run in forked
+    (or restarted) child processes, so samples go to a multiprocess directory,
+    into one file for this worker: must run before anything imports instrumentation.
+    """
+    if not (os.getenv("METRICS_TEXTFILE") or os.getenv("METRICS_PUSHGATEWAY")):
+        return
+    if not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="invoice_metrics_")
+    os.environ["METRICS_PROCESS_ID"] = f"worker_{os.getpid()}"
+
+
+class _WeightedQueues:
+    """
+    Dequeue order drawn again after every job: each queue comes first with a
+    probability proportional to its weight, then the others in weighted order.
+    Fast jobs mostly go first, but a full fast queue never starves the bulk one.
+    Queues with weight 0 are only read when all others are empty.
+    """
+
+    def reorder_queues(self, reference_queue):
+        remaining = [q for q in self.queues if queue_weights.get(q.name, 1.0) > 0]
+        order = []
+        while remaining:
+            pick = random.choices(remaining, weights=[queue_weights.get(q.name, 1.0) for q in remaining])[0]
+            order.append(pick)
+            remaining.remove(pick)
+        self._ordered_queues = order + [q for q in self.queues if q not in order]
+
+
+class WeightedWorker(_WeightedQueues, Worker):
+    pass
+
+
+class WeightedSimpleWorker(_WeightedQueues, SimpleWorker):
+    pass
+
+
+class ThreadedWorker(_WeightedQueues, SimpleWorker):
+    """
+    One of the WORKER_CONCURRENCY workers of a threaded child. Each is a full RQ
+    worker (own name, state, started registry entries, retries) running jobs on
+    its own thread, so RQ's bookkeeping is untouched. What a thread can't do:
+
+    - signals: the child's main thread handles SIGTERM/SIGINT for all of them
+      (request_stop); blocking dequeues are kept short so a stop is noticed
+    - SIGALRM job timeouts: the timeout exception is raised in the job's thread
+      instead, once it is back in Python code (a call blocked on a socket ends
+      with its own timeout first)
+    - a work horse: the main thread keeps each running job's heartbeat alive
+      (maintain_running_heartbeat), with the short TTL forking workers use, so
+      the jobs of a child that dies are failed as abandoned within minutes
+    """
+
+    death_penalty_class = TimerDeathPenalty
+    stop_poll_seconds = 5
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._running_lock = threading.RLock()
+        self._running = None
+
+    def _install_signal_handlers(self):
+        pass  # only the main thread may install handlers
+
+    def request_stop(self, signum=None, frame=None):
+        """Warm shutdown: finish the current job, take no new one."""
+        self._stop_requested = True
+        if self.scheduler:
+            self.stop_scheduler()
+
+    def get_heartbeat_ttl(self, job) -> int:
+        return Worker.get_heartbeat_ttl(self, job)
+
+    def dequeue_job_and_maintain_ttl(self, timeout, max_idle_time=None):
+        if timeout is None:  # burst: no blocking
+            return super().dequeue_job_and_maintain_ttl(timeout, max_idle_time)
+        idle_since = time.monotonic()
+        while not self._stop_requested:
+            poll = self.stop_poll_seconds
+            if max_idle_time is not None:
+                idle_left = max_idle_time - (time.monotonic() - idle_since)
+                if idle_left <= 0:
+                    return None
+                poll = min(poll, max(1, int(idle_left)))
+            # RQ gives up on an empty queue after max_idle_time: here, after one short poll
+            result = super().dequeue_job_and_maintain_ttl(timeout, poll)
+            if result is not None:
+                return result
+        raise StopRequested()
+
+    def execute_job(self, job, queue):
+        with self._running_lock:
+            self._running = job
+        try:
+            super().execute_job(job, queue)
+        finally:
+            with self._running_lock:
+                self._running = None
+
+    def cleanup_execution(self, job, pipeline):
+        with self._running_lock:
+            super().cleanup_execution(job, pipeline)
+
+    def maintain_running_heartbeat(self) -> None:
+        with self._running_lock:
+            if self._running is None or self.execution is None:
+                return
+            try:
+                self.maintain_heartbeats(self._running)
+            except Exception as e:
+                print(f"Worker {self.name}: heartbeat of job {self._running.id} failed: {e}")
+
+
+def _connect() -> tuple[Redis, list[Queue]]:
     redis_conn = Redis.from_url(os.environ["REDIS_URL"])
-    queues = [Queue(queue_name, connection=redis_conn)]
-    worker = Worker(queues, connection=redis_conn)
-    worker.work()
\ No newline at end of file
+    return redis_conn, [Queue(name, connection=redis_conn) for name in queue_weights]
+
+
+# with_scheduler: the worker also runs RQ's scheduler (one holds the lock at a time), so jobs
+# the budget guard deferred (POST /process with BUDGET_ACTION=defer) are enqueued once their
+# time comes; threaded workers leave it to a separate process (see _run_scheduler)
+def _start(worker, with_scheduler: bool = True) -> None:
+    worker.reorder_queues(reference_queue=None)
+    worker.work(burst=burst, max_jobs=max_jobs, with_scheduler=with_scheduler)
+
+
+def _run_warm_child() -> None:
+    from jobs.tasks import shutdown_warm, warm_up
+
+    warm_up()
+    # the connection is opened here, never inherited from the supervisor
+    redis_conn, queues = _connect()
+    worker = WeightedSimpleWorker(queues, connection=redis_conn)
+    try:
+        _start(worker)
+    finally:
+        shutdown_warm()
+
+
+def _run_threaded_child() -> None:
+    from jobs.tasks import shutdown_warm, warm_up
+
+    warm_up()  # one set of clients for every thread (all of them are thread-safe)
+    redis_conn, _ = _connect()
+    # own Queue objects per worker: the dequeue order is per worker
+    workers = [
+        ThreadedWorker([Queue(name, connection=redis_conn) for name in queue_weights], connection=redis_conn)
+        for _ in range(concurrency)
+    ]
+    forced = False
+
+    def stop(signum, frame):
+        nonlocal forced
+        if forced:
+            # cold shutdown: running jobs stop heartbeating and RQ fails them as abandoned
+            print("Threaded worker: second stop signal, exiting without waiting for jobs")
+            os._exit(1)
+        forced = True
+        print(f"Threaded worker: stopping after the running jobs ({signal.Signals(signum).name})")
+        for worker in workers:
+            worker.request_stop()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # no scheduler here: RQ starts it by forking, which is unsafe in a process with running
+    # threads (locks held by other threads stay locked in the fork). The supervisor runs it.
+    threads = [
+        threading.Thread(target=_start, args=(worker, False), name=f"rq-worker-{i}", daemon=True)
+        for i, worker in enumerate(workers)
+    ]
+    try:
+        for thread in threads:
+            thread.start()
+        while True:
+            alive = [thread for thread in threads if thread.is_alive()]
+            if not alive:
+                break
+            alive[0].join(timeout=workers[0].job_monitoring_interval)
+            for worker in workers:
+                worker.maintain_running_heartbeat()
+    finally:
+        shutdown_warm()
+
+
+def _run_scheduler() -> None:
+    """RQ's scheduler in a process of its own, for threaded workers (their threads run none)."""
+    redis_conn, queues = _connect()
+    scheduler = RQScheduler(queues, connection=redis_conn)
+    scheduler.acquire_locks()  # another worker may hold them: work() tries again periodically
+    scheduler.work()  # until SIGTERM / SIGINT, then releases its locks
+
+
+def _child_main(target) -> None:
+    # the fork inherits the supervisor's handlers (which manage `child`, a Process object
+    # only the supervisor may query): a signal during warm-up just ends the child, until
+    # RQ (or the threaded child) installs its own
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    target()
+
+
+def _supervise_warm() -> None:
+    import jobs.tasks
+
+    jobs.tasks.preload()  # loaded once here, inherited by every (re)started child
+    ctx = multiprocessing.get_context("fork")
+    stopping = False
+    child = None
+    scheduler = None
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        if child is not None and child.is_alive():
+            os.kill(child.pid, signal.SIGTERM)  # rq warm shutdown: finish the current job
+        if scheduler is not None and scheduler.is_alive():
+            os.kill(scheduler.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    def start_scheduler():
+        # forked from this single-threaded supervisor, never from the threaded child
+        process = ctx.Process(target=_child_main, args=(_run_scheduler,), name="rq-scheduler")
+        process.start()
+        return process
+
+    threaded = worker_mode == "threaded"
+    target = _run_threaded_child if threaded else _run_warm_child
+    while not stopping:
+        child = ctx.Process(target=_child_main, args=(target,), name=f"rq-{worker_mode}-worker")
+        child.start()
+        while child.is_alive():
+            if threaded and not burst and not stopping and (scheduler is None or not scheduler.is_alive()):
+                if scheduler is not None:
+                    print(f"Scheduler exited with code {scheduler.exitcode}, restarting")
+                scheduler = start_scheduler()
+            child.join(timeout=5)
+        if child.exitcode != 0:
+            # a crash (segfault in a native library, OOM kill, ...) takes down one job, not the worker
+            print(f"Warm worker exited with code {child.exitcode}, restarting")
+            time.sleep(1)
+        elif burst:
+            break
+    if scheduler is not None:
+        if scheduler.is_alive():
+            os.kill(scheduler.pid, signal.SIGTERM)
+        scheduler.join()
+
+
+if __name__ == "__main__":
+    _setup_metrics()
+    if worker_mode in ("warm", "threaded"):
+        _supervise_warm()
+    else:
+        if worker_mode == "preload":
+            import jobs.tasks
+
+            jobs.tasks.preload()
+        redis_conn, queues = _connect()
+        _start(WeightedWorker(queues, connection=redis_conn))
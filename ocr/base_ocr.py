@@ -3,4 +3,7 @@ from abc import ABC, abstractmethod
 class BaseOCREngine(ABC):
     @abstractmethod
     def extract_text(self, file_path: str) -> str:
-        pass
\ No newline at end of file
+        pass
+
+    def close(self) -> None:
+        """Release pools / clients the engine holds (called when a job's components are torn down)."""
\ No newline at end of file
@@ -1,34 +1,62 @@
 import os
-from landingai_ade import LandingAIADE
+from landingai_ade import APIConnectionError, APIStatusError, APITimeoutError, LandingAIADE
 from dotenv import load_dotenv
 import json
 import mimetypes
-from openai.types import auto_file_chunking_strategy_param
-from invoice import Invoice
 from pathlib import Path
+from typing import TYPE_CHECKING
+
+from instrumentation import timed_call
+from resilience import get_policy, status_reason
+
+if TYPE_CHECKING:  # only for the annotation; importing invoice here would pull in fitz/openai
+    from invoice import Invoice
 load_dotenv()
 
 
+def retry_reason(exc: BaseException):
+    """Transient LandingAI failures (see resilience.CallPolicy)."""
+    if isinstance(exc, APITimeoutError):
+        return "timeout"
+    if isinstance(exc, APIConnectionError):
+        return "connection"
+    if isinstance(exc, APIStatusError):
+        return status_reason(exc.status_code)
+    return None
+
+
 class OCRAgenticProcessor:
     def __init__(self, model_id="dpt-2-latest", name="agentic_ocr"):
         self.client = LandingAIADE(
             apikey=os.environ["VISION_AGENT_API_KEY"],
-            environment="eu"
+            environment="eu",
+            max_retries=0,  # retried by the shared policy in extract_text
         )
         self.model_id = model_id
         self.name = name
 
+    def close(self) -> None:
+        self.client.close()
+
     def extract_text(self, invoice: "Invoice"):
         p = Path(invoice.local_input_path)  # ensure Path
 
         data = p.read_bytes()
         mime = mimetypes.guess_type(p.name)[0] or "application/pdf"
 
-        parse_res = self.client.parse(
-            document=(p.name, data, mime),   # ✅ unambiguous file upload
-            model=self.model_id,
-            split="page",
-        )
+        with timed_call("landingai", "parse", sent_bytes=len(data)) as call:
+            parse_res = get_policy("landingai", retry_reason).call(
+                "parse",
+                self.client.parse,
+                document=(p.name, data, mime),   # ✅ unambiguous file upload
+                model=self.model_id,
+                split="page",
+            )
+            call.received_bytes = len(parse_res.markdown or "")
+
+        metadata = getattr(parse_res, "metadata", None)
+        if metadata is not None and getattr(invoice, "usage", None) is not None:
+            invoice.usage.record_landingai_parse(self.model_id, pages=metadata.page_count, credits=metadata.credit_usage)
 
         markdown = parse_res.markdown
         n_pages = len(parse_res.splits)
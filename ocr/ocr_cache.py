@@ -0,0 +1,202 @@
+# ocr/ocr_cache.py
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+from ocr.base_ocr import BaseOCREngine
+from storage.storage import StorageBackend
+
+
+OCRResult = tuple[str, dict[int, str]]
+
+
+def ocr_cache_key(content_sha256: str, engine_name: str, model_id: str) -> str:
+    """Content-addressed key: same bytes + same engine/model -> same OCR output."""
+    raw = f"{content_sha256}|{engine_name}|{model_id}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _dump_result(markdown: str, markdown_by_page: dict[int, str], engine_name: str, model_id: str) -> bytes:
+    payload = {
+        "engine": engine_name,
+        "model_id": model_id,
+        "markdown": markdown,
+        # JSON object keys are strings; converted back to int on load
+        "markdown_by_page": {str(k): v for k, v in markdown_by_page.items()},
+    }
+    return json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+
+def _load_result(data: bytes) -> OCRResult:
+    payload = json.loads(data.decode("utf-8"))
+    markdown_by_page = {int(k): v for k, v in payload["markdown_by_page"].items()}
+    return payload["markdown"], markdown_by_page
+
+
+class LocalOCRCache:
+    """
+    Size-bounded on-disk cache. One JSON file per entry; file mtime is the
+    LRU clock (bumped on every hit), oldest files are evicted first.
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int = 512 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def get(self, key: str) -> Optional[bytes]:
+        p = self._path(key)
+        try:
+            data = p.read_bytes()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(p, None)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        p = self._path(key)
+        # write to a temp file + rename so concurrent readers never see half an entry
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, p)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        total = 0
+        for p in self.cache_dir.glob("*.json"):
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+            total += st.st_size
+
+        if total <= self.max_bytes:
+            return
+
+        for _, size, p in sorted(entries):
+            try:
+                p.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+
+class CachedOCREngine(BaseOCREngine):
+    """
+    Wraps any OCR engine exposing extract_text(invoice) -> (markdown, markdown_by_page)
+    with a content-addressed cache. Lookup order: local disk -> storage prefix -> engine.
+    """
+
+    def __init__(
+        self,
+        engine,
+        local_cache: Optional[LocalOCRCache] = None,
+        storage: Optional[StorageBackend] = None,
+        storage_prefix: Optional[str] = None,
+    ):
+        self.engine = engine
+        self.name = getattr(engine, "name", type(engine).__name__)
+        self.model_id = getattr(engine, "model_id", "")
+        self.local_cache = local_cache
+        self.storage = storage if storage_prefix else None
+        self.storage_prefix = storage_prefix.rstrip("/") if storage_prefix else None
+
+        self.hits = 0
+        self.misses = 0
+
+    def close(self) -> None:
+        self.engine.close()
+
+    def _storage_key(self, key: str) -> str:
+        return f"{self.storage_prefix}/{key}.json"
+
+    def _read_storage(self, key: str) -> Optional[bytes]:
+        if self.storage is None:
+            return None
+        storage_key = self._storage_key(key)
+        try:
+            if not self.storage.exists(storage_key):
+                return None
+            return self.storage.read_bytes(storage_key)
+        except Exception as e:
+            # the shared tier is best-effort; a broken cache must never fail the job
+            print(f"OCR cache read failed for {storage_key}: {e}")
+            return None
+
+    def _write_storage(self, key: str, data: bytes) -> None:
+        if self.storage is None:
+            return
+        storage_key = self._storage_key(key)
+        try:
+            self.storage.write_bytes(storage_key, data, content_type="application/json")
+        except Exception as e:
+            print(f"OCR cache write failed for {storage_key}: {e}")
+
+    def extract_text(self, invoice) -> OCRResult:
+        key = ocr_cache_key(invoice.content_sha256, self.name, self.model_id)
+
+        if self.local_cache is not None:
+            data = self.local_cache.get(key)
+            if data is not None:
+                self.hits += 1
+                return _load_result(data)
+
+        data = self._read_storage(key)
+        if data is not None:
+            self.hits += 1
+            if self.local_cache is not None:
+                self.local_cache.put(key, data)
+            return _load_result(data)
+
+        self.misses += 1
+        markdown, markdown_by_page = self.engine.extract_text(invoice)
+
+        data = _dump_result(markdown, markdown_by_page, self.name, self.model_id)
+        if self.local_cache is not None:
+            self.local_cache.put(key, data)
+        self._write_storage(key, data)
+
+        return markdown, markdown_by_page
+
+
+def build_cached_ocr_engine(engine, storage: Optional[StorageBackend] = None):
+    """
+    Wrap `engine` according to env:
+      OCR_CACHE=0                 disable caching entirely
+      OCR_CACHE_DIR               local tier directory (default: <tmp>/invoice_ocr_cache)
+      OCR_CACHE_MAX_BYTES         local tier size bound (default: 512 MiB)
+      OCR_CACHE_PREFIX            optional shared tier, e.g. s3://bucket/ocr_cache
+    """
+    if os.getenv("OCR_CACHE", "1") == "0":
+        return engine
+
+    cache_dir = Path(os.getenv("OCR_CACHE_DIR", Path(tempfile.gettempdir()) / "invoice_ocr_cache"))
+    max_bytes = int(os.getenv("OCR_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+    return CachedOCREngine(
+        engine,
+        local_cache=LocalOCRCache(cache_dir, max_bytes=max_bytes),
+        storage=storage,
+        storage_prefix=os.getenv("OCR_CACHE_PREFIX") or None,
+    )
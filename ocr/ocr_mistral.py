@@ -1,12 +1,12 @@
 import os
-import fitz  # PyMuPDF
-import tempfile
+import base64
 from ocr.base_ocr import BaseOCREngine
+from rendering.rasterizer import Rasterizer, get_rasterizer
 from utils import encode_image_to_base64, encode_pdf
 from mistralai import Mistral
 
 class MistralOCR(BaseOCREngine):
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, rasterizer: Rasterizer = None):
         """Initialize Mistral OCR with API key"""
         if api_key is None:
             api_key = os.getenv("MISTRAL_API_KEY")
@@ -14,6 +14,7 @@ class MistralOCR(BaseOCREngine):
             raise ValueError("Mistral API key is required. Set MISTRAL_API_KEY environment variable or pass it directly.")
         
         self.client = Mistral(api_key=api_key)
+        self.rasterizer = rasterizer or get_rasterizer()
     
     def extract_text(self, file_path: str) -> str:
         """Extract text from image or PDF using Mistral OCR"""
@@ -29,44 +30,35 @@ class MistralOCR(BaseOCREngine):
         try:
             # Encode image to base64
             base64_image = encode_image_to_base64(image_path)
-            
-            # Call Mistral OCR API
-            ocr_response = self.client.ocr.process(
-                model="mistral-ocr-latest",
-                document={
-                    "type": "image_url",
-                    "image_url": f"data:image/jpeg;base64,{base64_image}" 
-                },
-                include_image_base64=True
-            )
-            
-            return ocr_response.pages[0].markdown
+            return self._ocr_base64_image(base64_image, "image/jpeg")
             
         except Exception as e:
             raise Exception(f"Error processing image {image_path}: {str(e)}")
+
+    def _ocr_base64_image(self, base64_image: str, mime_type: str) -> str:
+        # Call Mistral OCR API
+        ocr_response = self.client.ocr.process(
+            model="mistral-ocr-latest",
+            document={
+                "type": "image_url",
+                "image_url": f"data:{mime_type};base64,{base64_image}" 
+            },
+            include_image_base64=True
+        )
+        
+        return ocr_response.pages[0].markdown
     
     def _process_pdf(self, pdf_path: str) -> str:
-        """Process PDF by converting pages to images and processing each"""
+        """Process PDF by rendering its pages on the rasterizer pool and processing each"""
         text = ""
         try:
-            with fitz.open(pdf_path) as doc:
-                for page_num in range(len(doc)):
-                    # Convert PDF page to image
-                    page = doc[page_num]
-                    pix = page.get_pixmap(dpi=300)
-                    tmp_img = tempfile.mktemp(suffix=".png")
-                    pix.save(tmp_img)
-                    
-                    try:
-                        # Process the page image
-                        page_text = self._process_image(tmp_img)
-                        text += f"\n\n--- PAGE {page_num + 1} ---\n\n" + page_text
-                    finally:
-                        # Clean up temporary file
-                        if os.path.exists(tmp_img):
-                            os.remove(tmp_img)
+            # pages come back as PNG bytes, no temporary files
+            pages = self.rasterizer.render_pages(pdf_path, dpi=300)
+            for page_num, png in enumerate(pages):
+                page_text = self._ocr_base64_image(base64.b64encode(png).decode("utf-8"), "image/png")
+                text += f"\n\n--- PAGE {page_num + 1} ---\n\n" + page_text
             
             return text
             
         except Exception as e:
-            raise Exception(f"Error processing PDF {pdf_path}: {str(e)}")
\ No newline at end of file
+            raise Exception(f"Error processing PDF {pdf_path}: {str(e)}")
@@ -1,26 +1,157 @@
-from PIL import Image
-import pytesseract
-import fitz  # PyMuPDF
-import tempfile
+# ocr/ocr_tesseract.py
+"""
+Local OCR with the tesseract CLI: no API key, no network, no per-page cost.
+Needs the binary and its language data on the worker machine, e.g.
+
+    apt-get install tesseract-ocr tesseract-ocr-deu
+
+Each PDF page is rendered to a grayscale pixmap and piped to `tesseract stdin
+stdout` as PGM, so nothing is written to disk and no PNG is encoded or decoded
+on the way. Pages are OCR'd one task each on a process pool (the shared
+Rasterizer pool unless a worker count is given): pool processes render and run
+tesseract side by side, one page per core.
+
+Follows the extract_text(invoice) -> (markdown, markdown_by_page) contract of
+Invoice.extract_markdown, so it can be the pipeline engine (OCR_ENGINE=tesseract)
+or the fallback of HybridOCR. The text is tesseract's plain output, not markdown
+tables.
+"""
+from __future__ import annotations
+
 import os
+import subprocess
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+import fitz
+
 from ocr.base_ocr import BaseOCREngine
+from ocr.ocr_cache import OCRResult
+from rendering.rasterizer import Rasterizer, fitz_lock, get_rasterizer, open_in_worker
+
+if TYPE_CHECKING:
+    from invoice import Invoice
+
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png", ".tif", ".tiff")
+
+
+@dataclass(frozen=True)
+class TesseractSettings:
+    lang: str = "deu+eng"
+    dpi: int = 300
+    config: str = ""  # extra CLI arguments, e.g. "--psm 6"
+    cmd: str = "tesseract"
+    timeout: float = 120.0  # per page, seconds
+
+    @classmethod
+    def from_env(cls) -> "TesseractSettings":
+        return cls(
+            lang=os.getenv("TESSERACT_LANG", "deu+eng"),
+            dpi=int(os.getenv("TESSERACT_DPI", "300")),
+            config=os.getenv("TESSERACT_CONFIG", ""),
+            cmd=os.getenv("TESSERACT_CMD", "tesseract"),
+            timeout=float(os.getenv("TESSERACT_TIMEOUT_SECONDS", "120")),
+        )
+
+    @property
+    def id(self) -> str:
+        return f"{self.lang}-{self.dpi}dpi" + (f"-{self.config}" if self.config else "")
+
+
+def run_tesseract(image: bytes, settings: TesseractSettings) -> str:
+    """Text of one encoded image (PGM, PNG, JPEG, TIFF), passed on stdin."""
+    args = [settings.cmd, "stdin", "stdout", "-l", settings.lang, "--dpi", str(settings.dpi), *settings.config.split()]
+    # one thread per tesseract: the pool already runs one page per core, and
+    # OpenMP threads on top of that only compete with each other
+    env = {**os.environ, "OMP_THREAD_LIMIT": "1"}
+    try:
+        proc = subprocess.run(args, input=image, capture_output=True, timeout=settings.timeout, env=env)
+    except FileNotFoundError:
+        raise RuntimeError(f"{settings.cmd!r} not found: install tesseract-ocr (and the {settings.lang} language data)") from None
+    if proc.returncode != 0:
+        raise RuntimeError(f"tesseract failed ({proc.returncode}): {proc.stderr.decode('utf-8', 'replace').strip()}")
+    return proc.stdout.decode("utf-8", "replace").strip()
+
+
+def _page_image(doc, index: int, dpi: int) -> bytes:
+    pix = doc[index].get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+    return pix.tobytes("pgm")
+
+
+# ---- work done inside the pool processes ----
+
+def _ocr_page_task(pdf_path: str, index: int, settings: TesseractSettings) -> str:
+    return run_tesseract(_page_image(open_in_worker(pdf_path), index, settings.dpi), settings)
+
+
+# ---- engine used by the pipeline ----
 
 class TesseractOCR(BaseOCREngine):
-    def extract_text(self, file_path: str) -> str:
-        if file_path.lower().endswith((".jpg", ".jpeg", ".png")):
-            return pytesseract.image_to_string(Image.open(file_path))
-
-        elif file_path.lower().endswith(".pdf"):
-            text = ""
-            with fitz.open(file_path) as doc:
-                for page in doc:
-                    pix = page.get_pixmap(dpi=300)
-                    tmp_img = tempfile.mktemp(suffix=".png")
-                    pix.save(tmp_img)
-                    page_text = pytesseract.image_to_string(Image.open(tmp_img))
-                    text += f"\n\n--- PAGE {page.number + 1} ---\n\n" + page_text
-                    os.remove(tmp_img)
-            return text
+    """
+    Tesseract over every page of a PDF (or a single image file). With
+    `workers` the engine gets a pool of its own (closed by close()); otherwise
+    it submits to the process-wide Rasterizer pool (RASTER_WORKERS). With one
+    worker pages are rendered and OCR'd in-process, in order.
+    """
+
+    def __init__(
+        self,
+        settings: Optional[TesseractSettings] = None,
+        workers: Optional[int] = None,
+        rasterizer: Optional[Rasterizer] = None,
+        name: str = "tesseract",
+    ):
+        self.settings = settings or TesseractSettings.from_env()
+        self._owns_rasterizer = rasterizer is None and workers is not None
+        if self._owns_rasterizer:
+            rasterizer = Rasterizer(max_workers=workers)
+        self.rasterizer = rasterizer or get_rasterizer()
+        self.name = name
+        self.model_id = self.settings.id
 
+    def extract_text(self, invoice: "Invoice") -> OCRResult:
+        path = Path(invoice.local_input_path)
+        suffix = path.suffix.lower()
+        if suffix in IMAGE_SUFFIXES:
+            texts = [run_tesseract(path.read_bytes(), self.settings)]
+        elif suffix == ".pdf":
+            texts = self.ocr_pdf(path)
         else:
-            raise ValueError("Unsupported file format for TesseractOCR")
\ No newline at end of file
+            raise ValueError(f"Unsupported file format for TesseractOCR: {path.name}")
+        markdown_by_page = {number: text for number, text in enumerate(texts, start=1)}
+        return "\n\n".join(texts), markdown_by_page
+
+    def ocr_pdf(self, pdf_path) -> list[str]:
+        """Text of every page, in page order."""
+        pdf_path = str(pdf_path)
+        with fitz_lock:
+            doc = fitz.open(pdf_path)
+        try:
+            page_count = len(doc)
+            pool = self.rasterizer.pool
+            if pool is None or page_count <= 1:
+                # one page at a time (a 300 dpi A4 page is ~9 MB of gray pixels),
+                # and fitz_lock is not held while tesseract runs
+                texts = []
+                for i in range(page_count):
+                    with fitz_lock:
+                        image = _page_image(doc, i, self.settings.dpi)
+                    texts.append(run_tesseract(image, self.settings))
+                return texts
+        finally:
+            with fitz_lock:
+                doc.close()
+
+        # one task per page: OCR time varies a lot between pages (a dense
+        # treatment table vs. a nearly empty last page), so small tasks balance
+        futures = [pool.submit(_ocr_page_task, pdf_path, i, self.settings) for i in range(page_count)]
+        try:
+            return [future.result() for future in futures]
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def close(self) -> None:
+        if self._owns_rasterizer:
+            self.rasterizer.close()
@@ -0,0 +1,239 @@
+# ocr/ocr_text_layer.py
+"""
+Markdown straight from a PDF's embedded text layer, for born-digital documents
+(practice-management systems, e-invoicing exports): no rendering, no remote
+OCR, milliseconds per page.
+
+TextLayerOCR reads every page from the text layer. HybridOCR checks each page
+first and sends only the pages whose text layer is missing or can't be trusted
+to the fallback engine, as one smaller PDF:
+
+  - fewer than TEXT_LAYER_MIN_CHARS visible characters (scans, vector outlines)
+  - images covering more than TEXT_LAYER_MAX_IMAGE_COVERAGE of the page (scans)
+  - mostly invisible text (a scanner's OCR layer on top of the page image)
+  - more than TEXT_LAYER_MAX_BAD_CHARS of the characters unmappable (fonts
+    without a ToUnicode map come out as U+FFFD / private-use code points)
+
+Both follow the extract_text(invoice) -> (markdown, markdown_by_page) contract
+of Invoice.extract_markdown.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+import fitz
+
+from instrumentation import OCR_PAGES
+from ocr.base_ocr import BaseOCREngine
+from ocr.ocr_cache import OCRResult
+from rendering.rasterizer import fitz_lock
+
+if TYPE_CHECKING:
+    from invoice import Invoice
+
+# bump when the markdown produced from a text layer changes (part of model_id,
+# so OCR caches and stage checkpoints of the old output are not reused)
+TEXT_LAYER_VERSION = "1"
+
+
+@dataclass(frozen=True)
+class TextLayerSettings:
+    min_chars: int = 40
+    max_image_coverage: float = 0.5
+    max_bad_chars: float = 0.02  # fraction of the visible characters
+    tables: bool = True  # ruled tables as markdown tables (find_tables)
+
+    @classmethod
+    def from_env(cls) -> "TextLayerSettings":
+        return cls(
+            min_chars=int(os.getenv("TEXT_LAYER_MIN_CHARS", "40")),
+            max_image_coverage=float(os.getenv("TEXT_LAYER_MAX_IMAGE_COVERAGE", "0.5")),
+            max_bad_chars=float(os.getenv("TEXT_LAYER_MAX_BAD_CHARS", "0.02")),
+            tables=os.getenv("TEXT_LAYER_TABLES", "1") != "0",
+        )
+
+    @property
+    def id(self) -> str:
+        return f"c{self.min_chars}-i{self.max_image_coverage:g}-b{self.max_bad_chars:g}-t{int(self.tables)}"
+
+
+@dataclass
+class PageText:
+    page_number: int  # 1-based
+    markdown: str
+    chars: int  # visible, non-whitespace
+    invisible_chars: int
+    bad_chars: int
+    image_coverage: float
+
+    def problem(self, settings: TextLayerSettings) -> Optional[str]:
+        """Why this page's text layer can't be used, or None if it can."""
+        if self.invisible_chars > self.chars:
+            return "invisible text (OCR layer of a scan)"
+        if self.chars < settings.min_chars:
+            return f"{self.chars} characters"
+        if self.image_coverage > settings.max_image_coverage:
+            return f"images cover {self.image_coverage:.0%}"
+        if self.bad_chars > settings.max_bad_chars * self.chars:
+            return f"{self.bad_chars} unmappable characters"
+        return None
+
+
+def _is_bad_char(ch: str) -> bool:
+    code = ord(ch)
+    return ch == "\ufffd" or 0xE000 <= code <= 0xF8FF or (code < 32 and ch not in "\t\n\r")
+
+
+def _inside(rect: fitz.Rect, area: fitz.Rect) -> bool:
+    """Mostly (by area) inside `area`."""
+    overlap = fitz.Rect(rect).intersect(area)
+    return not overlap.is_empty and overlap.get_area() >= 0.5 * rect.get_area()
+
+
+def read_page(page: fitz.Page, tables: bool = True) -> PageText:
+    """Markdown of one page from its text layer, plus what the quality checks need. Call under fitz_lock."""
+    items: list[tuple[fitz.Rect, str]] = []
+    table_areas: list[fitz.Rect] = []
+    if tables:
+        for table in page.find_tables().tables:
+            area = fitz.Rect(table.bbox)
+            table_areas.append(area)
+            items.append((area, table.to_markdown().strip()))
+
+    chars = invisible = bad = 0
+    for block in page.get_text("dict", sort=True)["blocks"]:
+        if block["type"] != 0:  # image block
+            continue
+        lines = []
+        for line in block["lines"]:
+            text = ""
+            for span in line["spans"]:
+                visible = sum(1 for ch in span["text"] if not ch.isspace())
+                if span.get("alpha", 255) == 0:  # render mode 3: there, but not painted
+                    invisible += visible
+                    continue
+                chars += visible
+                bad += sum(1 for ch in span["text"] if _is_bad_char(ch))
+                text += span["text"]
+            if text.strip():
+                lines.append(text.strip())
+        rect = fitz.Rect(block["bbox"])
+        if lines and not any(_inside(rect, area) for area in table_areas):
+            items.append((rect, "\n".join(lines)))
+
+    items.sort(key=lambda item: (round(item[0].y0, 1), item[0].x0))
+
+    page_area = page.rect.get_area() or 1.0
+    covered = sum(fitz.Rect(info["bbox"]).intersect(page.rect).get_area() for info in page.get_image_info())
+    return PageText(
+        page_number=page.number + 1,
+        markdown="\n\n".join(text for _, text in items),
+        chars=chars,
+        invisible_chars=invisible,
+        bad_chars=bad,
+        image_coverage=min(covered / page_area, 1.0),
+    )
+
+
+def read_pages(pdf_path, tables: bool = True) -> list[PageText]:
+    with fitz_lock, fitz.open(pdf_path) as doc:
+        return [read_page(page, tables) for page in doc]
+
+
+def _join(markdown_by_page: dict[int, str]) -> str:
+    return "\n\n".join(markdown_by_page.values())
+
+
+class TextLayerOCR(BaseOCREngine):
+    """Every page from the PDF text layer, whatever its quality (see HybridOCR for the checked version)."""
+
+    def __init__(self, settings: Optional[TextLayerSettings] = None, name: str = "text_layer"):
+        self.settings = settings or TextLayerSettings.from_env()
+        self.name = name
+        self.model_id = f"v{TEXT_LAYER_VERSION}:{self.settings.id}"
+
+    def extract_text(self, invoice: "Invoice") -> OCRResult:
+        path = Path(invoice.local_input_path)
+        if path.suffix.lower() != ".pdf":
+            raise ValueError(f"{path.name} is not a PDF and has no text layer (use OCR_ENGINE=hybrid)")
+        markdown_by_page = {page.page_number: page.markdown for page in read_pages(path, self.settings.tables)}
+        OCR_PAGES.labels("text_layer").inc(len(markdown_by_page))
+        return _join(markdown_by_page), markdown_by_page
+
+
+@dataclass
+class _PageSelection:
+    """The part of an Invoice that OCR engines read, for a PDF of some of its pages."""
+    local_input_path: Path
+    content_sha256: str  # OCR cache key
+    usage: object
+    page_number: int
+
+
+class HybridOCR(BaseOCREngine):
+    """
+    Text layer for the pages where it is good enough (TextLayerSettings), the
+    fallback engine (e.g. the cached LandingAI engine) for the rest. A document
+    without any usable page goes to the fallback as it is; otherwise only its
+    scanned pages are cut out into one PDF and sent, and the results are
+    mapped back to their page numbers.
+    """
+
+    def __init__(self, fallback, settings: Optional[TextLayerSettings] = None, name: str = "hybrid"):
+        self.fallback = fallback
+        self.settings = settings or TextLayerSettings.from_env()
+        self.name = name
+        fallback_id = f"{getattr(fallback, 'name', type(fallback).__name__)}:{getattr(fallback, 'model_id', '')}"
+        self.model_id = f"text_layer-v{TEXT_LAYER_VERSION}:{self.settings.id}+{fallback_id}"
+
+    def extract_text(self, invoice: "Invoice") -> OCRResult:
+        path = Path(invoice.local_input_path)
+        if path.suffix.lower() != ".pdf":
+            OCR_PAGES.labels("ocr").inc()
+            return self.fallback.extract_text(invoice)
+
+        pages = read_pages(path, self.settings.tables)
+        problems = {page.page_number: page.problem(self.settings) for page in pages}
+        scanned = [number for number, problem in problems.items() if problem is not None]
+        OCR_PAGES.labels("text_layer").inc(len(pages) - len(scanned))
+        OCR_PAGES.labels("ocr").inc(len(scanned))
+        if scanned:
+            reasons = ", ".join(f"{number}: {problems[number]}" for number in scanned[:5])
+            print(f"Text layer used for {len(pages) - len(scanned)}/{len(pages)} pages of {path.name}; OCR for pages {scanned} ({reasons})")
+
+        if not scanned:
+            markdown_by_page = {page.page_number: page.markdown for page in pages}
+            return _join(markdown_by_page), markdown_by_page
+        if len(scanned) == len(pages):
+            return self.fallback.extract_text(invoice)
+
+        markdown_by_page = {page.page_number: page.markdown for page in pages if page.page_number not in scanned}
+        _, ocr_by_page = self.fallback.extract_text(self._select_pages(invoice, path, scanned))
+        for i, number in enumerate(scanned, start=1):
+            markdown_by_page[number] = ocr_by_page.get(i, "")
+        markdown_by_page = {number: markdown_by_page[number] for number in sorted(markdown_by_page)}
+        return _join(markdown_by_page), markdown_by_page
+
+    def close(self) -> None:
+        self.fallback.close()
+
+    @staticmethod
+    def _select_pages(invoice: "Invoice", path: Path, page_numbers: list[int]) -> _PageSelection:
+        work_dir = Path(getattr(invoice, "work_dir", path.parent))
+        out = work_dir / f"{path.stem}_ocr_pages.pdf"
+        with fitz_lock, fitz.open(path) as doc:
+            doc.select([number - 1 for number in page_numbers])
+            doc.save(out, garbage=3, deflate=True)
+        # saved PDFs aren't byte-stable (fresh /ID): the cache key comes from the source document instead
+        selection = ",".join(map(str, page_numbers))
+        key = hashlib.sha256(f"{invoice.content_sha256}|pages={selection}".encode("utf-8")).hexdigest()
+        return _PageSelection(
+            local_input_path=out,
+            content_sha256=key,
+            usage=getattr(invoice, "usage", None),
+            page_number=len(page_numbers),
+        )
@@ -1,20 +1,43 @@
-from openai import OpenAI
-from utils import convert_file_to_images, extract_json_from_response
+from utils import convert_file_to_images, extract_json_from_response, estimate_text_tokens, estimate_image_tokens
+import asyncio
 import base64
+import mimetypes
+import os
+from PIL import Image
+from rendering.image_policy import ImagePolicy
 from prompt_building.prompt_building import build_prompt_from_config
+from processors.openai_clients import get_openai_client, get_async_openai_client, openai_policy
+from processors.rate_limiter import TokenBucketRateLimiter
+from instrumentation import timed_call
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:  # annotation only; the ledger lives with the jobs
+    from jobs.usage_ledger import JobUsage
 import json
 import re
 
 
+def _content_bytes(content_blocks: list[dict]) -> int:
+    # prompt text + base64 data URLs: what actually goes over the wire, without serializing it again
+    return sum(len(b["text"]) if b["type"] == "text" else len(b["image_url"]["url"]) for b in content_blocks)
+
+
 class GPTInvoiceProcessor:
-    def __init__(self, model="gpt-4", name="gpt_processor", vision_model=None, api_key=None, ocr_engine=None):
-        self.client = OpenAI(api_key=api_key)   
+    def __init__(self, model="gpt-4", name="gpt_processor", vision_model=None, api_key=None, ocr_engine=None,
+                 rate_limiter: TokenBucketRateLimiter | None = None, image_policy: ImagePolicy | None = None):
+        self.api_key = api_key
+        self.image_policy = image_policy  # None keeps the original 150 DPI PNG / detail=auto behaviour
+        self.client = get_openai_client(api_key)
         self.model = model
         self.name = name
         self.vision_model = vision_model
+        self.rate_limiter = rate_limiter
 
-
-    def extract(self, img_file_path: str, use_ocr=True, use_vision=True, markdown_text="", prompt="", animal_information={}) -> str:
+    def _build_request(self, img_file_path: str | list[str], use_ocr, use_vision, markdown_text, prompt, animal_information):
+        """
+        Returns (model, content_blocks, estimated_tokens) for one extraction call.
+        `img_file_path` may be a list when a subdocument is stored as one image per page.
+        """
         if use_ocr and markdown_text == "":
             raise ValueError("Not enough markdown text information to extract data from document.")
         if use_vision and not self.vision_model:
@@ -24,38 +47,113 @@ class GPTInvoiceProcessor:
             prompt = build_prompt_from_config("configs/extraction_config.json", use_ocr=use_ocr, use_vision=use_vision, ocr_text=markdown_text, animal_information=animal_information)
 
         content_blocks = [{"type": "text", "text": prompt}]
+        estimated_tokens = estimate_text_tokens(prompt)
 
         if use_vision:
-            images = convert_file_to_images(img_file_path)      
-            for img_path in images:
-                with open(img_path, "rb") as f:
-                    b64 = base64.b64encode(f.read()).decode("utf-8")
-                    content_blocks.append({
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/png;base64,{b64}",
-                            "detail": "auto"
+            detail = self.image_policy.detail if self.image_policy else "auto"
+            paths = [img_file_path] if isinstance(img_file_path, str) else list(img_file_path)
+            images = []
+            try:
+                for path in paths:
+                    images += convert_file_to_images(path, self.image_policy)
+                for img_path in images:
+                    with Image.open(img_path) as img:
+                        estimated_tokens += estimate_image_tokens(img.width, img.height, detail)
+                    mime = mimetypes.guess_type(img_path)[0] or "image/png"
+                    with open(img_path, "rb") as f:
+                        b64 = base64.b64encode(f.read()).decode("utf-8")
+                        content_blocks.append({
+                            "type": "image_url",
+                            "image_url": {
+                                "url": f"data:{mime};base64,{b64}",
+                                "detail": detail
+                            }
                         }
-                    }
-                )
+                    )
+            finally:
+                # rendered pages and downscaled images are temp files: the request holds them as base64
+                for img_path in images:
+                    if img_path not in paths:
+                        os.remove(img_path)
         model = self.vision_model if use_vision else self.model
-        response = self.client.chat.completions.create(
+        return model, content_blocks, estimated_tokens
+
+    def build_request_body(self, img_file_path: str | list[str], use_ocr=True, use_vision=True, markdown_text="", prompt="", animal_information={}) -> dict:
+        """The chat.completions body extract() would send, e.g. for a Batch API request line."""
+        model, content_blocks, _ = self._build_request(
+            img_file_path, use_ocr, use_vision, markdown_text, prompt, animal_information
+        )
+        return {
+            "model": model,
+            "messages": [{"role": "user", "content": content_blocks}],
+            "temperature": 0,
+        }
+
+    def _parse_response(self, response, usage: "JobUsage | None" = None) -> dict:
+        # tokens and cost (from the model price table) go to the job's usage ledger
+        if usage is not None:
+            usage.record_chat_completion("extraction", response)
+        json_result = extract_json_from_response(response.choices[0].message.content)
+        return json_result
+
+    def extract(self, img_file_path: str | list[str], use_ocr=True, use_vision=True, markdown_text="", prompt="", animal_information={},
+                usage: "JobUsage | None" = None) -> str:
+        model, content_blocks, estimated_tokens = self._build_request(
+            img_file_path, use_ocr, use_vision, markdown_text, prompt, animal_information
+        )
+
+        if self.rate_limiter:
+            self.rate_limiter.acquire_blocking(estimated_tokens)
+        with timed_call("openai", "extraction", sent_bytes=_content_bytes(content_blocks)) as call:
+            response = openai_policy().call(
+                "extraction",
+                self.client.chat.completions.create,
                 model=model,
                 messages=[{"role": "user", "content": content_blocks}],
-                temperature=0
+                temperature=0,
+                on_discard=None if usage is None else (lambda discarded: usage.record_chat_completion("extraction_hedge", discarded)),
             )
+            call.received_bytes = len(response.choices[0].message.content or "")
+        if self.rate_limiter:
+            self.rate_limiter.settle(estimated_tokens, response.usage.total_tokens)
 
-        usage = response.usage
-        prompt_tokens = usage.prompt_tokens
-        completion_tokens = usage.completion_tokens
-        # total_tokens = usage.total_tokens
+        return self._parse_response(response, usage)
 
-        # Model-specific pricing (USD per 1K tokens)
-        PROMPT_RATE = 0.00015
-        COMPLETION_RATE = 0.0006
-        cost = (prompt_tokens / 1000 * PROMPT_RATE) + (completion_tokens / 1000 * COMPLETION_RATE)
-        #print(f"Cost of this call: ${cost:.6f}")
 
-        #result = response.choices[0].message.content
-        json_result = extract_json_from_response(response.choices[0].message.content)
-        return json_result
+class AsyncGPTInvoiceProcessor(GPTInvoiceProcessor):
+    """
+    asyncio-native variant: same prompt/response handling, but extract() is a
+    coroutine on the shared per-loop AsyncOpenAI client, so many subdocuments
+    can be in flight on one connection pool. Pair with a TokenBucketRateLimiter
+    to raise concurrency without running into 429s.
+    """
+
+    def __init__(self, model="gpt-4", name="gpt_processor_async", vision_model=None, api_key=None, ocr_engine=None,
+                 rate_limiter: TokenBucketRateLimiter | None = None, image_policy: ImagePolicy | None = None):
+        super().__init__(model=model, name=name, vision_model=vision_model, api_key=api_key,
+                         ocr_engine=ocr_engine, rate_limiter=rate_limiter, image_policy=image_policy)
+
+    async def extract(self, img_file_path: str | list[str], use_ocr=True, use_vision=True, markdown_text="", prompt="", animal_information={},
+                      usage: "JobUsage | None" = None) -> str:
+        # image reading/encoding is blocking file work -> keep it off the event loop
+        model, content_blocks, estimated_tokens = await asyncio.to_thread(
+            self._build_request,
+            img_file_path, use_ocr, use_vision, markdown_text, prompt, animal_information
+        )
+
+        if self.rate_limiter:
+            await self.rate_limiter.acquire(estimated_tokens)
+        client = get_async_openai_client(self.api_key)
+        with timed_call("openai", "extraction", sent_bytes=_content_bytes(content_blocks)) as call:
+            response = await openai_policy().acall(
+                "extraction",
+                client.chat.completions.create,
+                model=model,
+                messages=[{"role": "user", "content": content_blocks}],
+                temperature=0,
+            )
+            call.received_bytes = len(response.choices[0].message.content or "")
+        if self.rate_limiter:
+            self.rate_limiter.settle(estimated_tokens, response.usage.total_tokens)
+
+        return self._parse_response(response, usage)
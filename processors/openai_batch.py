@@ -0,0 +1,185 @@
+# processors/openai_batch.py
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Optional
+
+from openai import OpenAI
+from openai.types.chat import ChatCompletion
+
+from processors.openai_clients import get_openai_client, openai_policy
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+# API limits are 50,000 requests and 200 MB per input file; stay a little below the size cap
+MAX_REQUESTS_PER_FILE = 50_000
+MAX_BYTES_PER_FILE = 190 * 1024 * 1024
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+@dataclass
+class BatchRequest:
+    custom_id: str
+    body: dict  # chat.completions request body
+
+
+class BatchRequestError(RuntimeError):
+    pass
+
+
+def write_batch_files(
+    requests: Iterable[BatchRequest],
+    out_dir: Path,
+    prefix: str = "batch",
+    max_requests: int = MAX_REQUESTS_PER_FILE,
+    max_bytes: int = MAX_BYTES_PER_FILE,
+) -> tuple[list[Path], list[str]]:
+    """
+    Write Batch API JSONL input files, starting a new file whenever a count or
+    size limit would be hit. `requests` is consumed lazily, so request bodies
+    (base64 images) never have to be in memory all at once.
+    Returns (file paths, custom_ids written).
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths: list[Path] = []
+    custom_ids: list[str] = []
+    f = None
+    count = size = 0
+    try:
+        for req in requests:
+            line = json.dumps(
+                {"custom_id": req.custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": req.body},
+                ensure_ascii=False,
+            ).encode("utf-8") + b"\n"
+            if len(line) > max_bytes:
+                raise BatchRequestError(f"Request {req.custom_id} alone exceeds the batch file limit of {max_bytes} bytes.")
+            if f is None or count >= max_requests or size + len(line) > max_bytes:
+                if f is not None:
+                    f.close()
+                paths.append(out_dir / f"{prefix}_{len(paths):04d}.jsonl")
+                f = open(paths[-1], "wb")
+                count = size = 0
+            f.write(line)
+            custom_ids.append(req.custom_id)
+            count += 1
+            size += len(line)
+    finally:
+        if f is not None:
+            f.close()
+    return paths, custom_ids
+
+
+class OpenAIBatchRunner:
+    """
+    Runs chat.completions requests through the OpenAI Batch API (half the price,
+    up to `completion_window` latency): writes chunked JSONL, uploads and submits
+    every chunk, polls until all batches are done and maps the output back to
+    custom_ids. Point OPENAI_BASE_URL at fake_openai_batch_server.py to run it offline.
+    """
+
+    def __init__(
+        self,
+        client: Optional[OpenAI] = None,
+        work_dir: Optional[Path] = None,
+        poll_interval: float = 30.0,
+        completion_window: str = "24h",
+        max_requests_per_file: int = MAX_REQUESTS_PER_FILE,
+        max_bytes_per_file: int = MAX_BYTES_PER_FILE,
+    ):
+        self.client = client or get_openai_client()
+        self.work_dir = Path(work_dir or tempfile.mkdtemp(prefix="openai_batch_"))
+        self.poll_interval = poll_interval
+        self.completion_window = completion_window
+        self.max_requests_per_file = max_requests_per_file
+        self.max_bytes_per_file = max_bytes_per_file
+
+    def _upload(self, path: Path):
+        # opened per attempt: a retry must not send a half-read file
+        with open(path, "rb") as f:
+            return self.client.files.create(file=(path.name, f), purpose="batch")
+
+    def submit(self, requests: Iterable[BatchRequest], label: str) -> tuple[list[str], list[str]]:
+        """Write, upload and submit; returns (batch ids, custom_ids submitted)."""
+        paths, custom_ids = write_batch_files(
+            requests, self.work_dir, prefix=label,
+            max_requests=self.max_requests_per_file, max_bytes=self.max_bytes_per_file,
+        )
+        batch_ids = []
+        for path in paths:
+            input_file = openai_policy().call("batch_upload", self._upload, path)
+            batch = openai_policy().call(
+                "batch_create",
+                self.client.batches.create,
+                input_file_id=input_file.id,
+                endpoint=BATCH_ENDPOINT,
+                completion_window=self.completion_window,
+                metadata={"label": label, "chunk": path.stem},
+            )
+            print(f"Submitted batch {batch.id} ({path.name}, {path.stat().st_size} bytes)")
+            batch_ids.append(batch.id)
+        return batch_ids, custom_ids
+
+    def wait(self, batch_ids: list[str], timeout: Optional[float] = None) -> list:
+        deadline = time.monotonic() + timeout if timeout else None
+        done: dict[str, object] = {}
+        while True:
+            for batch_id in batch_ids:
+                if batch_id in done:
+                    continue
+                batch = openai_policy().call("batch_retrieve", self.client.batches.retrieve, batch_id)
+                if batch.status in TERMINAL_STATUSES:
+                    counts = batch.request_counts
+                    print(f"Batch {batch_id} {batch.status}"
+                          + (f" ({counts.completed} ok, {counts.failed} failed)" if counts else ""))
+                    done[batch_id] = batch
+            if len(done) == len(batch_ids):
+                return [done[batch_id] for batch_id in batch_ids]
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"Batches still running after {timeout}s: {sorted(set(batch_ids) - set(done))}")
+            time.sleep(self.poll_interval)
+
+    def _read_file(self, file_id: Optional[str]) -> list[dict]:
+        if not file_id:
+            return []
+        text = openai_policy().call("batch_download", self.client.files.content, file_id).text
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    def collect(self, batches: list) -> dict[str, ChatCompletion | Exception]:
+        results: dict[str, ChatCompletion | Exception] = {}
+        for batch in batches:
+            for line in self._read_file(batch.output_file_id) + self._read_file(batch.error_file_id):
+                custom_id = line["custom_id"]
+                response = line.get("response") or {}
+                if line.get("error") or response.get("status_code") != 200:
+                    error = line.get("error") or response.get("body", {}).get("error") or {}
+                    results[custom_id] = BatchRequestError(
+                        f"{error.get('code', response.get('status_code'))}: {error.get('message', 'request failed')}"
+                    )
+                else:
+                    results[custom_id] = ChatCompletion.model_validate(response["body"])
+        return results
+
+    def run(self, requests: Iterable[BatchRequest], label: str, timeout: Optional[float] = None) -> dict[str, ChatCompletion | Exception]:
+        """Submit, wait and collect. Requests without any result line (expired/failed batch) map to an error."""
+        batch_ids, custom_ids = self.submit(requests, label)
+        if not batch_ids:
+            return {}
+        batches = self.wait(batch_ids, timeout=timeout)
+        results = self.collect(batches)
+        statuses = ", ".join(sorted({b.status for b in batches}))
+        for custom_id in custom_ids:
+            results.setdefault(custom_id, BatchRequestError(f"No result for {custom_id} (batch status: {statuses})."))
+        return results
+
+
+def build_batch_runner(work_dir: Optional[Path] = None) -> OpenAIBatchRunner:
+    """Runner configured from env: OPENAI_BATCH_POLL_INTERVAL (seconds), OPENAI_BATCH_COMPLETION_WINDOW."""
+    return OpenAIBatchRunner(
+        work_dir=work_dir,
+        poll_interval=float(os.getenv("OPENAI_BATCH_POLL_INTERVAL", "30")),
+        completion_window=os.getenv("OPENAI_BATCH_COMPLETION_WINDOW", "24h"),
+    )
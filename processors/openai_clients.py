@@ -0,0 +1,108 @@
+# processors/openai_clients.py
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import weakref
+from typing import Optional
+
+import httpx
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+    AsyncOpenAI,
+    DefaultAsyncHttpxClient,
+    DefaultHttpxClient,
+    OpenAI,
+)
+
+from resilience import CallPolicy, get_policy, status_reason
+
+
+# Keep-alive pool sized for a worker running a handful of concurrent extractions
+_LIMITS = httpx.Limits(
+    max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", "50")),
+    max_keepalive_connections=int(os.getenv("OPENAI_MAX_KEEPALIVE", "20")),
+    keepalive_expiry=60.0,
+)
+
+_lock = threading.Lock()
+_sync_clients: dict[tuple[int, Optional[str]], OpenAI] = {}
+# httpx async connections belong to the event loop that opened them, so async
+# clients are shared per loop: run_async() keeps one long-lived loop per worker thread
+_thread_loop = threading.local()
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[Optional[str], AsyncOpenAI]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_openai_client(api_key: Optional[str] = None) -> OpenAI:
+    """
+    Process-wide OpenAI client (rebuilt after fork, never shared across processes).
+    The SDK's own retries are off: calls go through openai_policy().
+    """
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    cache_key = (os.getpid(), api_key)
+    with _lock:
+        client = _sync_clients.get(cache_key)
+        if client is None:
+            client = OpenAI(api_key=api_key, http_client=DefaultHttpxClient(limits=_LIMITS), max_retries=0)
+            _sync_clients[cache_key] = client
+        return client
+
+
+def get_async_openai_client(api_key: Optional[str] = None) -> AsyncOpenAI:
+    """AsyncOpenAI client shared by everything running on the current event loop."""
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    loop = asyncio.get_running_loop()
+    with _lock:
+        per_loop = _async_clients.setdefault(loop, {})
+        client = per_loop.get(api_key)
+        if client is None:
+            client = AsyncOpenAI(
+                api_key=api_key, http_client=DefaultAsyncHttpxClient(limits=_LIMITS), max_retries=0
+            )
+            per_loop[api_key] = client
+        return client
+
+
+def run_async(coro):
+    """
+    Run `coro` to completion on this thread's long-lived event loop. Unlike
+    asyncio.run (a new loop per call), every job the thread runs then shares
+    the loop's AsyncOpenAI client and its keep-alive connections, instead of
+    leaving one unclosed client (and its sockets) behind per job.
+    """
+    loop = getattr(_thread_loop, "loop", None)
+    if loop is None or loop.is_closed() or _thread_loop.pid != os.getpid():
+        # a loop inherited through fork belongs to the parent
+        loop = asyncio.new_event_loop()
+        _thread_loop.loop, _thread_loop.pid = loop, os.getpid()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        # like asyncio.run: nothing of this call keeps running into the next one
+        leftover = asyncio.all_tasks(loop)
+        for task in leftover:
+            task.cancel()
+        if leftover:
+            loop.run_until_complete(asyncio.gather(*leftover, return_exceptions=True))
+
+
+def retry_reason(exc: BaseException) -> Optional[str]:
+    """Transient OpenAI failures (see resilience.CallPolicy)."""
+    if isinstance(exc, APITimeoutError):
+        return "timeout"
+    if isinstance(exc, APIConnectionError):
+        return "connection"
+    if isinstance(exc, APIStatusError):
+        if getattr(exc, "code", None) == "insufficient_quota":
+            return None  # a 429 that waiting won't fix
+        return status_reason(exc.status_code)
+    return None
+
+
+def openai_policy() -> CallPolicy:
+    return get_policy("openai", retry_reason)
@@ -0,0 +1,94 @@
+# processors/rate_limiter.py
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import time
+from typing import Optional
+
+
+class TokenBucketRateLimiter:
+    """
+    Two token buckets (requests/minute and tokens/minute) in front of the OpenAI API.
+
+    Callers reserve an *estimated* token count before a request and settle it
+    against the real `usage.total_tokens` afterwards, so the TPM bucket tracks
+    what the API actually charged. State is guarded by a threading lock, which
+    makes one limiter usable from threads (acquire_blocking) and from any event
+    loop (acquire) at the same time.
+    """
+
+    def __init__(self, requests_per_minute: Optional[int] = None, tokens_per_minute: Optional[int] = None):
+        self.rpm = requests_per_minute
+        self.tpm = tokens_per_minute
+        self._lock = threading.Lock()
+        now = time.monotonic()
+        self._req_level = float(requests_per_minute or 0)
+        self._tok_level = float(tokens_per_minute or 0)
+        self._updated = now
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        self._updated = now
+        if self.rpm:
+            self._req_level = min(float(self.rpm), self._req_level + elapsed * self.rpm / 60.0)
+        if self.tpm:
+            self._tok_level = min(float(self.tpm), self._tok_level + elapsed * self.tpm / 60.0)
+
+    def _try_acquire(self, tokens: int) -> float:
+        """Take capacity if available and return 0, otherwise return seconds to wait."""
+        with self._lock:
+            self._refill(time.monotonic())
+            # a single request larger than the whole bucket would wait forever
+            tokens = min(tokens, self.tpm) if self.tpm else tokens
+
+            wait = 0.0
+            if self.rpm and self._req_level < 1:
+                wait = max(wait, (1 - self._req_level) * 60.0 / self.rpm)
+            if self.tpm and self._tok_level < tokens:
+                wait = max(wait, (tokens - self._tok_level) * 60.0 / self.tpm)
+            if wait > 0:
+                return wait
+
+            if self.rpm:
+                self._req_level -= 1
+            if self.tpm:
+                self._tok_level -= tokens
+            return 0.0
+
+    async def acquire(self, estimated_tokens: int = 0) -> None:
+        while (wait := self._try_acquire(estimated_tokens)) > 0:
+            await asyncio.sleep(wait)
+
+    def acquire_blocking(self, estimated_tokens: int = 0) -> None:
+        while (wait := self._try_acquire(estimated_tokens)) > 0:
+            time.sleep(wait)
+
+    def settle(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """Correct the TPM bucket once the real usage is known (refund or extra charge)."""
+        if not self.tpm:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tok_level = min(float(self.tpm), self._tok_level + estimated_tokens - actual_tokens)
+
+
+_shared: Optional[TokenBucketRateLimiter] = None
+_shared_lock = threading.Lock()
+
+
+def get_rate_limiter() -> Optional[TokenBucketRateLimiter]:
+    """
+    Per-process limiter from env (OPENAI_RPM / OPENAI_TPM). Returns None when
+    neither is set so callers can skip limiting entirely.
+    """
+    global _shared
+    rpm = int(os.getenv("OPENAI_RPM", "0")) or None
+    tpm = int(os.getenv("OPENAI_TPM", "0")) or None
+    if rpm is None and tpm is None:
+        return None
+    with _shared_lock:
+        if _shared is None:
+            _shared = TokenBucketRateLimiter(requests_per_minute=rpm, tokens_per_minute=tpm)
+        return _shared
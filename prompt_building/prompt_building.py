@@ -1,4 +1,7 @@
 import json
+from prompt_building.prompt_registry import get_registry, full_prompt_animals_section
+
+DEFAULT_CONFIG_PATH = "configs/extraction_config.json"
 
 # build_prompt_from_config("configs/extraction_config.json", use_ocr=True, use_vision=True, ocr_text=ocr_text)
 
@@ -24,13 +27,35 @@ def build_prompt_from_config_old(config_path="configs/extraction_config.json", u
 
     return f"{header}\n\n{body}\n\n{footer}"
 
-def build_prompt_for_analyze_document(config_path="configs/extraction_config.json", markdown_text=""):
+def build_prompt_for_analyze_document(config_path=DEFAULT_CONFIG_PATH, markdown_text=""):
+    return _registry(config_path).analysis_prompt(markdown_text=markdown_text)
+
+def build_prompt_from_config(config_path=DEFAULT_CONFIG_PATH, use_ocr=False, use_vision=False, ocr_text="", animal_information={}):
+    return _registry(config_path).extraction_prompt(
+        use_ocr=use_ocr, use_vision=use_vision, ocr_text=ocr_text, animal_information=animal_information
+    )
+
+def get_full_prompt(ocr_text="", animal_information={}):
+    return _registry(DEFAULT_CONFIG_PATH).full_prompt(ocr_text=ocr_text, animal_information=animal_information)
+
+def prompt_version(config_path=DEFAULT_CONFIG_PATH) -> str:
+    """Hash of the active prompt set; changes whenever the config or the full prompt template changes."""
+    return _registry(config_path).get_version()
+
+def _registry(config_path):
+    return get_registry(config_path, FULL_PROMPT_TEMPLATE)
+
+
+# Uncached builders: the original per-call implementations (re-read the config
+# every time). Kept as the baseline for bench_prompt_building.py.
+
+def build_prompt_for_analyze_document_uncached(config_path=DEFAULT_CONFIG_PATH, markdown_text=""):
     with open(config_path, "r") as f:
         config = json.load(f)   
     
     return config["analysis_prompt"].format(markdown_text=markdown_text)
 
-def build_prompt_from_config(config_path="configs/extraction_config.json", use_ocr=False, use_vision=False, ocr_text="", animal_information={}):
+def build_prompt_from_config_uncached(config_path=DEFAULT_CONFIG_PATH, use_ocr=False, use_vision=False, ocr_text="", animal_information={}):
     with open(config_path, "r") as f:
         config = json.load(f)   
 
@@ -62,17 +87,14 @@ def build_prompt_from_config(config_path="configs/extraction_config.json", use_o
 
 
 
-def get_full_prompt(ocr_text="", animal_information={}):
-    if animal_information:
-        animals_section = "\n".join([f"{animal['name']} (Tierart: {animal['species']}, Rasse: {animal['breed']})" 
-                                    if animal['breed'] != ""
-                                    else f"{animal['name']} (Tierart: {animal['species']})" 
-                                    for animal in animal_information])
-        animals_section = f"Die folgenden Tiere werden in der Rechnung oder Quittung erwähnt: {animals_section}. Diese Information ist wichtig für die Extrahierung der Leistungen auf der Rechnung oder Quittung."
-    else:
-        animals_section = ""
-        
-    return f"""
+def get_full_prompt_uncached(ocr_text="", animal_information={}):
+    return FULL_PROMPT_TEMPLATE.format(
+        ocr_text=ocr_text, animals_section=full_prompt_animals_section(animal_information)
+    )
+
+
+# str.format template (literal JSON braces are doubled)
+FULL_PROMPT_TEMPLATE = """
             Du bist ein Experte für die Analyse von Tierarzt- und Tierphysiotherapie-Rechnungen.
             Deine Aufgabe ist es, aus der untenstehenden Rechnung strukturierte Informationen zu extrahieren
             und sie ausschließlich als gültiges JSON-Objekt im definierten Schema zurückzugeben.
@@ -170,4 +192,4 @@ def get_full_prompt(ocr_text="", animal_information={}):
 
             Nur das vollständige JSON-Objekt ausgeben, ohne Erklärung oder Markdown.
             Wenn du unsicher bist, gib den wahrscheinlichsten Wert und eine kurze Begründung in warnings.
-            """
\ No newline at end of file
+            """
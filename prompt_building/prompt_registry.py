@@ -0,0 +1,145 @@
+# prompt_building/prompt_registry.py
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import string
+import threading
+from pathlib import Path
+
+
+class CompiledTemplate:
+    """
+    A str.format template split once into literal chunks and field names,
+    so rendering is a single join instead of re-parsing the template per call.
+    """
+
+    def __init__(self, template: str):
+        self.parts: list[tuple[str, str | None]] = []
+        for literal, field_name, format_spec, conversion in string.Formatter().parse(template):
+            if format_spec or conversion:
+                raise ValueError(f"Prompt templates only support plain {{name}} fields, got '{field_name}'.")
+            self.parts.append((literal, field_name))
+
+    def render(self, **values) -> str:
+        return "".join(
+            literal if field_name is None else literal + str(values[field_name])
+            for literal, field_name in self.parts
+        )
+
+
+def _animals_string(animal_information, sep: str) -> str:
+    return sep.join([f"{animal['name']} (Tierart: {animal['species']}, Rasse: {animal['breed']})"
+                     if animal['breed'] != ""
+                     else f"{animal['name']} (Tierart: {animal['species']})"
+                     for animal in animal_information])
+
+
+def full_prompt_animals_section(animal_information) -> str:
+    if not animal_information:
+        return ""
+    return (
+        "Die folgenden Tiere werden in der Rechnung oder Quittung erwähnt: "
+        f"{_animals_string(animal_information, chr(10))}. Diese Information ist wichtig "
+        "für die Extrahierung der Leistungen auf der Rechnung oder Quittung."
+    )
+
+
+class PromptRegistry:
+    """
+    Parsed + precompiled prompts from one extraction config file.
+
+    The file is re-read only when its mtime/size changes, and re-compiled only
+    when its content hash changes. `version` identifies the active prompt set
+    (config content + the built-in full extraction template) and is meant as a
+    cache key for anything derived from prompts.
+    """
+
+    def __init__(self, config_path: str | Path, full_prompt_template: str):
+        self.config_path = Path(config_path)
+        self._full_prompt_template = full_prompt_template
+        self._full_prompt = CompiledTemplate(full_prompt_template)
+        self._lock = threading.Lock()
+        self._stat_key: tuple[int, int] | None = None
+        self._content_hash: str | None = None
+        self._load_if_changed()
+
+    def _load_if_changed(self) -> None:
+        st = os.stat(self.config_path)
+        stat_key = (st.st_mtime_ns, st.st_size)
+        if stat_key == self._stat_key:
+            return
+        with self._lock:
+            if stat_key == self._stat_key:
+                return
+            raw = self.config_path.read_bytes()
+            content_hash = hashlib.sha256(raw).hexdigest()
+            if content_hash != self._content_hash:
+                self._compile(json.loads(raw))
+                self._content_hash = content_hash
+                self.version = hashlib.sha256(
+                    (content_hash + self._full_prompt_template).encode("utf-8")
+                ).hexdigest()[:16]
+            self._stat_key = stat_key
+
+    def _compile(self, config: dict) -> None:
+        tpl = config["prompt_template"]
+        fmt = tpl["field_format"]
+        self.config = config
+        self._analysis = CompiledTemplate(config["analysis_prompt"])
+        self._header = tpl["header"]
+        self._image_part = tpl["image_part"]
+        self._ocr_text = CompiledTemplate(tpl["ocr_text"])
+        self._animals_section = CompiledTemplate(tpl["animals_section"])
+        # the field list never depends on call arguments -> build it once
+        self._body = "\n".join(
+            fmt.format(readable_name=key, description=field["description"])
+            for key, field in config["extraction_fields"].items()
+        )
+        self._footer = tpl["footer"]
+
+    def get_version(self) -> str:
+        self._load_if_changed()
+        return self.version
+
+    def analysis_prompt(self, markdown_text: str = "") -> str:
+        self._load_if_changed()
+        return self._analysis.render(markdown_text=markdown_text)
+
+    def extraction_prompt(self, use_ocr=False, use_vision=False, ocr_text="", animal_information=None) -> str:
+        self._load_if_changed()
+        header = self._header
+        if use_vision:
+            header = header + "\n\n" + self._image_part
+        if use_ocr:
+            header = header + "\n\n" + self._ocr_text.render(ocr_text=ocr_text)
+
+        if animal_information:
+            animals_section = self._animals_section.render(
+                animals_string=_animals_string(animal_information, "\n ")
+            )
+            return f"{header}\n\n{animals_section}\n\n{self._body}\n\n{self._footer}"
+        return f"{header}\n\n{self._body}\n\n{self._footer}"
+
+    def full_prompt(self, ocr_text: str = "", animal_information=None) -> str:
+        return self._full_prompt.render(
+            ocr_text=ocr_text, animals_section=full_prompt_animals_section(animal_information)
+        )
+
+
+_registries: dict[str, PromptRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(config_path: str | Path, full_prompt_template: str) -> PromptRegistry:
+    # keyed by the path as given: resolving it on every prompt build costs more than the build
+    key = str(config_path)
+    registry = _registries.get(key)
+    if registry is None:
+        with _registries_lock:
+            registry = _registries.get(key)
+            if registry is None:
+                registry = PromptRegistry(config_path, full_prompt_template)
+                _registries[key] = registry
+    return registry
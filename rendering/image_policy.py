@@ -0,0 +1,227 @@
+# rendering/image_policy.py
+from __future__ import annotations
+
+import io
+import math
+import os
+from dataclasses import dataclass, field, replace
+from typing import Optional
+
+from PIL import Image
+
+
+# OpenAI vision tiling: images are fit into 2048x2048, then the short side is
+# scaled to 768 and billed per 512px tile. Pixels beyond that are thrown away.
+VISION_MAX_LONG_SIDE = 2048
+VISION_MAX_SHORT_SIDE = 768
+
+_FORMATS = {
+    "png": ("PNG", "image/png", ".png"),
+    "jpeg": ("JPEG", "image/jpeg", ".jpg"),
+    "webp": ("WEBP", "image/webp", ".webp"),
+}
+
+
+def estimate_image_tokens(width: int, height: int, detail: str = "auto") -> int:
+    """
+    OpenAI vision token cost for one image: fit into 2048x2048, scale the short
+    side down to 768, then 85 base tokens + 170 per 512px tile.
+    """
+    if detail == "low":
+        return 85
+    scale = min(1.0, VISION_MAX_LONG_SIDE / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, VISION_MAX_SHORT_SIDE / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 85 + 170 * tiles
+
+
+@dataclass(frozen=True)
+class ImagePolicy:
+    """
+    How page images for the vision model are rendered and encoded.
+    The default reproduces the original behaviour (300 DPI, one lossless PNG per subdocument).
+    """
+    dpi: int = 300
+    image_format: str = "png"  # png | jpeg | webp
+    quality: int = 85  # jpeg/webp only
+    max_long_side: Optional[int] = None
+    max_short_side: Optional[int] = None
+    max_pixels: Optional[int] = None
+    concatenate: bool = True  # one tall image per subdocument vs. one image per page
+    detail: str = "auto"  # OpenAI image_url detail: auto | low | high
+
+    def __post_init__(self):
+        if self.image_format not in _FORMATS:
+            raise ValueError(f"Unsupported image format '{self.image_format}'. Use one of {sorted(_FORMATS)}.")
+        if self.detail not in {"auto", "low", "high"}:
+            raise ValueError(f"Unsupported detail '{self.detail}'. Use auto, low or high.")
+
+    @property
+    def mime_type(self) -> str:
+        return _FORMATS[self.image_format][1]
+
+    @property
+    def extension(self) -> str:
+        return _FORMATS[self.image_format][2]
+
+    @classmethod
+    def legacy(cls) -> "ImagePolicy":
+        return cls()
+
+    @classmethod
+    def budget(cls) -> "ImagePolicy":
+        """
+        JPEG sized to the vision tiling limits, so nothing is uploaded that OpenAI
+        would downscale away. Same image tokens as legacy, a fraction of the bytes.
+        Per-page images (concatenate=False) are more legible for long subdocuments
+        but cost ~765 tokens per page instead of per subdocument.
+        """
+        return cls(
+            dpi=150,
+            image_format="jpeg",
+            quality=80,
+            max_long_side=VISION_MAX_LONG_SIDE,
+            max_short_side=VISION_MAX_SHORT_SIDE,
+        )
+
+    @classmethod
+    def from_env(cls) -> "ImagePolicy":
+        """
+        IMAGE_POLICY=legacy|budget picks the base preset; IMAGE_DPI, IMAGE_FORMAT,
+        IMAGE_QUALITY, IMAGE_MAX_LONG_SIDE, IMAGE_MAX_SHORT_SIDE, IMAGE_MAX_PIXELS,
+        IMAGE_CONCATENATE and IMAGE_DETAIL override single fields.
+        """
+        name = os.getenv("IMAGE_POLICY", "legacy").lower()
+        if name not in {"legacy", "budget"}:
+            raise ValueError(f"IMAGE_POLICY must be 'legacy' or 'budget', got '{name}'.")
+        policy = cls.budget() if name == "budget" else cls.legacy()
+
+        overrides = {}
+        for env, attr in [
+            ("IMAGE_DPI", "dpi"),
+            ("IMAGE_QUALITY", "quality"),
+            ("IMAGE_MAX_LONG_SIDE", "max_long_side"),
+            ("IMAGE_MAX_SHORT_SIDE", "max_short_side"),
+            ("IMAGE_MAX_PIXELS", "max_pixels"),
+        ]:
+            if os.getenv(env):
+                overrides[attr] = int(os.environ[env])
+        if os.getenv("IMAGE_FORMAT"):
+            overrides["image_format"] = os.environ["IMAGE_FORMAT"].lower().replace("jpg", "jpeg")
+        if os.getenv("IMAGE_DETAIL"):
+            overrides["detail"] = os.environ["IMAGE_DETAIL"].lower()
+        if os.getenv("IMAGE_CONCATENATE"):
+            overrides["concatenate"] = os.environ["IMAGE_CONCATENATE"].lower() in {"1", "true", "yes"}
+        return replace(policy, **overrides)
+
+    def target_size(self, width: int, height: int) -> tuple[int, int]:
+        """Largest size <= (width, height) that satisfies every cap, aspect ratio preserved."""
+        scale = 1.0
+        if self.max_long_side:
+            scale = min(scale, self.max_long_side / max(width, height))
+        if self.max_short_side:
+            scale = min(scale, self.max_short_side / min(width, height))
+        if self.max_pixels:
+            scale = min(scale, math.sqrt(self.max_pixels / (width * height)))
+        return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+@dataclass
+class EncodedImage:
+    data: bytes
+    width: int
+    height: int
+    mime_type: str
+    extension: str
+
+    def tokens(self, detail: str = "auto") -> int:
+        return estimate_image_tokens(self.width, self.height, detail)
+
+
+def fit_to_policy(img: Image.Image, policy: ImagePolicy) -> Image.Image:
+    size = policy.target_size(img.width, img.height)
+    if size == (img.width, img.height):
+        return img
+    return img.resize(size, Image.Resampling.LANCZOS)
+
+
+def encode_image(img: Image.Image, policy: ImagePolicy) -> EncodedImage:
+    img = fit_to_policy(img, policy)
+    pil_format = _FORMATS[policy.image_format][0]
+    if pil_format != "PNG" and img.mode not in {"RGB", "L"}:
+        img = img.convert("RGB")
+
+    buf = io.BytesIO()
+    if pil_format == "PNG":
+        img.save(buf, format="PNG")
+    else:
+        img.save(buf, format=pil_format, quality=policy.quality)
+    return EncodedImage(buf.getvalue(), img.width, img.height, policy.mime_type, policy.extension)
+
+
+def concatenate_vertically(page_images: list[Image.Image]) -> Image.Image:
+    total_height = sum(img.height for img in page_images)
+    max_width = max(img.width for img in page_images)
+    concatenated = Image.new("RGB", (max_width, total_height), color=(255, 255, 255))
+    y = 0
+    for img in page_images:
+        concatenated.paste(img, (0, y))
+        y += img.height
+    return concatenated
+
+
+def compose_images(page_images: list[Image.Image], policy: ImagePolicy) -> list[EncodedImage]:
+    """Encode rendered pages as one concatenated image or one image per page."""
+    if policy.concatenate:
+        return [encode_image(concatenate_vertically(page_images), policy)]
+    return [encode_image(img, policy) for img in page_images]
+
+
+def render_page(page, policy: ImagePolicy) -> Image.Image:
+    """Rasterize one fitz page at the policy DPI."""
+    pix = page.get_pixmap(dpi=policy.dpi)
+    mode = "RGB" if pix.alpha == 0 else "RGBA"
+    return Image.frombytes(mode, [pix.width, pix.height], pix.samples)
+
+
+def legacy_image_size(pages) -> tuple[int, int]:
+    """Pixel size the original 300 DPI concatenated PNG would have had, computed from page rects."""
+    widths = [round(p.rect.width * 300 / 72) for p in pages]
+    heights = [round(p.rect.height * 300 / 72) for p in pages]
+    return max(widths), sum(heights)
+
+
+@dataclass
+class ImageBudgetReport:
+    """Bytes and estimated vision tokens per subdocument, against the 300 DPI PNG baseline."""
+    entries: list[dict] = field(default_factory=list)
+
+    def add(self, label: str, images: list[EncodedImage], detail: str,
+            baseline_size: Optional[tuple[int, int]] = None, baseline_bytes: Optional[int] = None) -> None:
+        entry = {
+            "label": label,
+            "images": len(images),
+            "bytes": sum(len(i.data) for i in images),
+            "tokens": sum(i.tokens(detail) for i in images),
+        }
+        if baseline_size:
+            entry["baseline_tokens"] = estimate_image_tokens(*baseline_size, "auto")
+        if baseline_bytes is not None:
+            entry["baseline_bytes"] = baseline_bytes
+        self.entries.append(entry)
+
+    def summary(self) -> dict:
+        out = {
+            "images": sum(e["images"] for e in self.entries),
+            "bytes": sum(e["bytes"] for e in self.entries),
+            "tokens": sum(e["tokens"] for e in self.entries),
+        }
+        if self.entries and all("baseline_tokens" in e for e in self.entries):
+            out["baseline_tokens"] = sum(e["baseline_tokens"] for e in self.entries)
+            out["tokens_saved"] = out["baseline_tokens"] - out["tokens"]
+        if self.entries and all("baseline_bytes" in e for e in self.entries):
+            out["baseline_bytes"] = sum(e["baseline_bytes"] for e in self.entries)
+            out["bytes_saved"] = out["baseline_bytes"] - out["bytes"]
+        return out
@@ -0,0 +1,202 @@
+# rendering/rasterizer.py
+from __future__ import annotations
+
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Iterator, Optional
+
+import fitz
+
+from rendering.image_policy import EncodedImage, ImagePolicy, compose_images, render_page
+
+# PyMuPDF must not be called from two threads at once. Everything in a process that
+# touches fitz (jobs running side by side in a threaded worker, see jobs/worker.py)
+# holds this lock for the duration of the call; pool processes render on their own.
+fitz_lock = threading.RLock()
+
+
+# ---- work done inside the pool processes ----
+
+_worker_doc: Optional[tuple[tuple[str, int, int], fitz.Document]] = None
+
+
+def open_in_worker(pdf_path: str) -> fitz.Document:
+    """
+    For tasks running in a pool process: each process keeps the last PDF open,
+    so consecutive ranges of one document share it. The cache is keyed by
+    (path, mtime, size), so a path reused for other content is opened afresh,
+    and the previous document (maybe a deleted job file) is closed by the
+    next task, freeing its disk space.
+    """
+    global _worker_doc
+    st = os.stat(pdf_path)
+    key = (pdf_path, st.st_mtime_ns, st.st_size)
+    if _worker_doc is None or _worker_doc[0] != key:
+        if _worker_doc is not None:
+            _worker_doc[1].close()
+            _worker_doc = None
+        _worker_doc = (key, fitz.open(pdf_path))
+    return _worker_doc[1]
+
+
+def _encode_pages(doc, first: int, last: int, dpi: int, image_format: str, quality: int) -> list[bytes]:
+    out = []
+    for i in range(first, last + 1):
+        pix = doc[i].get_pixmap(dpi=dpi)
+        if image_format == "png":
+            out.append(pix.tobytes("png"))
+        else:
+            out.append(pix.tobytes("jpeg", jpg_quality=quality))
+    return out
+
+
+def _render_subdocument(doc, first: int, last: int, policy: ImagePolicy) -> list[EncodedImage]:
+    return compose_images([render_page(doc[i], policy) for i in range(first, last + 1)], policy)
+
+
+def _pages_task(pdf_path: str, first: int, last: int, dpi: int, image_format: str, quality: int) -> list[bytes]:
+    return _encode_pages(open_in_worker(pdf_path), first, last, dpi, image_format, quality)
+
+
+def _subdocument_task(pdf_path: str, first: int, last: int, policy: ImagePolicy) -> list[EncodedImage]:
+    return _render_subdocument(open_in_worker(pdf_path), first, last, policy)
+
+
+# ---- service used by the pipeline ----
+
+class Rasterizer:
+    """
+    PDF page rendering on a process pool, so rasterization (pure CPU, GIL-bound
+    in PyMuPDF and PIL) uses every core of the worker machine.
+
+    Workers open the PDF themselves and send back compressed buffers (PNG/JPEG
+    bytes, or policy-encoded subdocument images), never raw pixmaps. With
+    max_workers <= 1 everything is rendered in-process with identical output.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, start_method: Optional[str] = None):
+        self.max_workers = max_workers if max_workers is not None else (os.cpu_count() or 1)
+        self.start_method = start_method or (
+            "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        )
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self) -> Optional[ProcessPoolExecutor]:
+        if self.max_workers <= 1:
+            return None
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.max_workers,
+                        mp_context=multiprocessing.get_context(self.start_method),
+                    )
+        return self._pool
+
+    def render_pages(self, pdf_path, dpi: int = 300, image_format: str = "png", quality: int = 85) -> list[bytes]:
+        """Every page of `pdf_path` as encoded image bytes (png or jpeg), in page order."""
+        pdf_path = str(pdf_path)
+        with fitz_lock, fitz.open(pdf_path) as doc:
+            page_count = len(doc)
+            if self.pool is None or page_count <= 1:
+                return _encode_pages(doc, 0, page_count - 1, dpi, image_format, quality)
+
+        # contiguous chunks, one per worker: each process opens the PDF once
+        chunk = -(-page_count // self.max_workers)
+        futures = [
+            self.pool.submit(_pages_task, pdf_path, first, min(first + chunk, page_count) - 1, dpi, image_format, quality)
+            for first in range(0, page_count, chunk)
+        ]
+        return [data for future in futures for data in future.result()]
+
+    def iter_subdocument_images(
+        self, pdf_path, page_ranges: list[tuple[int, int]], policy: ImagePolicy
+    ) -> Iterator[list[EncodedImage]]:
+        """
+        Render each (first, last) 0-based page range with compose_images(policy),
+        yielding results in order. At most max_workers ranges are in flight, so
+        finished images never pile up faster than the caller consumes them.
+        """
+        pdf_path = str(pdf_path)
+        if self.pool is None or len(page_ranges) <= 1:
+            # the lock is never held across a yield: the caller uses fitz in between
+            with fitz_lock:
+                doc = fitz.open(pdf_path)
+            try:
+                for first, last in page_ranges:
+                    with fitz_lock:
+                        images = _render_subdocument(doc, first, last, policy)
+                    yield images
+            finally:
+                with fitz_lock:
+                    doc.close()
+            return
+
+        remaining = iter(page_ranges)
+        pending: deque[Future] = deque()
+
+        def submit_next() -> None:
+            page_range = next(remaining, None)
+            if page_range is not None:
+                pending.append(self.pool.submit(_subdocument_task, pdf_path, *page_range, policy))
+
+        for _ in range(self.max_workers):
+            submit_next()
+        try:
+            while pending:
+                images = pending.popleft().result()
+                submit_next()
+                yield images
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True, cancel_futures=True)
+                self._pool = None
+
+
+_shared: Optional[tuple[int, Rasterizer]] = None
+_shared_lock = threading.Lock()
+
+
+def _default_workers() -> int:
+    # a pool only pays off in a process that lives for many jobs (WORKER_MODE=warm /
+    # threaded); a forked work horse would start one per job just to render one document
+    if os.getenv("WORKER_MODE", "fork").lower() in ("warm", "threaded"):
+        return os.cpu_count() or 1
+    return 1
+
+
+def get_rasterizer() -> Rasterizer:
+    """
+    Per-process Rasterizer from env: RASTER_WORKERS (0/1 renders in-process;
+    default: CPU count in warm / threaded workers, in-process everywhere else),
+    RASTER_START_METHOD (default forkserver). Keyed by pid: a pool inherited
+    through fork (e.g. the RQ work horse) is not usable.
+    """
+    global _shared
+    pid = os.getpid()
+    with _shared_lock:
+        if _shared is None or _shared[0] != pid:
+            workers = os.getenv("RASTER_WORKERS")
+            _shared = (pid, Rasterizer(
+                max_workers=int(workers) if workers else _default_workers(),
+                start_method=os.getenv("RASTER_START_METHOD") or None,
+            ))
+        return _shared[1]
+
+
+def close_rasterizer() -> None:
+    """Shut down this process's pool, if it started one (end of a job in a forked work horse)."""
+    with _shared_lock:
+        shared = _shared
+    if shared is not None and shared[0] == os.getpid():
+        shared[1].close()
@@ -0,0 +1,375 @@
+# resilience.py
+"""
+Retry / circuit breaker / hedging policy for calls to external services
+(OpenAI, LandingAI, S3). One CallPolicy per service and process:
+
+    policy = get_policy("openai", retry_reason)
+    response = policy.call("extraction", client.chat.completions.create, **request)
+    response = await policy.acall("extraction", async_client.chat.completions.create, **request)
+
+`retry_reason(exc)` is the service's classifier: a short label ("429", "503",
+"connection", ...) when the failure is transient, None when retrying can't
+help (bad request, auth, quota, our own bug). The SDKs' built-in retries are
+turned off where the clients are built, so this layer is the only one retrying.
+
+Settings are read from the environment, service-specific first
+(OPENAI_RETRY_MAX_ATTEMPTS), then the shared name (RETRY_MAX_ATTEMPTS):
+
+  RETRY_MAX_ATTEMPTS     attempts per call, including the first (default 4)
+  RETRY_BASE_DELAY       first backoff in seconds, doubled per attempt, full jitter (0.5)
+  RETRY_MAX_DELAY        longest backoff; a Retry-After above it fails the call
+                         instead of retrying early into another 429 (60)
+  CB_FAILURE_THRESHOLD   consecutive transient failures that open the breaker (5)
+  CB_RESET_SECONDS       how long an open breaker fails calls fast before letting
+                         one probe through (30)
+  HEDGE_OPERATIONS       service:operation pairs to hedge, e.g.
+                         "openai:extraction,s3:get" (default: none)
+  HEDGE_QUANTILE         latency quantile after which the duplicate fires (0.95)
+  HEDGE_MIN_SAMPLES      successful calls observed before hedging starts (20)
+  HEDGE_MIN_DELAY        never hedge earlier than this many seconds (0)
+
+A hedged call sends a second, identical request when the first has not answered
+after the operation's recent p95 latency, and returns whichever answers first.
+Both requests are billed: pass `on_discard` to account for the losing response
+(sync calls; an async loser is cancelled).
+"""
+from __future__ import annotations
+
+import asyncio
+import email.utils
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Optional
+
+from instrumentation import CIRCUIT_BREAKER_TRANSITIONS, EXTERNAL_CALL_HEDGES, EXTERNAL_CALL_RETRIES
+
+RetryClassifier = Callable[[BaseException], Optional[str]]
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+def _setting(service: str, name: str, default: str) -> str:
+    return os.getenv(f"{service.upper()}_{name}") or os.getenv(name) or default
+
+
+def status_reason(status_code: Optional[int]) -> Optional[str]:
+    """Retry label for an HTTP status: timeouts, conflicts, rate limits and 5xx are transient."""
+    if status_code is None:
+        return None
+    if status_code in (408, 409, 429) or status_code >= 500:
+        return str(status_code)
+    return None
+
+
+def retry_after(exc: BaseException) -> Optional[float]:
+    """
+    Seconds the server asked us to wait, from the error's response headers
+    (httpx responses of the OpenAI/LandingAI SDKs, botocore error dicts).
+    """
+    response = getattr(exc, "response", None)
+    if isinstance(response, dict):  # botocore ClientError
+        headers = response.get("ResponseMetadata", {}).get("HTTPHeaders", {})
+    else:
+        headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        parsed = email.utils.parsedate_to_datetime(value) if value else None
+        return max(parsed.timestamp() - time.time(), 0.0) if parsed else None
+
+
+class CircuitOpenError(RuntimeError):
+    """The service's breaker is open: it failed repeatedly and is not called for now."""
+
+    def __init__(self, service: str, retry_after: float):
+        super().__init__(f"{service} circuit breaker is open; retry in {retry_after:.1f}s")
+        self.service = service
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Per-service breaker shared by all threads of a process: after
+    `failure_threshold` consecutive transient failures it opens and calls fail
+    fast for `reset_seconds`; then one probe call is let through, which closes
+    it again on success or reopens it on failure.
+    """
+
+    def __init__(self, service: str, failure_threshold: int, reset_seconds: float):
+        self.service = service
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_started: Optional[float] = None
+
+    def _transition(self, state: str) -> None:
+        self.state = state
+        CIRCUIT_BREAKER_TRANSITIONS.labels(self.service, state).inc()
+        print(f"{self.service} circuit breaker {state}")
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self._opened_at + self.reset_seconds - time.monotonic()
+                if remaining > 0:
+                    raise CircuitOpenError(self.service, remaining)
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                now = time.monotonic()
+                # a probe that never reported back (cancelled, killed) doesn't block the breaker forever
+                if self._probe_started is not None and now - self._probe_started < self.reset_seconds:
+                    raise CircuitOpenError(self.service, min(1.0, self.reset_seconds))
+                self._probe_started = now
+
+    def record_ok(self) -> None:
+        """The service answered (possibly with an error that is ours, like a 400)."""
+        with self._lock:
+            self._failures = 0
+            self._probe_started = None
+            if self.state != CLOSED:
+                self._transition(CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._probe_started = None
+            if self.state == HALF_OPEN or (self.state == CLOSED and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self._transition(OPEN)
+
+
+class LatencyWindow:
+    """Recent successful call latencies of one operation, for the hedge delay."""
+
+    def __init__(self, size: int = 200):
+        self._samples: deque[float] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q: float, min_samples: int) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+_hedge_pool_lock = threading.Lock()
+_hedge_pools: dict[int, ThreadPoolExecutor] = {}
+
+
+def _hedge_pool() -> ThreadPoolExecutor:
+    pid = os.getpid()
+    with _hedge_pool_lock:
+        pool = _hedge_pools.get(pid)
+        if pool is None:
+            pool = ThreadPoolExecutor(
+                max_workers=int(os.getenv("HEDGE_MAX_WORKERS", "32")), thread_name_prefix="hedge"
+            )
+            _hedge_pools[pid] = pool
+        return pool
+
+
+class CallPolicy:
+    def __init__(self, service: str, classify: RetryClassifier):
+        self.service = service
+        self.classify = classify
+        self.max_attempts = max(int(_setting(service, "RETRY_MAX_ATTEMPTS", "4")), 1)
+        self.base_delay = float(_setting(service, "RETRY_BASE_DELAY", "0.5"))
+        self.max_delay = float(_setting(service, "RETRY_MAX_DELAY", "60"))
+        self.breaker = CircuitBreaker(
+            service,
+            failure_threshold=int(_setting(service, "CB_FAILURE_THRESHOLD", "5")),
+            reset_seconds=float(_setting(service, "CB_RESET_SECONDS", "30")),
+        )
+        self.hedged_operations = {
+            pair.split(":", 1)[1]
+            for pair in (p.strip() for p in os.getenv("HEDGE_OPERATIONS", "").split(","))
+            if pair.startswith(f"{service}:")
+        }
+        self.hedge_quantile = float(_setting(service, "HEDGE_QUANTILE", "0.95"))
+        self.hedge_min_samples = int(_setting(service, "HEDGE_MIN_SAMPLES", "20"))
+        self.hedge_min_delay = float(_setting(service, "HEDGE_MIN_DELAY", "0"))
+        self._latency: dict[str, LatencyWindow] = {}
+
+    # ---- shared by call() and acall() ----
+
+    def _window(self, operation: str) -> LatencyWindow:
+        window = self._latency.get(operation)
+        if window is None:
+            window = self._latency.setdefault(operation, LatencyWindow())
+        return window
+
+    def _hedge_delay(self, operation: str) -> Optional[float]:
+        if operation not in self.hedged_operations:
+            return None
+        delay = self._window(operation).quantile(self.hedge_quantile, self.hedge_min_samples)
+        return None if delay is None else max(delay, self.hedge_min_delay)
+
+    def _backoff(self, operation: str, attempt: int, exc: BaseException) -> float:
+        """
+        Seconds to wait before attempt `attempt + 1`, or re-raise `exc` when the
+        call should fail now (not transient, out of attempts, or asked to wait
+        longer than RETRY_MAX_DELAY). Also feeds the breaker.
+        """
+        if isinstance(exc, CircuitOpenError):
+            reason, wait_for = "circuit_open", exc.retry_after
+        else:
+            reason = self.classify(exc)
+            if reason is None:
+                self.breaker.record_ok()
+                raise exc
+            self.breaker.record_failure()
+            wait_for = retry_after(exc)
+        if attempt >= self.max_attempts:
+            raise exc
+        if wait_for is not None:
+            if wait_for > self.max_delay:
+                raise exc
+            delay = wait_for + random.uniform(0, self.base_delay)
+        else:
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        EXTERNAL_CALL_RETRIES.labels(self.service, operation, reason).inc()
+        print(f"{self.service} {operation} failed ({reason}); retry {attempt}/{self.max_attempts - 1} in {delay:.1f}s")
+        return delay
+
+    def _discard(self, operation: str, on_discard: Optional[Callable[[Any], None]], result: Any) -> None:
+        if on_discard is None:
+            return
+        try:
+            on_discard(result)
+        except Exception as e:
+            print(f"{self.service} {operation}: could not account for the discarded hedge response: {e}")
+
+    # ---- sync ----
+
+    def _timed(self, operation: str, fn: Callable, args: tuple, kwargs: dict):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        self._window(operation).add(time.perf_counter() - start)
+        return result
+
+    def _race(self, operation: str, delay: float, fn: Callable, args: tuple, kwargs: dict, on_discard):
+        pool = _hedge_pool()
+        primary = pool.submit(self._timed, operation, fn, args, kwargs)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        hedge = pool.submit(self._timed, operation, fn, args, kwargs)
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    EXTERNAL_CALL_HEDGES.labels(self.service, operation, "primary" if future is primary else "hedge").inc()
+                    for loser in pending:  # can't cancel a running HTTP call; account for it when it lands
+                        loser.add_done_callback(
+                            lambda f: f.exception() is None and self._discard(operation, on_discard, f.result())
+                        )
+                    return future.result()
+                error = error or future.exception()
+        EXTERNAL_CALL_HEDGES.labels(self.service, operation, "none").inc()
+        raise error
+
+    def call(self, operation: str, fn: Callable, *args, on_discard: Optional[Callable[[Any], None]] = None, **kwargs):
+        """fn(*args, **kwargs) with retries, the breaker and (if configured) hedging."""
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                self.breaker.before_call()
+                delay = self._hedge_delay(operation)
+                if delay is None:
+                    result = self._timed(operation, fn, args, kwargs)
+                else:
+                    result = self._race(operation, delay, fn, args, kwargs, on_discard)
+            except Exception as e:
+                time.sleep(self._backoff(operation, attempt, e))
+                continue
+            self.breaker.record_ok()
+            return result
+
+    # ---- async ----
+
+    async def _atimed(self, operation: str, fn: Callable[..., Awaitable], args: tuple, kwargs: dict):
+        start = time.perf_counter()
+        result = await fn(*args, **kwargs)
+        self._window(operation).add(time.perf_counter() - start)
+        return result
+
+    async def _arace(self, operation: str, delay: float, fn: Callable[..., Awaitable], args: tuple, kwargs: dict):
+        primary = asyncio.ensure_future(self._atimed(operation, fn, args, kwargs))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+        hedge = asyncio.ensure_future(self._atimed(operation, fn, args, kwargs))
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        EXTERNAL_CALL_HEDGES.labels(self.service, operation, "primary" if task is primary else "hedge").inc()
+                        return task.result()
+                    error = error or task.exception()
+        finally:
+            for task in pending:
+                task.cancel()
+        EXTERNAL_CALL_HEDGES.labels(self.service, operation, "none").inc()
+        raise error
+
+    async def acall(self, operation: str, fn: Callable[..., Awaitable], *args, **kwargs):
+        """Async call(): `fn` returns an awaitable; a losing hedge is cancelled."""
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                self.breaker.before_call()
+                delay = self._hedge_delay(operation)
+                if delay is None:
+                    result = await self._atimed(operation, fn, args, kwargs)
+                else:
+                    result = await self._arace(operation, delay, fn, args, kwargs)
+            except Exception as e:
+                await asyncio.sleep(self._backoff(operation, attempt, e))
+                continue
+            self.breaker.record_ok()
+            return result
+
+
+_policies_lock = threading.Lock()
+_policies: dict[tuple[int, str], CallPolicy] = {}
+
+
+def get_policy(service: str, classify: RetryClassifier) -> CallPolicy:
+    """Process-wide policy of `service` (its breaker and latency window are shared by all callers)."""
+    key = (os.getpid(), service)
+    with _policies_lock:
+        policy = _policies.get(key)
+        if policy is None:
+            policy = CallPolicy(service, classify)
+            _policies[key] = policy
+        return policy
@@ -0,0 +1,270 @@
+# storage/cached_storage.py
+from __future__ import annotations
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from typing import Optional
+
+from storage.storage import StorageBackend, StorageKey, WriteItem
+
+
+class CachedStorage(StorageBackend):
+    """
+    Write-through cache around any StorageBackend.
+
+    Every object written or read through it is also kept in a local directory,
+    so reading back a fresh artifact (e.g. the subdocument PNG that
+    split_document_into_invoices just uploaded) is served from disk instead of
+    a second S3 download. The directory is bounded by `max_bytes`; the least
+    recently used objects are evicted first.
+
+    Paths handed out by materialize_to_local are opened again later by path
+    (fitz, the rasterizer pool, OCR tools), so a job that shares the cache
+    with others (warm / threaded workers) uses it through lease(): whatever
+    the lease materializes is pinned, i.e. not evicted, until it is released.
+    """
+
+    def __init__(self, inner: StorageBackend, cache_dir: Optional[Path] = None, max_bytes: int = 1024 * 1024 * 1024):
+        self.inner = inner
+        # always a fresh directory of this instance's own (inside `cache_dir` when given):
+        # other worker processes on the host may cache into the same configured directory,
+        # and cleanup_cache() removes everything below self.cache_dir
+        if cache_dir is not None:
+            Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        self.cache_dir = Path(tempfile.mkdtemp(prefix="invoice_storage_cache_", dir=cache_dir))
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> (path, size); insertion order doubles as LRU order
+        self._entries: dict[StorageKey, tuple[Path, int]] = {}
+        self._total_bytes = 0
+        self._pins: dict[StorageKey, int] = {}  # key -> number of leases using its file
+        self._links: dict[StorageKey, set[Path]] = {}  # suffixed hard links of materialize_to_local
+
+    def __getattr__(self, name):
+        # backend specific extras (S3Storage.cleanup_tmp, .s3, ...) pass through
+        if name == "inner":
+            raise AttributeError(name)
+        return getattr(self.inner, name)
+
+    def _cache_path(self, key: StorageKey) -> Path:
+        # keep the original file name so suffix-based mime detection still works
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+        return self.cache_dir / digest / Path(key).name
+
+    def _drop_locked(self, key: StorageKey) -> None:
+        """Forget `key` and remove its file and hard links."""
+        entry = self._entries.pop(key, None)
+        for link in self._links.pop(key, ()):
+            link.unlink(missing_ok=True)
+        if entry is not None:
+            self._total_bytes -= entry[1]
+            entry[0].unlink(missing_ok=True)
+
+    def _lookup(self, key: StorageKey) -> Optional[Path]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not entry[0].exists():
+                if entry is not None:
+                    self._drop_locked(key)
+                self.misses += 1
+                return None
+            self._entries[key] = self._entries.pop(key)  # move to most recently used
+            self.hits += 1
+            return entry[0]
+
+    def _store(self, key: StorageKey, data: bytes) -> Path:
+        path = self._cache_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total_bytes -= old[1]
+            if key not in self._pins:
+                # hard links still point at the old content (the path itself was replaced)
+                for link in self._links.pop(key, ()):
+                    link.unlink(missing_ok=True)
+            self._entries[key] = (path, len(data))
+            self._total_bytes += len(data)
+            self._evict_locked(keep=key)
+        return path
+
+    def _forget(self, key: StorageKey) -> None:
+        with self._lock:
+            self._drop_locked(key)
+
+    def _evict_locked(self, keep: Optional[StorageKey] = None) -> None:
+        """Drop least recently used objects until under max_bytes; pinned ones stay."""
+        for key in list(self._entries):
+            if self._total_bytes <= self.max_bytes:
+                break
+            if key == keep or key in self._pins:
+                continue
+            self._drop_locked(key)
+
+    def read_bytes(self, key: StorageKey) -> bytes:
+        path = self._lookup(key)
+        if path is not None:
+            return path.read_bytes()
+        data = self.inner.read_bytes(key)
+        self._store(key, data)
+        return data
+
+    def write_bytes(self, key: StorageKey, data: bytes, content_type: Optional[str] = None) -> None:
+        self.inner.write_bytes(key, data, content_type=content_type)
+        self._store(key, data)
+
+    def write_text(self, key: StorageKey, text: str, encoding: str = "utf-8") -> None:
+        self.inner.write_text(key, text, encoding=encoding)
+        self._store(key, text.encode(encoding))
+
+    def delete(self, key: StorageKey) -> None:
+        self._forget(key)
+        self.inner.delete(key)
+
+    def open_writer(self, key: StorageKey, content_type: Optional[str] = None):
+        # streamed objects are typically large uploads: write through without caching
+        self._forget(key)
+        return self.inner.open_writer(key, content_type=content_type)
+
+    def write_many(self, items: list[WriteItem]) -> None:
+        self.inner.write_many(items)
+        for key, data, _ in items:
+            self._store(key, data)
+
+    def read_many(self, keys: list[StorageKey]) -> list[bytes]:
+        results: dict[StorageKey, bytes] = {}
+        missing = []
+        for key in keys:
+            path = self._lookup(key)
+            if path is not None:
+                results[key] = path.read_bytes()
+            else:
+                missing.append(key)
+        if missing:
+            for key, data in zip(missing, self.inner.read_many(missing)):
+                self._store(key, data)
+                results[key] = data
+        return [results[key] for key in keys]
+
+    def delete_many(self, keys: list[StorageKey]) -> None:
+        for key in keys:
+            self._forget(key)
+        self.inner.delete_many(keys)
+
+    def exists(self, key: StorageKey) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0].exists():
+            return True
+        return self.inner.exists(key)
+
+    def materialize_to_local(self, key: StorageKey, suffix: str = "") -> Path:
+        path = self._lookup(key)
+        if path is None:
+            path = self._store(key, self.inner.read_bytes(key))
+        if suffix and not path.name.endswith(suffix):
+            # same contract as S3Storage: enforce the requested suffix
+            with_suffix = path.with_name(path.name + suffix)
+            try:
+                os.link(path, with_suffix)
+            except FileExistsError:
+                pass
+            with self._lock:
+                self._links.setdefault(key, set()).add(with_suffix)
+            return with_suffix
+        return path
+
+    def lease(self) -> "StorageLease":
+        """This cache as seen by one job: files it materializes stay until lease.release()."""
+        return StorageLease(self)
+
+    def _pin(self, key: StorageKey) -> None:
+        with self._lock:
+            self._pins[key] = self._pins.get(key, 0) + 1
+
+    def _unpin(self, keys: list[StorageKey]) -> None:
+        with self._lock:
+            for key in keys:
+                count = self._pins.get(key, 0) - 1
+                if count > 0:
+                    self._pins[key] = count
+                else:
+                    self._pins.pop(key, None)
+            # pinned objects may have kept the cache over its bound
+            self._evict_locked()
+
+    def cleanup_cache(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._links.clear()
+            self._pins.clear()
+            self._total_bytes = 0
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "objects": len(self._entries),
+                "bytes": self._total_bytes,
+            }
+
+
+class StorageLease:
+    """
+    A CachedStorage for the duration of one job. Everything passes through to
+    the cache; objects materialized through the lease are pinned (and so
+    never evicted while the job may still open them by path) until release().
+    """
+
+    def __init__(self, cache: CachedStorage):
+        self.cache = cache
+        self._pinned: list[StorageKey] = []
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if name == "cache":
+            raise AttributeError(name)
+        return getattr(self.cache, name)
+
+    def materialize_to_local(self, key: StorageKey, suffix: str = "") -> Path:
+        # pinned before the lookup, so the object can't be evicted in between
+        self.cache._pin(key)
+        with self._lock:
+            self._pinned.append(key)
+        return self.cache.materialize_to_local(key, suffix=suffix)
+
+    def release(self) -> None:
+        with self._lock:
+            keys, self._pinned = self._pinned, []
+        self.cache._unpin(keys)
+
+
+def build_cached_storage(inner: StorageBackend) -> StorageBackend:
+    """
+    Wrap `inner` according to env:
+      STORAGE_CACHE=0             disable the write-through cache
+      STORAGE_CACHE_DIR           where each instance creates its cache directory (default: system temp dir)
+      STORAGE_CACHE_MAX_BYTES     size bound (default: 1 GiB)
+    """
+    if os.getenv("STORAGE_CACHE", "1") == "0":
+        return inner
+    cache_dir = os.getenv("STORAGE_CACHE_DIR")
+    return CachedStorage(
+        inner,
+        cache_dir=Path(cache_dir) if cache_dir else None,
+        max_bytes=int(os.getenv("STORAGE_CACHE_MAX_BYTES", str(1024 * 1024 * 1024))),
+    )
@@ -1,11 +1,14 @@
 # storage/file_storage.py
 from __future__ import annotations
 
+import hashlib
 import os
 import uuid
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional
+from typing import BinaryIO, Optional
 
+from storage.pdf_pages import PdfPageCounter
 from storage.storage import LocalStorage, S3Storage  # adjust to your actual module
 
 
@@ -42,9 +45,23 @@ def get_file_key(file_id: str) -> str:
     return f"{_uploads_prefix()}/{file_id}"
 
 
-def save_upload(file_bytes: bytes, original_filename: Optional[str] = None, content_type: Optional[str] = None) -> str:
-    storage = _build_storage()
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLargeError(ValueError):
+    pass
 
+
+@dataclass
+class UploadResult:
+    file_id: str
+    sha256: str
+    size: int
+    pages: Optional[int] = None  # None: not a PDF we could count (the pipeline treats images as 1 page)
+    is_pdf: bool = False
+
+
+def _new_file_id(original_filename: Optional[str]) -> str:
     # determine extension (optional but helpful)
     ext = ""
     if original_filename:
@@ -53,7 +70,48 @@ def save_upload(file_bytes: bytes, original_filename: Optional[str] = None, cont
         if ext and ext not in {".pdf", ".png", ".jpg", ".jpeg", ".tif", ".tiff"}:
             ext = ""  # or raise if you want strict
 
-    file_id = f"{uuid.uuid4().hex}{ext}"
+    return f"{uuid.uuid4().hex}{ext}"
+
+
+def save_upload_stream(
+    fileobj: BinaryIO,
+    original_filename: Optional[str] = None,
+    content_type: Optional[str] = None,
+    max_bytes: Optional[int] = None,
+    chunk_size: int = UPLOAD_CHUNK_SIZE,
+) -> UploadResult:
+    """
+    Copy an upload to storage chunk by chunk (S3 multipart / chunked local file),
+    hashing, counting bytes and counting PDF pages on the way. Memory stays at roughly one chunk (one
+    multipart part for S3) regardless of file size. Exceeding `max_bytes` aborts
+    the write and raises UploadTooLargeError.
+    """
+    storage = _build_storage()
+    file_id = _new_file_id(original_filename)
+    key = get_file_key(file_id)
+
+    h = hashlib.sha256()
+    pages = PdfPageCounter()
+    size = 0
+    with storage.open_writer(key, content_type=content_type) as writer:
+        while chunk := fileobj.read(chunk_size):
+            size += len(chunk)
+            if max_bytes is not None and size > max_bytes:
+                raise UploadTooLargeError(f"Upload exceeds the limit of {max_bytes} bytes.")
+            h.update(chunk)
+            pages.feed(chunk)
+            writer.write(chunk)
+
+    page_count = pages.finish()
+    if page_count is None and not pages.is_pdf and Path(file_id).suffix in {".png", ".jpg", ".jpeg"}:
+        page_count = 1
+    return UploadResult(file_id=file_id, sha256=h.hexdigest(), size=size, pages=page_count, is_pdf=bool(pages.is_pdf))
+
+
+def save_upload(file_bytes: bytes, original_filename: Optional[str] = None, content_type: Optional[str] = None) -> str:
+    storage = _build_storage()
+
+    file_id = _new_file_id(original_filename)
     key = get_file_key(file_id)
 
     storage.write_bytes(key, file_bytes, content_type=content_type)
@@ -0,0 +1,178 @@
+# storage/pdf_pages.py
+"""
+Page count of a PDF from its raw bytes, fed chunk by chunk while an upload is
+streamed to storage: no PDF library (the API process doesn't load PyMuPDF) and
+no second pass over the file.
+
+Every page object is a dictionary with /Type /Page. Those are counted in the
+raw bytes and inside compressed object streams (/Type /ObjStm, FlateDecode),
+where PDF 1.5+ writers often put them. An uncompressed page rewritten by an
+incremental update is counted once (by object number). The count is None when
+it can't be trusted: not a PDF, no page found, or an object stream that could
+not be inflated (encrypted, unfiltered or not FlateDecode, more than
+`max_inflate` bytes in total).
+"""
+from __future__ import annotations
+
+import re
+import zlib
+from typing import Optional
+
+_TOKENS = re.compile(
+    rb"(?P<page>/Type\s*/Page(?![A-Za-z]))|(?P<objstm>/Type\s*/ObjStm\b)|(?P<stream>(?<!end)stream\r?\n)"
+)
+_PAGE = re.compile(rb"/Type\s*/Page(?![A-Za-z])")
+_OBJ = re.compile(rb"(\d+)\s+(\d+)\s+obj\b")
+
+_OVERLAP = 256  # longer than any token, so none is cut at a chunk boundary
+_LOOKBACK = 2048  # how far before a /Type /Page its "N G obj" header is looked for
+_INFLATE_STEP = 1024 * 1024
+
+
+class _ObjectStream:
+    """Inflates one object stream as its bytes arrive and counts the page dictionaries in it."""
+
+    def __init__(self, start: int):
+        self.next_offset = start  # absolute file offset of the next byte to feed
+        self.pages = 0
+        self.inflated = 0
+        self.done = False
+        self.failed = False
+        self._zlib = zlib.decompressobj()
+        self._tail = b""
+
+    def feed(self, data: bytes, budget: int) -> None:
+        self.next_offset += len(data)
+        while data and not self.done:
+            try:
+                out = self._zlib.decompress(data, _INFLATE_STEP)
+            except zlib.error:
+                self.done = self.failed = True
+                return
+            self.inflated += len(out)
+            if self.inflated > budget:
+                self.done = self.failed = True
+                return
+            text = self._tail + out
+            # a match lying entirely in the previous tail was counted last time
+            self.pages += sum(1 for m in _PAGE.finditer(text) if m.end() > len(self._tail))
+            self._tail = text[-_OVERLAP:]
+            data = self._zlib.unconsumed_tail
+            if self._zlib.eof:
+                self.done = True
+
+
+class PdfPageCounter:
+    def __init__(self, max_inflate: int = 64 * 1024 * 1024):
+        self.max_inflate = max_inflate  # total inflated object stream bytes
+        self.is_pdf: Optional[bool] = None
+        self._buf = b""
+        self._buf_start = 0  # absolute offset of _buf[0]
+        self._scanned = 0  # absolute offset up to which tokens have been handled
+        self._page_objects: set[tuple[bytes, bytes]] = set()
+        self._loose_pages = 0  # page dictionaries without a recognisable object header
+        self._compressed_pages = 0
+        self._inflated = 0
+        self._awaiting_stream = False
+        self._objstm: Optional[_ObjectStream] = None
+        self._incomplete = False
+
+    def feed(self, chunk: bytes) -> None:
+        if self.is_pdf is None:
+            self.is_pdf = b"%PDF-" in chunk[:1024]
+        if not self.is_pdf or not chunk:
+            return
+        self._buf += chunk
+        self._process(final=False)
+
+    def finish(self) -> Optional[int]:
+        if self.is_pdf:
+            self._process(final=True)
+            if self._objstm is not None:  # file ends inside an object stream
+                self._incomplete = True
+        return self.page_count
+
+    @property
+    def page_count(self) -> Optional[int]:
+        if not self.is_pdf or self._incomplete:
+            return None
+        pages = len(self._page_objects) + self._loose_pages + self._compressed_pages
+        return pages or None
+
+    def _process(self, final: bool) -> None:
+        buf = self._buf
+        limit = len(buf) if final else len(buf) - _OVERLAP
+        start = self._scanned - self._buf_start
+        if limit > start:
+            for m in _TOKENS.finditer(buf, start):
+                if m.start() >= limit:
+                    break
+                if m.lastgroup == "page":
+                    self._count_page(buf, m.start())
+                elif m.lastgroup == "objstm":
+                    self._awaiting_stream = True
+                elif self._awaiting_stream:
+                    self._awaiting_stream = False
+                    if self._objstm is not None:
+                        # the previous object stream gets the bytes up to here first (they
+                        # may have arrived in this very chunk); if it is still open after
+                        # that, it was cut short
+                        self._feed_objstm(buf[: m.start()])
+                        self._end_objstm()
+                    if b"/FlateDecode" not in buf[self._object_start(buf, m.start()) : m.start()]:
+                        self._incomplete = True  # unfiltered or not zlib: not counted
+                        continue
+                    self._objstm = _ObjectStream(self._buf_start + m.end())
+                    self._feed_objstm(buf)
+            self._scanned = self._buf_start + limit
+
+        self._feed_objstm(buf)
+
+        # keep enough behind the scan position for object headers and cut tokens
+        keep_from = max(0, min(limit, len(buf)) - _LOOKBACK)
+        self._buf = buf[keep_from:]
+        self._buf_start += keep_from
+
+    @staticmethod
+    def _object_header(buf: bytes, pos: int):
+        """The last "N G obj" before `pos` (the object `pos` is in), if it is close enough."""
+        header = None
+        for header in _OBJ.finditer(buf, max(0, pos - _LOOKBACK), pos):
+            pass
+        return header
+
+    def _object_start(self, buf: bytes, pos: int) -> int:
+        header = self._object_header(buf, pos)
+        return header.start() if header is not None else max(0, pos - _LOOKBACK)
+
+    def _count_page(self, buf: bytes, pos: int) -> None:
+        header = self._object_header(buf, pos)
+        if header is None:
+            self._loose_pages += 1
+        else:
+            self._page_objects.add((header.group(1), header.group(2)))
+
+    def _feed_objstm(self, buf: bytes) -> None:
+        """Hand the open object stream whatever of its bytes arrived since the last call."""
+        if self._objstm is None:
+            return
+        offset = self._objstm.next_offset - self._buf_start
+        if offset < len(buf):
+            self._objstm.feed(buf[offset:], self.max_inflate - self._inflated)
+        if self._objstm.done:
+            self._end_objstm()
+
+    def _end_objstm(self) -> None:
+        objstm, self._objstm = self._objstm, None
+        if objstm is None:
+            return
+        self._inflated += objstm.inflated
+        self._compressed_pages += objstm.pages
+        if objstm.failed or not objstm.done:
+            self._incomplete = True
+
+
+def count_pdf_pages(data: bytes) -> Optional[int]:
+    counter = PdfPageCounter()
+    counter.feed(data)
+    return counter.finish()
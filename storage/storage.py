@@ -1,7 +1,8 @@
 # storage.py
 from __future__ import annotations
 
-from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Protocol, Union, Optional
 import io
@@ -9,14 +10,39 @@ import os
 import shutil
 import tempfile
 
-# S3 is optional until you use it
-try:
-    import boto3
-except Exception:  # pragma: no cover
-    boto3 = None
-
+from instrumentation import timed_call
+from resilience import CallPolicy, get_policy, status_reason
 
 StorageKey = str  # could be "local:/abs/path/file.pdf" or "s3://bucket/key.pdf" or just a plain path
+WriteItem = tuple[StorageKey, bytes, Optional[str]]  # (key, data, content_type)
+
+S3_DELETE_BATCH = 1000  # delete_objects limit per request
+
+# S3 error codes worth retrying; some of them come with a 400 status
+_S3_TRANSIENT_CODES = {
+    "RequestTimeout", "RequestTimeoutException", "SlowDown", "Throttling", "ThrottlingException",
+    "InternalError", "ServiceUnavailable",
+}
+
+
+def s3_retry_reason(exc: BaseException) -> Optional[str]:
+    """Transient S3 failures (see resilience.CallPolicy)."""
+    # only reached from S3Storage, so boto3 is already imported
+    from botocore.exceptions import ClientError, ConnectionError, HTTPClientError, IncompleteReadError
+    from s3transfer.exceptions import RetriesExceededError
+
+    if isinstance(exc, ClientError):
+        code = exc.response.get("Error", {}).get("Code")
+        if code in _S3_TRANSIENT_CODES:
+            return code
+        return status_reason(exc.response.get("ResponseMetadata", {}).get("HTTPStatusCode"))
+    if isinstance(exc, (ConnectionError, HTTPClientError, IncompleteReadError, RetriesExceededError)):
+        return "connection"
+    return None
+
+
+def _s3_policy() -> CallPolicy:
+    return get_policy("s3", s3_retry_reason)
 
 
 class StorageBackend(Protocol):
@@ -26,6 +52,14 @@ class StorageBackend(Protocol):
     def delete(self, key: StorageKey) -> None: ...
     def exists(self, key: StorageKey) -> bool: ...
 
+    def open_writer(self, key: StorageKey, content_type: Optional[str] = None) -> "StorageWriter":
+        """Incremental writer for large objects (uploads); nothing is visible under `key` until close()."""
+
+    # bulk variants: backends may run these concurrently / batched
+    def write_many(self, items: list[WriteItem]) -> None: ...
+    def read_many(self, keys: list[StorageKey]) -> list[bytes]: ...
+    def delete_many(self, keys: list[StorageKey]) -> None: ...
+
     def materialize_to_local(self, key: StorageKey, suffix: str = "") -> Path:
         """
         Ensure key is available as a local file path and return that path.
@@ -33,6 +67,112 @@ class StorageBackend(Protocol):
         """
 
 
+class StorageWriter(Protocol):
+    def write(self, chunk: bytes) -> None: ...
+    def close(self) -> None: ...
+    def abort(self) -> None: ...
+
+
+class _WriterContext:
+    # `with storage.open_writer(key) as w:` commits on success, aborts on error
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+class LocalFileWriter(_WriterContext):
+    """Chunked writes to a temp file next to the target, renamed into place on close()."""
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".part")
+        self._tmp = Path(tmp)
+        self._f = os.fdopen(fd, "wb")
+
+    def write(self, chunk: bytes) -> None:
+        self._f.write(chunk)
+
+    def close(self) -> None:
+        self._f.close()
+        os.replace(self._tmp, self.path)
+
+    def abort(self) -> None:
+        self._f.close()
+        self._tmp.unlink(missing_ok=True)
+
+
+class S3MultipartWriter(_WriterContext):
+    """
+    Streams to S3 with a multipart upload, holding at most one part in memory.
+    Objects smaller than one part are sent with a single put_object instead.
+    """
+
+    def __init__(self, s3, bucket: str, obj_key: str, content_type: Optional[str], part_size: int):
+        self.s3 = s3
+        self.bucket = bucket
+        self.obj_key = obj_key
+        self.extra = {"ContentType": content_type} if content_type else {}
+        self.part_size = max(part_size, 5 * 1024 * 1024)  # S3 minimum for all but the last part
+        self._buf = bytearray()
+        self._upload_id: Optional[str] = None
+        self._parts: list[dict] = []
+
+    def _upload_part(self, data: bytes) -> None:
+        if self._upload_id is None:
+            res = _s3_policy().call(
+                "create_multipart", self.s3.create_multipart_upload, Bucket=self.bucket, Key=self.obj_key, **self.extra
+            )
+            self._upload_id = res["UploadId"]
+        part_number = len(self._parts) + 1
+        with timed_call("s3", "put_part", sent_bytes=len(data)):
+            res = _s3_policy().call(
+                "put_part",
+                self.s3.upload_part,
+                Bucket=self.bucket, Key=self.obj_key, UploadId=self._upload_id, PartNumber=part_number, Body=data,
+            )
+        self._parts.append({"ETag": res["ETag"], "PartNumber": part_number})
+
+    def write(self, chunk: bytes) -> None:
+        self._buf += chunk
+        while len(self._buf) >= self.part_size:
+            self._upload_part(bytes(self._buf[: self.part_size]))
+            del self._buf[: self.part_size]
+
+    def close(self) -> None:
+        if self._upload_id is None:
+            with timed_call("s3", "put", sent_bytes=len(self._buf)):
+                _s3_policy().call(
+                    "put", self.s3.put_object, Bucket=self.bucket, Key=self.obj_key, Body=bytes(self._buf), **self.extra
+                )
+            return
+        if self._buf:
+            self._upload_part(bytes(self._buf))
+            self._buf.clear()
+        _s3_policy().call(
+            "complete_multipart",
+            self.s3.complete_multipart_upload,
+            Bucket=self.bucket,
+            Key=self.obj_key,
+            UploadId=self._upload_id,
+            MultipartUpload={"Parts": self._parts},
+        )
+
+    def abort(self) -> None:
+        self._buf.clear()
+        if self._upload_id is not None:
+            _s3_policy().call(
+                "abort_multipart", self.s3.abort_multipart_upload, Bucket=self.bucket, Key=self.obj_key, UploadId=self._upload_id
+            )
+            self._upload_id = None
+
+
 def is_s3_uri(key: str) -> bool:
     return key.startswith("s3://")
 
@@ -79,6 +219,20 @@ class LocalStorage(StorageBackend):
     def exists(self, key: StorageKey) -> bool:
         return self._resolve(key).exists()
 
+    def open_writer(self, key: StorageKey, content_type: Optional[str] = None) -> LocalFileWriter:
+        return LocalFileWriter(self._resolve(key))
+
+    def write_many(self, items: list[WriteItem]) -> None:
+        for key, data, content_type in items:
+            self.write_bytes(key, data, content_type=content_type)
+
+    def read_many(self, keys: list[StorageKey]) -> list[bytes]:
+        return [self.read_bytes(key) for key in keys]
+
+    def delete_many(self, keys: list[StorageKey]) -> None:
+        for key in keys:
+            self.delete(key)
+
     def materialize_to_local(self, key: StorageKey, suffix: str = "") -> Path:
         # already local
         return self._resolve(key)
@@ -88,39 +242,130 @@ class LocalStorage(StorageBackend):
 class S3Storage(StorageBackend):
     """
     key is expected as s3://bucket/path/to/file.ext
+
+    Bulk operations (write_many/read_many/delete_many) fan out over a thread
+    pool of `max_workers`; the boto3 connection pool is sized to match.
+    Objects above `multipart_threshold` go through the managed transfer
+    (multipart upload / ranged download).
     """
     region_name: Optional[str] = None
+    max_workers: int = field(default_factory=lambda: int(os.getenv("S3_MAX_WORKERS", "16")))
+    multipart_threshold: int = 8 * 1024 * 1024
 
     def __post_init__(self):
-        if boto3 is None:
+        # S3 is optional until you use it; importing boto3 lazily also keeps it
+        # (~150 ms, ~20 MB) out of processes that only use LocalStorage
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+            from botocore.config import Config as BotoConfig
+        except ImportError:  # pragma: no cover
             raise ImportError("boto3 not installed. `pip install boto3`")
-        self.s3 = boto3.client("s3", region_name=self.region_name)
+        self.s3 = boto3.client(
+            "s3",
+            region_name=self.region_name,
+            config=BotoConfig(
+                max_pool_connections=max(10, self.max_workers * 2),
+                retries={"mode": "standard", "max_attempts": 1},  # retried by _s3_policy()
+            ),
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=self.multipart_threshold,
+            multipart_chunksize=self.multipart_threshold,
+            max_concurrency=4,
+            use_threads=True,
+        )
+        self._executor: Optional[ThreadPoolExecutor] = None
         self._tmp_dir = Path(tempfile.mkdtemp(prefix="invoice_s3_"))
 
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="s3io")
+        return self._executor
+
     def read_bytes(self, key: StorageKey) -> bytes:
         bucket, obj_key = parse_s3_uri(key)
-        buf = io.BytesIO()
-        self.s3.download_fileobj(bucket, obj_key, buf)
-        return buf.getvalue()
+
+        def download() -> bytes:
+            buf = io.BytesIO()
+            self.s3.download_fileobj(bucket, obj_key, buf, Config=self.transfer_config)
+            return buf.getvalue()
+
+        with timed_call("s3", "get") as call:
+            data = _s3_policy().call("get", download)
+            call.received_bytes = len(data)
+        return data
 
     def write_bytes(self, key: StorageKey, data: bytes, content_type: Optional[str] = None) -> None:
         bucket, obj_key = parse_s3_uri(key)
         extra = {}
         if content_type:
             extra["ContentType"] = content_type
-        self.s3.put_object(Bucket=bucket, Key=obj_key, Body=data, **extra)
+        with timed_call("s3", "put", sent_bytes=len(data)):
+            if len(data) >= self.multipart_threshold:
+                # large PDFs: parallel multipart upload
+                _s3_policy().call(
+                    "put",
+                    lambda: self.s3.upload_fileobj(
+                        io.BytesIO(data), bucket, obj_key, ExtraArgs=extra, Config=self.transfer_config
+                    ),
+                )
+            else:
+                _s3_policy().call("put", self.s3.put_object, Bucket=bucket, Key=obj_key, Body=data, **extra)
+
+    def open_writer(self, key: StorageKey, content_type: Optional[str] = None) -> S3MultipartWriter:
+        bucket, obj_key = parse_s3_uri(key)
+        return S3MultipartWriter(self.s3, bucket, obj_key, content_type, part_size=self.multipart_threshold)
+
+    def write_many(self, items: list[WriteItem]) -> None:
+        futures = [self.executor.submit(self.write_bytes, key, data, content_type) for key, data, content_type in items]
+        for f in futures:
+            f.result()
+
+    def read_many(self, keys: list[StorageKey]) -> list[bytes]:
+        return list(self.executor.map(self.read_bytes, keys))
+
+    def delete_many(self, keys: list[StorageKey]) -> None:
+        by_bucket: dict[str, list[str]] = {}
+        for key in keys:
+            bucket, obj_key = parse_s3_uri(key)
+            by_bucket.setdefault(bucket, []).append(obj_key)
+
+        batches = [
+            (bucket, obj_keys[i : i + S3_DELETE_BATCH])
+            for bucket, obj_keys in by_bucket.items()
+            for i in range(0, len(obj_keys), S3_DELETE_BATCH)
+        ]
+
+        def delete_batch(bucket: str, obj_keys: list[str]) -> None:
+            with timed_call("s3", "delete_many"):
+                res = _s3_policy().call(
+                    "delete_many",
+                    self.s3.delete_objects,
+                    Bucket=bucket,
+                    Delete={"Objects": [{"Key": k} for k in obj_keys], "Quiet": True},
+                )
+            errors = res.get("Errors") or []
+            if errors:
+                raise RuntimeError(f"S3 delete_objects failed for {len(errors)} key(s) in {bucket}: {errors[:3]}")
+
+        futures = [self.executor.submit(delete_batch, bucket, obj_keys) for bucket, obj_keys in batches]
+        for f in futures:
+            f.result()
 
     def write_text(self, key: StorageKey, text: str, encoding: str = "utf-8") -> None:
         self.write_bytes(key, text.encode(encoding), content_type="text/plain; charset=utf-8")
 
     def delete(self, key: StorageKey) -> None:
         bucket, obj_key = parse_s3_uri(key)
-        self.s3.delete_object(Bucket=bucket, Key=obj_key)
+        with timed_call("s3", "delete"):
+            _s3_policy().call("delete", self.s3.delete_object, Bucket=bucket, Key=obj_key)
 
     def exists(self, key: StorageKey) -> bool:
         bucket, obj_key = parse_s3_uri(key)
         try:
-            self.s3.head_object(Bucket=bucket, Key=obj_key)
+            _s3_policy().call("head", self.s3.head_object, Bucket=bucket, Key=obj_key)
             return True
         except Exception:
             return False
@@ -133,10 +378,21 @@ class S3Storage(StorageBackend):
             filename = filename + suffix
         local_path = self._tmp_dir / filename
         local_path.parent.mkdir(parents=True, exist_ok=True)
-        with local_path.open("wb") as f:
-            self.s3.download_fileobj(bucket, obj_key, f)
+
+        def download() -> int:
+            with local_path.open("wb") as f:  # truncated again on every attempt
+                self.s3.download_fileobj(bucket, obj_key, f)
+                return f.tell()
+
+        with timed_call("s3", "get") as call:
+            call.received_bytes = _s3_policy().call("get", download)
         return local_path
 
     def cleanup_tmp(self) -> None:
         if self._tmp_dir.exists():
-            shutil.rmtree(self._tmp_dir, ignore_errors=True)
\ No newline at end of file
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
\ No newline at end of file
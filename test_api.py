@@ -1,4 +1,3 @@
-import time
 import requests
 import json
 import os
@@ -15,6 +14,9 @@ HEADERS = {
     "X-API-Key": API_KEY
 }
 
+# statuses of a job that is still on its way (jobs/dedup_index.py)
+ACTIVE_STATUSES = {"queued", "started", "deferred", "scheduled"}
+
 TEST_FILE = "3C_testdaten_pdf/230072869L_Splitt.pdf"   # <-- adjust path
 
 
@@ -51,11 +53,13 @@ def poll_job(job_id):
     print("🔄 Polling job status...")
 
     while True:
-        res = requests.get(f"{API_BASE}/job/{job_id}", headers=HEADERS)
+        # long-poll: the server answers as soon as the job reaches its next stage (or after 30s)
+        res = requests.get(f"{API_BASE}/job/{job_id}", params={"wait": 30}, headers=HEADERS, timeout=60)
         data = res.json()
 
         status = data["status"]
-        print(f"   → Status: {status}")
+        progress = data.get("progress") or {}
+        print(f"   → Status: {status} {progress.get('event', '')} {progress.get('data', '')}")
 
         if status == "finished":
             print("🎉 Job finished!")
@@ -69,7 +73,15 @@ def poll_job(job_id):
             print(data.get("error"))
             return
 
-        time.sleep(10)
+        if status == "not_found":
+            print("❓ Job not found")
+            return
+
+        if status not in ACTIVE_STATUSES:
+            # canceled, stopped, ...: the job won't move on, and the long-poll returns at once
+            print(f"⏹️  Job ended: {status}")
+            print(data.get("error"))
+            return
 
 
 if __name__ == "__main__":
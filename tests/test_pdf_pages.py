@@ -0,0 +1,92 @@
+import random
+import zlib
+from pathlib import Path
+
+import fitz
+import pytest
+
+from storage.pdf_pages import PdfPageCounter, count_pdf_pages
+
+# 1 MiB is the API's UPLOAD_CHUNK_SIZE
+CHUNK_SIZES = [512, 4096, 65536, 1024 * 1024]
+SYSTEM_PDF = Path("/usr/share/doc/shared-mime-info/shared-mime-info-spec.pdf")
+
+
+def _written_by_mupdf(pages: int, **save_options) -> bytes:
+    doc = fitz.open()
+    for number in range(1, pages + 1):
+        page = doc.new_page()
+        for line in range(40):
+            page.insert_text((50, 60 + 18 * line), f"Rechnung Seite {number}, Position {line}: Behandlung 42,00 EUR")
+    return doc.tobytes(garbage=3, deflate=True, **save_options)
+
+
+def _object_streams(pages: int, per_stream: int = 6, filler: int = 3000) -> bytes:
+    """
+    Page dictionaries spread over several compressed object streams, each big
+    enough (incompressible filler) to span chunk boundaries, so one stream's
+    data and the next one's header often arrive in the same chunk.
+    """
+    out = bytearray(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+    kids = " ".join(f"{3 + i} 0 R" for i in range(pages))
+    out += b"1 0 obj\n<< /Type /Catalog /Pages 2 0 R >>\nendobj\n"
+    out += f"2 0 obj\n<< /Type /Pages /Kids [{kids}] /Count {pages} >>\nendobj\n".encode()
+    number = 3 + pages
+    for start in range(0, pages, per_stream):
+        offsets, body = b"", b""
+        for i in range(start, min(start + per_stream, pages)):
+            offsets += f"{3 + i} {len(body)} ".encode()
+            filler_hex = random.Random(i).randbytes(filler).hex().encode()
+            body += b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /PieceInfo (" + filler_hex + b") >>\n"
+        data = zlib.compress(offsets + body)
+        count = min(per_stream, pages - start)
+        out += (
+            f"{number} 0 obj\n<< /Type /ObjStm /N {count} /First {len(offsets)} "
+            f"/Length {len(data)} /Filter /FlateDecode >>\nstream\n"
+        ).encode()
+        out += data + b"\nendstream\nendobj\n"
+        number += 1
+    out += b"trailer\n<< /Root 1 0 R >>\n%%EOF\n"
+    return bytes(out)
+
+
+def _padded(data: bytes, size: int = 1024 * 1024) -> bytes:
+    """A comment at the end pushes the file just past `size`."""
+    return data + b"%" + b" " * max(size - len(data), 0) + b"\n"
+
+
+def _system_pdf() -> bytes:
+    if not SYSTEM_PDF.exists():
+        pytest.skip(f"{SYSTEM_PDF} not installed")
+    return SYSTEM_PDF.read_bytes()
+
+
+DOCUMENTS = {
+    "plain": lambda: _written_by_mupdf(17),
+    "mupdf_object_streams": lambda: _written_by_mupdf(17, use_objstms=True),
+    "object_streams": lambda: _object_streams(17),
+    "object_streams_padded": lambda: _padded(_object_streams(17)),
+    "system_pdf": _system_pdf,
+    "system_pdf_padded": lambda: _padded(_system_pdf()),
+}
+
+
+def _fed(data: bytes, chunk_size: int):
+    counter = PdfPageCounter()
+    for start in range(0, len(data), chunk_size):
+        counter.feed(data[start : start + chunk_size])
+    return counter.finish()
+
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+@pytest.mark.parametrize("name", sorted(DOCUMENTS))
+def test_count_does_not_depend_on_chunk_boundaries(name, chunk_size):
+    data = DOCUMENTS[name]()
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        expected = len(doc)
+    assert count_pdf_pages(data) == expected
+    assert _fed(data, chunk_size) == expected
+
+
+def test_not_a_pdf():
+    assert _fed(b"\x89PNG\r\n\x1a\n" + b"\0" * 4096, 512) is None
@@ -1,4 +1,6 @@
 import base64
+import hashlib
+import os
 from PIL import Image
 import re
 import json 
@@ -6,6 +8,9 @@ import fitz  # PyMuPDF
 import tempfile
 import csv
 from PIL import Image
+from rendering.image_policy import ImagePolicy, estimate_image_tokens, render_page
+from rendering.image_policy import encode_image as encode_pil_image  # utils.encode_image is the base64 helper
+from rendering.rasterizer import fitz_lock
 
 
 def ensure_json_serializable(obj):
@@ -26,6 +31,14 @@ def extract_json_from_response(text):
     # Parse as JSON
     return json.loads(cleaned)
 
+def sha256_file(file_path, chunk_size: int = 1024 * 1024) -> str:
+    """Hex SHA-256 of a file's bytes, read in chunks so large PDFs stay out of memory."""
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
 def encode_image_to_base64(image_path):
     """
     Read an image file and encode it as a base64 string.
@@ -91,18 +104,46 @@ def resize_image_by_height(image_path, target_height=200):
     
     return resized_img
 
-def convert_file_to_images(file_path: str) -> list:
+def estimate_text_tokens(text: str) -> int:
+    """Rough prompt size for rate limiting (~4 characters per token)."""
+    return len(text) // 4 + 1
+
+def _write_temp_image(data: bytes, suffix: str) -> str:
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    return path
+
+def convert_file_to_images(file_path: str, policy: ImagePolicy | None = None) -> list:
+    """
+    Image paths to send to the vision model. PDFs are rendered page by page with
+    `policy`; images pass through unless they exceed the policy's size caps.
+    Without a policy the original behaviour (150 DPI PNG per PDF page) is kept.
+    Paths other than `file_path` are temporary files the caller deletes.
+    """
     images = []
 
-    if file_path.lower().endswith((".jpg", ".jpeg", ".png")):
-        images.append(file_path)
+    if file_path.lower().endswith((".jpg", ".jpeg", ".png", ".webp")):
+        if policy is None:
+            images.append(file_path)
+        else:
+            with Image.open(file_path) as img:
+                if policy.target_size(img.width, img.height) == (img.width, img.height):
+                    images.append(file_path)
+                else:
+                    encoded = encode_pil_image(img, policy)
+                    images.append(_write_temp_image(encoded.data, encoded.extension))
     elif file_path.lower().endswith(".pdf"):
-        with fitz.open(file_path) as doc:
-            for i, page in enumerate(doc):
-                pix = page.get_pixmap(dpi=150)
-                temp_img_path = tempfile.mktemp(suffix=f"_{i}.png")
-                pix.save(temp_img_path)
-                images.append(temp_img_path)
+        policy = policy or ImagePolicy(dpi=150)
+        try:
+            with fitz_lock, fitz.open(file_path) as doc:
+                for i, page in enumerate(doc):
+                    encoded = encode_pil_image(render_page(page, policy), policy)
+                    images.append(_write_temp_image(encoded.data, f"_{i}{encoded.extension}"))
+        except BaseException:
+            for path in images:
+                os.remove(path)
+            raise
     else:
         raise ValueError("Unsupported file format for direct vision input.")
 
@@ -0,0 +1,90 @@
+"""
+Measure the fixed per-job overhead of each RQ worker mode (see jobs/worker.py).
+
+For every mode, N `jobs.tasks.overhead_probe` jobs are queued on a scratch
+queue and drained by `python jobs/worker.py` in burst mode. The probe only does
+process_file's setup (imports in the job process, storage/OCR/OpenAI clients),
+so the spacing between consecutive job completions is the fixed cost every real
+job pays before touching a document: dequeue, fork, imports, client setup,
+result bookkeeping.
+
+With --io-seconds every probe also waits that long, like a job waiting on
+LandingAI/OpenAI/S3: the spacing is then the throughput of one worker on an
+I/O-bound load. The threaded mode runs WORKER_CONCURRENCY probes at once, so
+its spacing is divided by about that much.
+
+    REDIS_URL=redis://localhost:6379/0 python worker_overhead_report.py --jobs 20
+    REDIS_URL=redis://localhost:6379/0 python worker_overhead_report.py --jobs 40 --io-seconds 2 --modes warm threaded
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+from redis import Redis
+from rq import Queue
+
+MODES = ["fork", "preload", "warm", "threaded"]
+
+
+def measure(mode: str, n_jobs: int, redis_conn: Redis, io_seconds: float = 0.0) -> dict:
+    queue_name = f"overhead-report-{mode}-{uuid.uuid4().hex[:8]}"
+    queue = Queue(queue_name, connection=redis_conn)
+    jobs = [queue.enqueue("jobs.tasks.overhead_probe", io_seconds, result_ttl=600) for _ in range(n_jobs)]
+
+    env = dict(os.environ, WORKER_MODE=mode, WORKER_BURST="1", RQ_QUEUE_NAME=queue_name)
+    # the probe builds clients but never calls them; placeholders are enough when no real keys are set
+    env.setdefault("OPENAI_API_KEY", "overhead-report")
+    env.setdefault("VISION_AGENT_API_KEY", "overhead-report")
+
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "jobs/worker.py"], env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wall = time.perf_counter() - start
+
+    for job in jobs:
+        job.refresh()
+    failed = [job.id for job in jobs if job.get_status() != "finished"]
+    if failed:
+        raise RuntimeError(f"{mode}: {len(failed)} probe jobs did not finish")
+
+    ended = sorted(job.ended_at.timestamp() for job in jobs)
+    # mean spacing, not the median gap: a threaded worker finishes jobs in bursts
+    spacing = (ended[-1] - ended[0]) / (len(ended) - 1)
+    setups = [job.return_value()["setup_seconds"] for job in jobs]
+    queue.delete(delete_jobs=True)
+    return {
+        "mode": mode,
+        "per_job_ms": spacing * 1000,
+        "setup_ms": statistics.median(setups) * 1000,
+        "first_setup_ms": setups[0] * 1000,
+        "processes": len({job.return_value()["pid"] for job in jobs}),
+        "wall_s": wall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-job fixed overhead of each RQ worker mode")
+    parser.add_argument("--jobs", type=int, default=20)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--io-seconds", type=float, default=0.0, help="simulated external-call wait per job")
+    args = parser.parse_args()
+
+    redis_conn = Redis.from_url(os.environ["REDIS_URL"])
+    rows = [measure(mode, args.jobs, redis_conn, args.io_seconds) for mode in args.modes]
+
+    print(f"{'mode':<8} {'per job':>10} {'setup/job':>10} {'1st setup':>10} {'procs':>6} {'wall':>8}")
+    for r in rows:
+        print(f"{r['mode']:<8} {r['per_job_ms']:>8.0f}ms {r['setup_ms']:>8.1f}ms "
+              f"{r['first_setup_ms']:>8.1f}ms {r['processes']:>6} {r['wall_s']:>7.1f}s")
+    baseline = rows[0]["per_job_ms"] if rows[0]["mode"] == "fork" else None
+    if baseline:
+        for r in rows[1:]:
+            print(f"{r['mode']}: {baseline - r['per_job_ms']:.0f}ms less fixed overhead per job than fork")
+
+
+if __name__ == "__main__":
+    main()